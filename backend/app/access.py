@@ -0,0 +1,149 @@
+"""
+Buffered tracking of clipboard accesses.
+
+Reads record a touch in memory instead of committing `last_accessed` on
+every lookup. A background thread flushes pending touches every
+ACCESS_FLUSH_INTERVAL seconds with batched `UPDATE ... WHERE id IN (...)`
+statements. Stored timestamps are rounded down to ACCESS_RESOLUTION seconds,
+which bounds how far `last_accessed` may lag behind the real last access
+(plus at most one flush interval until it becomes visible).
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import or_, update
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes; 0 writes every touch through immediately
+ACCESS_FLUSH_INTERVAL = float(os.getenv("ACCESS_FLUSH_INTERVAL", "30"))
+# Accuracy bound, in seconds, of the stored last_accessed values
+ACCESS_RESOLUTION = float(os.getenv("ACCESS_RESOLUTION", "60"))
+# Flush early once this many clipboards have pending touches
+ACCESS_MAX_PENDING = int(os.getenv("ACCESS_MAX_PENDING", "10000"))
+# Clipboard IDs per UPDATE statement
+ACCESS_FLUSH_BATCH_SIZE = 500
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class AccessTracker:
+    """Collects clipboard touches and writes them to the database in batches"""
+
+    def __init__(
+        self,
+        flush_interval: float = ACCESS_FLUSH_INTERVAL,
+        resolution: float = ACCESS_RESOLUTION,
+        max_pending: int = ACCESS_MAX_PENDING,
+    ):
+        self.flush_interval = flush_interval
+        self.resolution = max(resolution, 1.0)
+        self.max_pending = max_pending
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def touch(self, clipboard_id: str) -> None:
+        """Record that a clipboard was accessed now"""
+        with self._lock:
+            self._pending[clipboard_id] = datetime.utcnow()
+            pending = len(self._pending)
+
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+
+        self._ensure_started()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Write all pending touches to the database.
+        Returns the number of clipboards whose touches were flushed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            if not pending:
+                return 0
+
+            try:
+                self._write(pending)
+            except Exception:
+                logger.exception("Failed to flush %d clipboard access(es)", len(pending))
+                # Put the touches back, keeping any newer ones recorded meanwhile
+                with self._lock:
+                    for clipboard_id, accessed in pending.items():
+                        current = self._pending.get(clipboard_id)
+                        if current is None or current < accessed:
+                            self._pending[clipboard_id] = accessed
+                return 0
+
+            return len(pending)
+
+    def close(self) -> None:
+        """Stop the background thread and flush what is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _write(self, pending: Dict[str, datetime]) -> None:
+        # Group touches by their rounded timestamp so each group is one UPDATE
+        buckets: Dict[datetime, List[str]] = {}
+        for clipboard_id, accessed in pending.items():
+            buckets.setdefault(self._round(accessed), []).append(clipboard_id)
+
+        clipboard = database.Clipboard
+        with database.engine.begin() as conn:
+            for accessed, clipboard_ids in buckets.items():
+                for start in range(0, len(clipboard_ids), ACCESS_FLUSH_BATCH_SIZE):
+                    batch = clipboard_ids[start : start + ACCESS_FLUSH_BATCH_SIZE]
+                    conn.execute(
+                        update(clipboard)
+                        .where(clipboard.id.in_(batch))
+                        .where(
+                            or_(
+                                clipboard.last_accessed.is_(None),
+                                clipboard.last_accessed < accessed,
+                            )
+                        )
+                        # Pin updated_at, which only tracks content changes
+                        .values(last_accessed=accessed, updated_at=clipboard.updated_at)
+                    )
+
+    def _round(self, accessed: datetime) -> datetime:
+        seconds = (accessed - _EPOCH).total_seconds()
+        return _EPOCH + timedelta(seconds=seconds // self.resolution * self.resolution)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="access-tracker", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+tracker = AccessTracker()
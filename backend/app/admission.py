@@ -0,0 +1,365 @@
+"""
+Rate limiting and admission control.
+
+`AdmissionMiddleware` runs before routing and turns requests away early,
+with a `Retry-After` header, rather than letting them queue for the
+database pool until they time out:
+
+- Token buckets limit writes (RATE_LIMIT_METHODS) per client IP and per
+  clipboard: each key refills at RATE_LIMIT_*_RATE requests per second up
+  to RATE_LIMIT_*_BURST. A request takes a token from each of its buckets,
+  or from none of them when one is empty; that answers 429.
+- A concurrency limit admits at most ADMISSION_MAX_CONCURRENT requests of
+  a worker at a time. Up to ADMISSION_MAX_QUEUE more wait for a slot, for
+  at most ADMISSION_QUEUE_TIMEOUT seconds; beyond that the answer is 503.
+  While recent pool checkouts waited longer than ADMISSION_MAX_POOL_WAIT
+  seconds on average, new requests get 503 straight away.
+
+Bucket backends:
+- memory (default): per-process buckets, so each worker enforces the
+  limits on its own share of the traffic
+- redis: buckets shared by all workers through a Redis-protocol server
+  (requires the `redis` package)
+- none: no rate limits
+
+Health checks, /metrics and event streams are never limited; streams stay
+open for long, and would hold a concurrency slot each.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Requests per second and burst size per client IP, and per clipboard;
+# a rate of 0 disables the limit
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "10"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "50"))
+RATE_LIMIT_CLIPBOARD_RATE = float(os.getenv("RATE_LIMIT_CLIPBOARD_RATE", "20"))
+RATE_LIMIT_CLIPBOARD_BURST = float(os.getenv("RATE_LIMIT_CLIPBOARD_BURST", "100"))
+RATE_LIMIT_METHODS = frozenset(
+    method.strip().upper()
+    for method in os.getenv("RATE_LIMIT_METHODS", "POST,PUT,PATCH,DELETE").split(",")
+    if method.strip()
+)
+# Take the client IP from X-Forwarded-For; only behind a proxy that sets it
+RATE_LIMIT_TRUST_FORWARDED = os.getenv(
+    "RATE_LIMIT_TRUST_FORWARDED", "false"
+).lower() in ("1", "true", "yes")
+# Trusted proxies in front of the app, each appending to X-Forwarded-For;
+# the client IP is the entry the outermost one added, counted from the right
+RATE_LIMIT_FORWARDED_HOPS = max(1, int(os.getenv("RATE_LIMIT_FORWARDED_HOPS", "1")))
+# Buckets kept by the memory backend; the least recently used go first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_KEY_PREFIX = "clipboard:ratelimit:"
+
+# Requests handled at once per worker; 0 disables the concurrency limit
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "128"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+# Average pool checkout wait, in seconds, above which requests are shed;
+# 0 disables the check
+ADMISSION_MAX_POOL_WAIT = float(os.getenv("ADMISSION_MAX_POOL_WAIT", "1"))
+# Checkout waits older than this many seconds no longer count
+ADMISSION_POOL_WAIT_WINDOW = 5.0
+# Retry-After, in seconds, of 503 responses
+ADMISSION_RETRY_AFTER = 1
+
+EXEMPT_PATHS = frozenset(("/", "/health", "/metrics"))
+EXEMPT_SUFFIXES = ("/stream",)
+
+_CLIPBOARD_PATH = re.compile(r"^/clipboard/([^/]+)")
+
+# (key, rate, burst) of a token bucket
+Bucket = Tuple[str, float, float]
+
+
+class MemoryRateLimitBackend:
+    """Per-process token buckets, evicted least recently used first"""
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, buckets: List[Bucket]) -> Tuple[int, float]:
+        """
+        Take a token from every bucket, or from none if one is empty.
+        Returns (-1, 0), or the index of the first empty bucket and the
+        seconds until it has a token.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, updated_at = self._buckets.pop(key, (burst, now))
+                levels.append(min(burst, tokens + (now - updated_at) * rate))
+            empty = next(
+                (index for index, tokens in enumerate(levels) if tokens < 1), -1
+            )
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - 1 if empty < 0 else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if empty < 0:
+            return -1, 0.0
+        return empty, (1 - levels[empty]) / buckets[empty][1]
+
+
+# Refill every bucket, then take a token from each unless one is empty, all
+# atomically. ARGV holds the time, then rate and burst per key. Returns the
+# index (1-based, 0 if none) of the first empty bucket and the wait, as a
+# string since Redis truncates Lua numbers to integers
+_REDIS_ACQUIRE = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local empty = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local burst = tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'at')
+    local tokens = tonumber(bucket[1]) or burst
+    local at = tonumber(bucket[2]) or now
+    levels[i] = math.min(burst, tokens + math.max(0, now - at) * rate)
+    if empty == 0 and levels[i] < 1 then
+        empty = i
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local burst = tonumber(ARGV[2 * i + 1])
+    local tokens = levels[i]
+    if empty == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'at', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+if empty == 0 then
+    return {0, '0'}
+end
+local rate = tonumber(ARGV[2 * empty])
+return {empty, tostring((1 - levels[empty]) / rate)}
+"""
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared through a Redis-protocol server"""
+
+    name = "redis"
+    blocking = True
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "RATE_LIMIT_BACKEND=redis requires the redis package "
+                "(pip install redis)"
+            ) from e
+        client = redis.Redis.from_url(url)
+        self._acquire = client.register_script(_REDIS_ACQUIRE)
+
+    def acquire(self, buckets: List[Bucket]) -> Tuple[int, float]:
+        # Wall clock time, since the buckets are shared between hosts
+        args = [time.time()]
+        for _, rate, burst in buckets:
+            args.extend((rate, burst))
+        empty, wait = self._acquire(
+            keys=[RATE_LIMIT_KEY_PREFIX + key for key, _, _ in buckets], args=args
+        )
+        return int(empty) - 1, float(wait)
+
+
+def _create_backend():
+    if RATE_LIMIT_BACKEND == "none":
+        return None
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimitBackend(RATE_LIMIT_REDIS_URL)
+    if RATE_LIMIT_BACKEND == "memory":
+        return MemoryRateLimitBackend(RATE_LIMIT_MAX_KEYS)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{RATE_LIMIT_BACKEND}'")
+
+
+class ConcurrencyLimiter:
+    """Bounds the requests a worker handles at once, and the queue before it"""
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        max_pool_wait: float = ADMISSION_MAX_POOL_WAIT,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_pool_wait = max_pool_wait
+        self.waiting = 0
+        # Created on first use, inside the worker's event loop
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _pool_saturated(self) -> bool:
+        if self.max_pool_wait <= 0:
+            return False
+        return any(
+            stats.recent_wait(ADMISSION_POOL_WAIT_WINDOW) > self.max_pool_wait
+            for stats in metrics.pool_stats.values()
+        )
+
+    async def acquire(self) -> Optional[str]:
+        """
+        Wait for a slot. Returns None once admitted (call release() when
+        done), or the reason the request is turned away.
+        """
+        if self._pool_saturated():
+            return "pool_wait"
+        if self.max_concurrent <= 0:
+            return None
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return None
+        if self.waiting >= self.max_queue:
+            return "queue_full"
+
+        self.waiting += 1
+        metrics.http_requests_queued.inc()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        finally:
+            self.waiting -= 1
+            metrics.http_requests_queued.dec()
+        return None
+
+    def release(self) -> None:
+        if self.max_concurrent > 0:
+            self._slots.release()
+
+
+def client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        # Entries left of those our proxies appended are whatever the client
+        # sent, so they can't identify it
+        forwarded = [
+            entry.strip()
+            for name, value in scope["headers"]
+            if name == b"x-forwarded-for"
+            for entry in value.decode("latin-1").split(",")
+            if entry.strip()
+        ]
+        if forwarded:
+            return forwarded[-min(RATE_LIMIT_FORWARDED_HOPS, len(forwarded))]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _rejection(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware:
+    """Applies the rate limits, then the concurrency limit, to each request"""
+
+    def __init__(self, app, limiter: Optional[ConcurrencyLimiter] = None):
+        self.app = app
+        self.backend = _create_backend()
+        self.limiter = limiter or ConcurrencyLimiter()
+
+    def _buckets(self, scope) -> List[Bucket]:
+        """The buckets the request draws from"""
+        buckets: List[Bucket] = []
+        if scope["method"] not in RATE_LIMIT_METHODS:
+            return buckets
+        if RATE_LIMIT_IP_RATE > 0:
+            buckets.append(
+                (f"ip:{client_ip(scope)}", RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)
+            )
+        match = _CLIPBOARD_PATH.match(scope["path"])
+        if RATE_LIMIT_CLIPBOARD_RATE > 0 and match and match.group(1) != "new":
+            buckets.append(
+                (
+                    f"clipboard:{match.group(1)}",
+                    RATE_LIMIT_CLIPBOARD_RATE,
+                    RATE_LIMIT_CLIPBOARD_BURST,
+                )
+            )
+        return buckets
+
+    async def _rate_limited(self, scope) -> Optional[Tuple[str, float]]:
+        """The exhausted bucket's kind and wait in seconds, if any"""
+        if self.backend is None:
+            return None
+        buckets = self._buckets(scope)
+        if not buckets:
+            return None
+        try:
+            if self.backend.blocking:
+                empty, wait = await run_in_threadpool(self.backend.acquire, buckets)
+            else:
+                empty, wait = self.backend.acquire(buckets)
+        except Exception:
+            # An unreachable limiter must not take the API down with it
+            logger.exception("Rate limit backend failed; request let through")
+            return None
+        if empty < 0:
+            return None
+        return buckets[empty][0].partition(":")[0], wait
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "OPTIONS"
+            or path in EXEMPT_PATHS
+            or path.endswith(EXEMPT_SUFFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        limited = await self._rate_limited(scope)
+        if limited is not None:
+            kind, wait = limited
+            metrics.http_requests_rejected.inc(kind)
+            response = _rejection(429, f"Too many requests for this {kind}", wait)
+            await response(scope, receive, send)
+            return
+
+        reason = await self.limiter.acquire()
+        if reason is not None:
+            metrics.http_requests_rejected.inc(reason)
+            response = _rejection(
+                503, "Server is busy, please retry", ADMISSION_RETRY_AFTER
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
@@ -0,0 +1,402 @@
+"""
+Cold storage for idle clipboards.
+
+Clipboards not accessed for a number of days can be archived instead of
+deleted: each one, with its cards and the metadata of their attachments,
+becomes a single row of the `archived_clipboards` table holding a
+zlib-compressed JSON payload. Its cards, blob references, change log and
+search index entries leave the hot tables, which stay small; attachment
+files stay where they are in the blob store.
+
+Archival works in batches of clipboards, one transaction per batch, like
+the cleanup jobs. Reading an archived clipboard (see crud.get_clipboard)
+rehydrates it: the rows are restored in one transaction and the archive
+row is dropped. Restored cards get new IDs, so the clipboard's version is
+bumped and its change log floor raised: clients refetch it in full.
+
+Archived clipboards are kept until purge_old_archived deletes them, which
+only runs when asked to (cleanup.py --purge-archive, or the scheduler with
+CLEANUP_ARCHIVE_RETENTION_DAYS set), with a cutoff of its own: the cleanup
+of old live clipboards never touches the archive.
+"""
+
+import json
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import delete, exc, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import database, metrics, search
+
+# zlib level of archived payloads; archives are written once and read rarely
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "9"))
+
+
+def _idle_filter(days):
+    cutoff_date = datetime.utcnow() - timedelta(days=days)
+    return database.Clipboard.last_accessed < cutoff_date
+
+
+def _timestamp(value):
+    return value.isoformat() if value is not None else None
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _payloads(db: Session, clipboard_ids: List[str]) -> Dict[str, Dict]:
+    """Cards of clipboards, with their attachments, as JSON-ready dicts"""
+    card, blob = database.Card, database.CardBlob
+    payloads: Dict[str, Dict] = {
+        clipboard_id: {"cards": []} for clipboard_id in clipboard_ids
+    }
+    cards_by_id = {}
+
+    rows = db.execute(
+        select(
+            card.id,
+            card.clipboard_id,
+            card.user_name,
+            card.version,
+            card.created_at,
+            card.updated_at,
+            card.legacy_content,
+            blob.content.label("blob_content"),
+        )
+        .outerjoin(blob, blob.hash == card.content_hash)
+        .where(card.clipboard_id.in_(clipboard_ids))
+        .order_by(card.created_at, card.id)
+    )
+    for row in rows:
+        content = row.blob_content
+        if content is None:
+            content = row.legacy_content or ""
+        entry = {
+            "content": content,
+            "user_name": row.user_name,
+            "version": row.version,
+            "created_at": _timestamp(row.created_at),
+            "updated_at": _timestamp(row.updated_at),
+            "attachments": [],
+        }
+        payloads[row.clipboard_id]["cards"].append(entry)
+        cards_by_id[row.id] = entry
+
+    attachment = database.Attachment
+    for row in db.execute(
+        select(attachment).where(attachment.clipboard_id.in_(clipboard_ids))
+    ).scalars():
+        cards_by_id[row.card_id]["attachments"].append(
+            {
+                "filename": row.filename,
+                "content_type": row.content_type,
+                "size": row.size,
+                "sha256": row.sha256,
+                "storage_key": row.storage_key,
+                "created_at": _timestamp(row.created_at),
+            }
+        )
+
+    return payloads
+
+
+def archive_clipboards(db: Session, clipboard_ids: List[str], days=None) -> int:
+    """
+    Move clipboards into the archive, if they are still idle for `days`
+    when given. The caller commits. Returns the number archived.
+    """
+    if not clipboard_ids:
+        return 0
+    clipboard = database.Clipboard
+
+    # A write first: it locks the rows (PostgreSQL) or the database (SQLite)
+    # against card writes until commit, so none can slip past the copy
+    condition = clipboard.id.in_(clipboard_ids)
+    if days is not None:
+        condition = condition & _idle_filter(days)
+    db.execute(
+        update(clipboard)
+        .where(condition)
+        .values(
+            version=clipboard.version,
+            updated_at=clipboard.updated_at,
+            last_accessed=clipboard.last_accessed,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    clipboards = db.execute(
+        select(
+            clipboard.id,
+            clipboard.created_at,
+            clipboard.updated_at,
+            clipboard.last_accessed,
+            clipboard.version,
+        ).where(condition)
+    ).all()
+    if not clipboards:
+        return 0
+    clipboard_ids = [row.id for row in clipboards]
+    payloads = _payloads(db, clipboard_ids)
+
+    archived_at = datetime.utcnow()
+    rows = []
+    for row in clipboards:
+        payload = json.dumps(payloads[row.id], separators=(",", ":")).encode()
+        rows.append(
+            {
+                "id": row.id,
+                "created_at": row.created_at,
+                "updated_at": row.updated_at,
+                "last_accessed": row.last_accessed,
+                "version": row.version,
+                "archived_at": archived_at,
+                "card_count": len(payloads[row.id]["cards"]),
+                "size": len(payload),
+                "payload": zlib.compress(payload, ARCHIVE_COMPRESSION_LEVEL),
+            }
+        )
+    db.execute(insert(database.ArchivedClipboard), rows)
+
+    # The attachment files now belong to the archive: drop the rows only, so
+    # that delete_clipboards doesn't remove the files
+    db.execute(
+        delete(database.Attachment)
+        .where(database.Attachment.clipboard_id.in_(clipboard_ids))
+        .execution_options(synchronize_session=False)
+    )
+    return database.delete_clipboards(db, clipboard_ids)
+
+
+def archive_idle_clipboards(
+    db: Session,
+    days: int,
+    batch_size: int = database.CLEANUP_BATCH_SIZE,
+    time_budget=None,
+) -> int:
+    """
+    Archive clipboards that haven't been accessed in the specified number
+    of days. Works in chunks of `batch_size`, one transaction per chunk,
+    and stops after `time_budget` seconds if given.
+    Returns the number of clipboards archived.
+    """
+    from .access import tracker
+    from .cache import response_cache
+
+    # Make buffered accesses visible before judging what is idle
+    tracker.flush()
+
+    deadline = time.monotonic() + time_budget if time_budget else None
+    total = 0
+
+    while True:
+        clipboard_ids = list(
+            db.scalars(
+                select(database.Clipboard.id)
+                .where(_idle_filter(days))
+                .limit(batch_size)
+            )
+        )
+        if not clipboard_ids:
+            break
+
+        total += archive_clipboards(db, clipboard_ids, days)
+        db.commit()
+        for clipboard_id in clipboard_ids:
+            response_cache.invalidate(clipboard_id)
+
+        if len(clipboard_ids) < batch_size:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+
+    metrics.archive_events.inc("archived", amount=total)
+    return total
+
+
+def count_idle_clipboards(db: Session, days: int) -> int:
+    """Number of clipboards archive_idle_clipboards would archive"""
+    from .access import tracker
+
+    tracker.flush()
+
+    return db.scalar(
+        select(func.count()).select_from(database.Clipboard).where(_idle_filter(days))
+    )
+
+
+def rehydrate_clipboard(db: Session, clipboard_id: str) -> bool:
+    """
+    Restore an archived clipboard into the hot tables and commit. Returns
+    whether the clipboard exists now; False if it was never archived.
+    """
+    archived = db.get(database.ArchivedClipboard, clipboard_id)
+    if archived is None:
+        return False
+    payload = json.loads(zlib.decompress(archived.payload))
+
+    # New card IDs: clients must not apply deltas against the old ones
+    version = archived.version + 1
+    try:
+        db.execute(
+            insert(database.Clipboard).values(
+                id=clipboard_id,
+                created_at=archived.created_at,
+                updated_at=archived.updated_at,
+                last_accessed=datetime.utcnow(),
+                version=version,
+                log_floor=version,
+            )
+        )
+    except exc.IntegrityError:
+        # Restored by another request in the meantime
+        db.rollback()
+        return True
+
+    cards = payload["cards"]
+    hashes = database.acquire_blobs(db, [entry["content"] for entry in cards])
+    restored = [
+        database.Card(
+            clipboard_id=clipboard_id,
+            content_hash=content_hash,
+            user_name=entry["user_name"],
+            version=entry["version"],
+            created_at=_parse_timestamp(entry["created_at"]),
+            updated_at=_parse_timestamp(entry["updated_at"]),
+        )
+        for entry, content_hash in zip(cards, hashes)
+    ]
+    db.add_all(restored)
+    db.flush()
+
+    db.add_all(
+        database.Attachment(
+            card_id=card.id,
+            clipboard_id=clipboard_id,
+            filename=attachment["filename"],
+            content_type=attachment["content_type"],
+            size=attachment["size"],
+            sha256=attachment["sha256"],
+            storage_key=attachment["storage_key"],
+            created_at=_parse_timestamp(attachment["created_at"]),
+        )
+        for entry, card in zip(cards, restored)
+        for attachment in entry["attachments"]
+    )
+    search.index_cards(
+        db,
+        [
+            (card.id, clipboard_id, entry["content"])
+            for entry, card in zip(cards, restored)
+        ],
+    )
+    db.execute(
+        delete(database.ArchivedClipboard).where(
+            database.ArchivedClipboard.id == clipboard_id
+        )
+    )
+    db.commit()
+
+    metrics.archive_events.inc("rehydrated")
+    return True
+
+
+def delete_archived(db: Session, clipboard_ids: List[str]) -> int:
+    """
+    Delete archived clipboards and, once the transaction commits, their
+    attachment files. The caller commits. Returns the number deleted.
+    """
+    if not clipboard_ids:
+        return 0
+    archived = database.ArchivedClipboard
+
+    keys = []
+    for payload in db.scalars(
+        select(archived.payload).where(archived.id.in_(clipboard_ids))
+    ):
+        cards = json.loads(zlib.decompress(payload))["cards"]
+        keys.extend(
+            attachment["storage_key"]
+            for entry in cards
+            for attachment in entry["attachments"]
+        )
+    database.purge_blobs_after_commit(db, keys)
+
+    return db.execute(
+        delete(archived)
+        .where(archived.id.in_(clipboard_ids))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def purge_old_archived(
+    db: Session,
+    days: int,
+    batch_size: int = database.CLEANUP_BATCH_SIZE,
+    time_budget=None,
+) -> int:
+    """
+    Delete archived clipboards not accessed in the specified number of days,
+    in chunks of `batch_size`, stopping after `time_budget` seconds if given.
+    Returns the number deleted.
+    """
+    archived = database.ArchivedClipboard
+    cutoff_date = datetime.utcnow() - timedelta(days=days)
+    deadline = time.monotonic() + time_budget if time_budget else None
+    total = 0
+
+    while True:
+        clipboard_ids = list(
+            db.scalars(
+                select(archived.id)
+                .where(archived.last_accessed < cutoff_date)
+                .limit(batch_size)
+            )
+        )
+        if not clipboard_ids:
+            break
+
+        total += delete_archived(db, clipboard_ids)
+        db.commit()
+
+        if len(clipboard_ids) < batch_size:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+
+    metrics.cleanup_deleted.inc("archive", amount=total)
+    return total
+
+
+def count_old_archived(db: Session, days: int) -> int:
+    archived = database.ArchivedClipboard
+    cutoff_date = datetime.utcnow() - timedelta(days=days)
+    return db.scalar(
+        select(func.count())
+        .select_from(archived)
+        .where(archived.last_accessed < cutoff_date)
+    )
+
+
+def archive_stats(db: Session) -> Dict:
+    """Size of the archive"""
+    archived = database.ArchivedClipboard
+    clipboards, cards, size, stored = db.execute(
+        select(
+            func.count(archived.id),
+            func.coalesce(func.sum(archived.card_count), 0),
+            func.coalesce(func.sum(archived.size), 0),
+            func.coalesce(func.sum(func.length(archived.payload)), 0),
+        )
+    ).one()
+    return {
+        "archived_clipboards": clipboards,
+        "archived_cards": cards,
+        "archived_bytes": size,
+        "archived_stored_bytes": stored,
+    }
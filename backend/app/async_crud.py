@@ -0,0 +1,103 @@
+"""
+Async counterparts of the functions in crud.py, used when ASYNC_DB is set.
+
+Reads are native async queries. Writes run the sync crud functions on the
+async connection through `AsyncSession.run_sync`, so version bumps, the
+change log and stream events stay defined in one place while the database
+IO itself never blocks the event loop.
+"""
+
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import archive, crud, database, schemas
+from .access import tracker
+from .text_delta import DeltaOp
+
+
+async def _rehydrate(db: AsyncSession, clipboard_id: str) -> bool:
+    return await db.run_sync(archive.rehydrate_clipboard, clipboard_id)
+
+
+async def create_clipboard(db: AsyncSession) -> schemas.ClipboardIDResponse:
+    """Create a new clipboard with a unique ID"""
+    clipboard = await db.run_sync(crud.create_clipboard)
+    return schemas.ClipboardIDResponse(id=clipboard.id)
+
+
+async def get_clipboard(
+    db: AsyncSession, clipboard_id: str, with_cards: bool = False
+) -> Optional[database.Clipboard]:
+    """
+    Get a clipboard by ID and record the access for last_accessed. An
+    archived clipboard is rehydrated first. Cards are only loaded when
+    `with_cards` is set; lazy loads are not available on async sessions.
+    """
+    query = select(database.Clipboard).where(database.Clipboard.id == clipboard_id)
+    if with_cards:
+        query = query.options(selectinload(database.Clipboard.cards))
+
+    clipboard = (await db.execute(query)).scalar_one_or_none()
+    if clipboard is None and await _rehydrate(db, clipboard_id):
+        clipboard = (await db.execute(query)).scalar_one_or_none()
+
+    if clipboard:
+        tracker.touch(clipboard_id)
+
+    return clipboard
+
+
+async def get_clipboard_version(db: AsyncSession, clipboard_id: str) -> Optional[int]:
+    """Version of a clipboard, recording the access; None if it doesn't exist"""
+    version = await db.scalar(crud.clipboard_version_query(clipboard_id))
+    if version is not None:
+        tracker.touch(clipboard_id)
+    return version
+
+
+async def get_clipboard_json(
+    db: AsyncSession, clipboard_id: str
+) -> Optional[Tuple[int, bytes]]:
+    """(version, JSON body) of a clipboard from one query; see crud.py"""
+    query = crud.clipboard_rows_query(clipboard_id)
+    rows = (await db.execute(query)).all()
+    if not rows and await _rehydrate(db, clipboard_id):
+        rows = (await db.execute(query)).all()
+    if not rows:
+        return None
+    tracker.touch(clipboard_id)
+    return crud.encode_clipboard_rows(rows)
+
+
+async def create_card(
+    db: AsyncSession, clipboard_id: str, content: str, user_name: Optional[str] = None
+) -> Optional[database.Card]:
+    """Create a new card in a clipboard"""
+    return await db.run_sync(crud.create_card, clipboard_id, content, user_name)
+
+
+async def update_card(
+    db: AsyncSession, card_id: int, content: str
+) -> Optional[database.Card]:
+    """Update a card's content"""
+    return await db.run_sync(crud.update_card, card_id, content)
+
+
+async def patch_card(
+    db: AsyncSession, card_id: int, base_version: int, ops: List[DeltaOp]
+) -> Optional[database.Card]:
+    """Apply a text delta to a card's content"""
+    return await db.run_sync(crud.patch_card, card_id, base_version, ops)
+
+
+async def delete_card(db: AsyncSession, card_id: int) -> bool:
+    """Delete a card"""
+    return await db.run_sync(crud.delete_card, card_id)
+
+
+async def delete_clipboard(db: AsyncSession, clipboard_id: str) -> bool:
+    """Delete a clipboard and all its cards"""
+    return await db.run_sync(crud.delete_clipboard, clipboard_id)
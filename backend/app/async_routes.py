@@ -0,0 +1,190 @@
+"""
+Async versions of the core clipboard and card routes.
+
+Included ahead of the sync routes in main.py when ASYNC_DB is set, so they
+take precedence for the same paths. They are left out of the OpenAPI schema
+because their contract is identical to the sync routes.
+"""
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import async_crud, crud, database, schemas
+from .access import tracker
+from .cache import response_cache
+from .etags import etag_headers, etag_matches, not_modified, version_etag
+
+router = APIRouter(include_in_schema=False)
+
+
+@router.post(
+    "/clipboard/new",
+    response_model=schemas.ClipboardIDResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_new_clipboard(db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Create a new clipboard with a unique ID.
+    Returns the unique ID that can be used in the URL.
+    """
+    return await async_crud.create_clipboard(db)
+
+
+@router.get("/clipboard/{clipboard_id}", response_model=schemas.ClipboardResponse)
+async def get_clipboard(
+    clipboard_id: str,
+    if_none_match: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """
+    Get the clipboard by its ID with all cards.
+    If the clipboard doesn't exist, returns 404.
+    Send the last ETag in `If-None-Match` to get a 304 when nothing changed.
+    """
+    cached = response_cache.get_clipboard(clipboard_id)
+
+    if cached:
+        tracker.touch(clipboard_id)
+        etag, body = cached
+    else:
+        read = response_cache.start_read(clipboard_id)
+
+        # Conditional requests are answered from the version alone
+        if if_none_match:
+            version = await async_crud.get_clipboard_version(db, clipboard_id)
+            if version is not None and etag_matches(
+                if_none_match, version_etag(version)
+            ):
+                return not_modified(version_etag(version))
+
+        # One projected query, encoded straight to JSON without the ORM
+        result = await async_crud.get_clipboard_json(db, clipboard_id)
+
+        if result is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Clipboard with id '{clipboard_id}' not found",
+            )
+
+        version, body = result
+        etag = version_etag(version)
+        response_cache.put_clipboard(clipboard_id, etag, body, read)
+
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    return Response(
+        content=body, media_type="application/json", headers=etag_headers(etag)
+    )
+
+
+@router.post(
+    "/clipboard/{clipboard_id}/cards",
+    response_model=schemas.CardResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_card(
+    clipboard_id: str,
+    card_data: schemas.CardCreate,
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """
+    Create a new card in the clipboard.
+    """
+    card = await async_crud.create_card(
+        db, clipboard_id, card_data.content, card_data.user_name
+    )
+
+    if not card:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clipboard with id '{clipboard_id}' not found",
+        )
+
+    return card
+
+
+@router.put("/cards/{card_id}", response_model=schemas.CardResponse)
+async def update_card(
+    card_id: int,
+    card_data: schemas.CardUpdate,
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """
+    Update a card's content.
+    """
+    card = await async_crud.update_card(db, card_id, card_data.content)
+
+    if not card:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Card with id '{card_id}' not found",
+        )
+
+    return card
+
+
+@router.patch("/cards/{card_id}", response_model=schemas.CardResponse)
+async def patch_card(
+    card_id: int,
+    patch: schemas.CardPatch,
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """
+    Apply a text delta to a card's content instead of resending all of it.
+    Returns 409 if the card is no longer at `base_version`.
+    """
+    try:
+        card = await async_crud.patch_card(
+            db, card_id, patch.base_version, patch.ops
+        )
+    except crud.StaleCardVersion as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+
+    if not card:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Card with id '{card_id}' not found",
+        )
+
+    return card
+
+
+@router.delete("/cards/{card_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_card(card_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Delete a card.
+    """
+    success = await async_crud.delete_card(db, card_id)
+
+    if not success:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Card with id '{card_id}' not found",
+        )
+
+    return None
+
+
+@router.delete("/clipboard/{clipboard_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_clipboard(
+    clipboard_id: str, db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    Delete an entire clipboard and all its cards.
+    """
+    success = await async_crud.delete_clipboard(db, clipboard_id)
+
+    if not success:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clipboard with id '{clipboard_id}' not found",
+        )
+
+    return None
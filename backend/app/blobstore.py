@@ -0,0 +1,95 @@
+"""
+Storage for card attachment files.
+
+Attachment metadata lives in the database; the bytes live in a blob store
+under an opaque key. Stores implement:
+
+- `save(key, chunks, max_bytes)`: write an async iterator of byte chunks,
+  returning (size, sha256 hex); raises BlobTooLarge past `max_bytes`
+- `path(key)`: local file path for zero-copy responses
+- `delete(key)`: remove a blob; missing blobs are ignored
+
+Backends (ATTACHMENT_STORE):
+- local (default): files under ATTACHMENT_DIR
+"""
+
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Tuple
+
+from anyio import to_thread
+
+ATTACHMENT_STORE = os.getenv("ATTACHMENT_STORE", "local").lower()
+ATTACHMENT_DIR = os.getenv(
+    "ATTACHMENT_DIR", str(Path(__file__).resolve().parents[1] / "attachments")
+)
+# Largest accepted upload in bytes
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+class BlobTooLarge(Exception):
+    """An upload exceeded the allowed size"""
+
+
+def new_blob_key() -> str:
+    return uuid.uuid4().hex
+
+
+class LocalBlobStore:
+    """Blobs as files, fanned out over subdirectories by key prefix"""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path(self, key: str) -> str:
+        return str(self.root / key[:2] / key)
+
+    async def save(
+        self, key: str, chunks: AsyncIterator[bytes], max_bytes: int
+    ) -> Tuple[int, str]:
+        final = Path(self.path(key))
+        partial = final.with_name(final.name + ".part")
+        await to_thread.run_sync(
+            lambda: final.parent.mkdir(parents=True, exist_ok=True)
+        )
+
+        digest = hashlib.sha256()
+        size = 0
+        handle = await to_thread.run_sync(partial.open, "wb")
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise BlobTooLarge(f"Attachment exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                await to_thread.run_sync(handle.write, chunk)
+            await to_thread.run_sync(handle.close)
+            # Readers never see partially written files
+            await to_thread.run_sync(os.replace, partial, final)
+        except BaseException:
+            handle.close()
+            partial.unlink(missing_ok=True)
+            raise
+
+        return size, digest.hexdigest()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def _create_store():
+    if ATTACHMENT_STORE == "local":
+        return LocalBlobStore(ATTACHMENT_DIR)
+    raise ValueError(f"Unknown ATTACHMENT_STORE '{ATTACHMENT_STORE}'")
+
+
+blob_store = _create_store()
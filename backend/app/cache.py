@@ -0,0 +1,247 @@
+"""
+Read-through cache of serialized clipboard responses.
+
+`GET /clipboard/{clipboard_id}` stores the JSON body and ETag it produced,
+and every card or clipboard mutation invalidates the entry. Entries also
+expire after CACHE_TTL seconds, which bounds staleness across workers when
+the in-process backend is used.
+
+Backends:
+- memory (default): per-process LRU bounded by entry count and bytes.
+  Other processes don't see its invalidations, so serve.py turns it off
+  when it runs several workers, unless CACHE_BACKEND is set explicitly
+- redis: any server speaking the Redis protocol, shared by all workers
+  (requires the `redis` package). Every invalidation bumps a generation
+  counter next to the entry, and a response is only stored if the counter
+  hasn't moved since its read started, so a slow reader on one worker
+  can't store a body that another worker invalidated meanwhile
+- none: caching disabled
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_KEY_PREFIX = "clipboard:response:"
+# Suffix of the Redis key counting invalidations of an entry
+CACHE_GENERATION_SUFFIX = ":generation"
+
+
+class MemoryCacheBackend:
+    """Thread-safe LRU with per-entry expiry"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def generation(self, key: str) -> Optional[bytes]:
+        # ResponseCache tracks local invalidations itself
+        return None
+
+    def set(
+        self, key: str, value: bytes, ttl: float, generation: Optional[bytes] = None
+    ) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+class RedisCacheBackend:
+    """Cache shared through a Redis-protocol server"""
+
+    name = "redis"
+
+    # Stores the value only if the generation is still the one passed in
+    _SET_IF_GENERATION = """
+    if (redis.call('GET', KEYS[2]) or '0') == ARGV[3] then
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    end
+    """
+
+    def __init__(self, url: str, ttl: float):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "CACHE_BACKEND=redis requires the redis package (pip install redis)"
+            ) from e
+        self._client = redis.Redis.from_url(url)
+        # Generation counters only have to outlive the reads in flight
+        self._generation_px = max(int(ttl * 1000), 1)
+        self._set_if_generation = self._client.register_script(
+            self._SET_IF_GENERATION
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def generation(self, key: str) -> Optional[bytes]:
+        return self._client.get(key + CACHE_GENERATION_SUFFIX) or b"0"
+
+    def set(
+        self, key: str, value: bytes, ttl: float, generation: Optional[bytes] = None
+    ) -> None:
+        px = max(int(ttl * 1000), 1)
+        if generation is None:
+            self._client.set(key, value, px=px)
+            return
+        self._set_if_generation(
+            keys=[key, key + CACHE_GENERATION_SUFFIX], args=[value, px, generation]
+        )
+
+    def delete(self, key: str) -> None:
+        pipeline = self._client.pipeline()
+        pipeline.incr(key + CACHE_GENERATION_SUFFIX)
+        pipeline.pexpire(key + CACHE_GENERATION_SUFFIX, self._generation_px)
+        pipeline.delete(key)
+        pipeline.execute()
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class ResponseCache:
+    """Clipboard response cache with hit/miss accounting"""
+
+    def __init__(self, backend, ttl: float = CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Last local invalidation per key, so that a read which started
+        # before a write can't store its outdated body afterwards
+        self._invalidated_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def start_read(self, clipboard_id: str) -> Tuple[float, Optional[bytes]]:
+        """Token to pass to put_clipboard for a read starting now"""
+        if not self.enabled:
+            return time.monotonic(), None
+        generation = self.backend.generation(CACHE_KEY_PREFIX + clipboard_id)
+        return time.monotonic(), generation
+
+    def get_clipboard(self, clipboard_id: str) -> Optional[Tuple[str, bytes]]:
+        """Return the cached (etag, body) of a clipboard, if any"""
+        if not self.enabled:
+            return None
+        value = self.backend.get(CACHE_KEY_PREFIX + clipboard_id)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        etag, _, body = value.partition(b"\n")
+        return etag.decode(), body
+
+    def put_clipboard(
+        self,
+        clipboard_id: str,
+        etag: str,
+        body: bytes,
+        read: Tuple[float, Optional[bytes]],
+    ) -> None:
+        """
+        Store a clipboard response unless it was invalidated since `read`,
+        the token start_read returned, by this process or (with a shared
+        backend) by another one.
+        """
+        if not self.enabled:
+            return
+        read_started, generation = read
+        with self._lock:
+            if self._invalidated_at.get(clipboard_id, float("-inf")) >= read_started:
+                return
+        value = etag.encode() + b"\n" + body
+        self.backend.set(CACHE_KEY_PREFIX + clipboard_id, value, self.ttl, generation)
+
+    def invalidate(self, clipboard_id: str) -> None:
+        """Drop the cached response of a clipboard after it changed"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.invalidations += 1
+            self._invalidated_at[clipboard_id] = now
+            # Reads older than the TTL are long finished; forget them
+            if len(self._invalidated_at) > CACHE_MAX_ENTRIES:
+                cutoff = now - self.ttl
+                self._invalidated_at = {
+                    key: at for key, at in self._invalidated_at.items() if at > cutoff
+                }
+        self.backend.delete(CACHE_KEY_PREFIX + clipboard_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "backend": self.backend.name if self.enabled else "none",
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+        if self.enabled:
+            stats.update(self.backend.stats())
+        return stats
+
+
+def _create_backend():
+    if CACHE_BACKEND == "none":
+        return None
+    if CACHE_BACKEND == "redis":
+        return RedisCacheBackend(CACHE_REDIS_URL, CACHE_TTL)
+    if CACHE_BACKEND == "memory":
+        return MemoryCacheBackend(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+    raise ValueError(f"Unknown CACHE_BACKEND '{CACHE_BACKEND}'")
+
+
+response_cache = ResponseCache(_create_backend())
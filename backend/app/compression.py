@@ -0,0 +1,182 @@
+"""
+Compression of card content at rest and of HTTP responses on the wire.
+
+Stored content is tagged with a codec marker so that compressed, escaped
+and legacy plain values can live side by side in the same text column:
+
+- "\\x01z" + base64(zlib(utf-8 text)): compressed
+- "\\x01r" + text: stored as-is, used for text that itself starts with \\x01
+- anything else: plain text written before compression existed
+"""
+
+import base64
+import gzip
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+
+MARKER = "\x01"
+CODEC_ZLIB = MARKER + "z"
+CODEC_RAW = MARKER + "r"
+
+
+def compress_text(value: str, threshold: int, level: int = 6) -> str:
+    """
+    Encode text for storage, compressing it when it is at least `threshold`
+    bytes long and compression actually saves space. A negative threshold
+    disables compression.
+    """
+    raw = value.encode("utf-8")
+
+    if threshold >= 0 and len(raw) >= threshold:
+        packed = CODEC_ZLIB + base64.b64encode(zlib.compress(raw, level)).decode()
+        if len(packed) < len(raw):
+            return packed
+
+    if value.startswith(MARKER):
+        return CODEC_RAW + value
+    return value
+
+
+def decompress_text(stored: str) -> str:
+    """Inverse of compress_text; plain legacy values pass through"""
+    if stored.startswith(CODEC_ZLIB):
+        return zlib.decompress(base64.b64decode(stored[len(CODEC_ZLIB) :])).decode(
+            "utf-8"
+        )
+    if stored.startswith(CODEC_RAW):
+        return stored[len(CODEC_RAW) :]
+    return stored
+
+
+def is_compressed(stored: Optional[str]) -> bool:
+    return stored is not None and stored.startswith(CODEC_ZLIB)
+
+
+def _weak_etag(etag: bytes) -> bytes:
+    return etag if etag.startswith(b"W/") else b"W/" + etag
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression of complete responses.
+
+    Streaming responses (event streams, anything sent in several chunks)
+    pass through untouched so their events aren't held back. Compressed
+    responses carry a weak ETag, since the bytes differ from the identity
+    encoding while the content is the same.
+    """
+
+    def __init__(self, app, minimum_size: int = 500, gzip_level: int = 6):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._negotiate(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+
+            if message["type"] == "http.response.start":
+                if self._is_event_stream(message):
+                    await send(message)
+                    return
+                # Hold the headers back until the body shows whether to compress
+                start_message = message
+                return
+
+            if start_message is None:
+                await send(message)
+                return
+
+            if message["type"] != "http.response.body":
+                # e.g. zero-copy file sends: pass the response through as is
+                start, start_message = start_message, None
+                await send(start)
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+
+            if message.get("more_body", False) or not self._compressible(
+                start, body
+            ):
+                if start["status"] == 304:
+                    start = self._with_headers(start, {}, weaken_etag=True)
+                await send(start)
+                await send(message)
+                return
+
+            body = self._compress(encoding, body)
+            start = self._with_headers(
+                start,
+                {
+                    b"content-encoding": encoding.encode(),
+                    b"content-length": str(len(body)).encode(),
+                },
+                weaken_etag=True,
+            )
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _negotiate(self, scope) -> Optional[str]:
+        accepted = set()
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                for item in value.decode("latin-1").split(","):
+                    coding, _, params = item.strip().partition(";")
+                    if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00"):
+                        continue
+                    accepted.add(coding.strip().lower())
+
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def _is_event_stream(self, start) -> bool:
+        return any(
+            name == b"content-type" and value.startswith(b"text/event-stream")
+            for name, value in start["headers"]
+        )
+
+    def _compressible(self, start, body: bytes) -> bool:
+        if len(body) < self.minimum_size:
+            return False
+        return all(name != b"content-encoding" for name, _ in start["headers"])
+
+    def _compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=4)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def _with_headers(self, start, replace: dict, weaken_etag: bool):
+        headers = [
+            (name, _weak_etag(value) if weaken_etag and name == b"etag" else value)
+            for name, value in start["headers"]
+            if name not in replace and name != b"vary"
+        ]
+        vary = [value for name, value in start["headers"] if name == b"vary"]
+        if b"accept-encoding" not in b",".join(vary).lower():
+            vary.append(b"Accept-Encoding")
+        headers.append((b"vary", b", ".join(vary)))
+        headers.extend(replace.items())
+        return {**start, "headers": headers}
@@ -1,51 +1,165 @@
-import random
-import string
-from typing import List, Optional
+import base64
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional, Tuple
 
+from sqlalchemy import Select, bindparam, delete, insert, select, tuple_, update
 from sqlalchemy.orm import Session
 
-from . import database, schemas
+from . import archive, database, fast_json, schemas, search
+from .access import tracker
+from .cache import response_cache
+from .events import hub
+from .ids import CLIPBOARD_ID_LENGTH, id_allocator, random_id
+from .text_delta import DeltaOp, apply_text_delta
 
 
-def generate_unique_id() -> str:
-    """Generate a short unique ID for a clipboard (6 characters alphanumeric)"""
-    characters = string.ascii_letters + string.digits  # a-z, A-Z, 0-9
-    return "".join(random.choices(characters, k=6))
+class StaleCardVersion(Exception):
+    """A card delta was based on a version that is no longer current"""
 
+    def __init__(self, card: database.Card, base_version: int):
+        self.card = card
+        super().__init__(
+            f"Card with id '{card.id}' is at version {card.version}, "
+            f"not {base_version}"
+        )
 
-def create_clipboard(db: Session) -> database.Clipboard:
-    """Create a new clipboard with a unique ID"""
-    clipboard_id = generate_unique_id()
 
-    # Ensure the ID is unique (very unlikely to collide, but safe)
-    while get_clipboard(db, clipboard_id):
-        clipboard_id = generate_unique_id()
+def generate_unique_id(length: int = CLIPBOARD_ID_LENGTH) -> str:
+    """Generate a random clipboard ID (alphanumeric, 6 characters by default)"""
+    return random_id(length)
+
 
-    db_clipboard = database.Clipboard(id=clipboard_id)
-    db.add(db_clipboard)
+def create_clipboard(db: Session) -> database.Clipboard:
+    """Create a new clipboard with a unique ID"""
+    # Claimed with one conflict-checked INSERT; see app/ids.py
+    clipboard_id = id_allocator.insert_clipboard(db)
     db.commit()
-    db.refresh(db_clipboard)
-    return db_clipboard
+    return db.get(database.Clipboard, clipboard_id)
 
 
 def get_clipboard(db: Session, clipboard_id: str) -> Optional[database.Clipboard]:
-    """Get a clipboard by ID and update last_accessed timestamp"""
-    from datetime import datetime
-
-    clipboard = (
-        db.query(database.Clipboard)
-        .filter(database.Clipboard.id == clipboard_id)
-        .first()
-    )
+    """
+    Get a clipboard by ID and record the access for last_accessed.
+    An archived clipboard is rehydrated first.
+    """
+    query = db.query(database.Clipboard).filter(database.Clipboard.id == clipboard_id)
+    clipboard = query.first()
+    if clipboard is None and archive.rehydrate_clipboard(db, clipboard_id):
+        clipboard = query.first()
 
     if clipboard:
-        clipboard.last_accessed = datetime.utcnow()
-        db.commit()
-        db.refresh(clipboard)
+        # Buffered; written in batches by the access tracker
+        tracker.touch(clipboard_id)
 
     return clipboard
 
 
+def serialize_clipboard(clipboard: database.Clipboard) -> bytes:
+    """JSON body of GET /clipboard/{clipboard_id}, loading the cards"""
+    response = schemas.ClipboardResponse.model_validate(clipboard)
+    return response.model_dump_json().encode()
+
+
+def clipboard_version_query(clipboard_id: str) -> Select:
+    """The version column of one clipboard, for conditional reads"""
+    return select(database.Clipboard.version).where(
+        database.Clipboard.id == clipboard_id
+    )
+
+
+def clipboard_rows_query(clipboard_id: str) -> Select:
+    """
+    A clipboard and its cards as flat rows, one per card in display order
+    (a single row with NULL card columns for an empty clipboard). Plain
+    column projection: no ORM objects, no identity map.
+    """
+    clipboard, card, blob = database.Clipboard, database.Card, database.CardBlob
+    return (
+        select(
+            clipboard.id,
+            clipboard.created_at,
+            clipboard.updated_at,
+            clipboard.version,
+            card.id.label("card_id"),
+            card.user_name,
+            card.version.label("card_version"),
+            card.created_at.label("card_created_at"),
+            card.updated_at.label("card_updated_at"),
+            card.legacy_content,
+            blob.content.label("blob_content"),
+        )
+        .outerjoin(card, card.clipboard_id == clipboard.id)
+        .outerjoin(blob, blob.hash == card.content_hash)
+        .where(clipboard.id == clipboard_id)
+        .order_by(card.created_at, card.id)
+    )
+
+
+def encode_clipboard_rows(rows) -> Tuple[int, bytes]:
+    """
+    (version, JSON body) of the rows of clipboard_rows_query; the body is
+    byte for byte what serialize_clipboard produces
+    """
+    clipboard_id, created_at, updated_at, version = rows[0][:4]
+    # Rows unpack positionally; attribute access per column costs far more
+    cards = [
+        {
+            "content": blob if blob is not None else legacy or "",
+            "user_name": user_name,
+            "id": card_id,
+            "clipboard_id": clipboard_id,
+            "version": card_version,
+            "created_at": card_created_at,
+            "updated_at": card_updated_at,
+        }
+        for (
+            *_,
+            card_id,
+            user_name,
+            card_version,
+            card_created_at,
+            card_updated_at,
+            legacy,
+            blob,
+        ) in rows
+        if card_id is not None
+    ]
+    body = fast_json.dumps(
+        {
+            "id": clipboard_id,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "version": version,
+            "cards": cards,
+        }
+    )
+    return version, body
+
+
+def get_clipboard_version(db: Session, clipboard_id: str) -> Optional[int]:
+    """Version of a clipboard, recording the access; None if it doesn't exist"""
+    version = db.scalar(clipboard_version_query(clipboard_id))
+    if version is not None:
+        tracker.touch(clipboard_id)
+    return version
+
+
+def get_clipboard_json(db: Session, clipboard_id: str) -> Optional[Tuple[int, bytes]]:
+    """
+    (version, JSON body) of GET /clipboard/{clipboard_id} from one query,
+    recording the access; None if the clipboard doesn't exist. An archived
+    clipboard is rehydrated first.
+    """
+    rows = db.execute(clipboard_rows_query(clipboard_id)).all()
+    if not rows and archive.rehydrate_clipboard(db, clipboard_id):
+        rows = db.execute(clipboard_rows_query(clipboard_id)).all()
+    if not rows:
+        return None
+    tracker.touch(clipboard_id)
+    return encode_clipboard_rows(rows)
+
+
 def get_or_create_clipboard(
     db: Session, clipboard_id: Optional[str] = None
 ) -> database.Clipboard:
@@ -59,6 +173,83 @@ def get_or_create_clipboard(
     return create_clipboard(db)
 
 
+def _record_changes(
+    db: Session, clipboard_id: str, changes: List[Tuple[int, str]]
+) -> List[int]:
+    """
+    Advance the clipboard's version once per (card_id, op) change and log
+    each change under its own version. Call before committing the card
+    writes; returns the new versions in order.
+    """
+    db.query(database.Clipboard).filter(
+        database.Clipboard.id == clipboard_id
+    ).update(
+        {database.Clipboard.version: database.Clipboard.version + len(changes)},
+        synchronize_session=False,
+    )
+    version = (
+        db.query(database.Clipboard.version)
+        .filter(database.Clipboard.id == clipboard_id)
+        .scalar()
+    )
+    versions = list(range(version - len(changes) + 1, version + 1))
+    db.execute(
+        insert(database.CardChange),
+        [
+            {"clipboard_id": clipboard_id, "seq": seq, "card_id": card_id, "op": op}
+            for seq, (card_id, op) in zip(versions, changes)
+        ],
+    )
+    return versions
+
+
+def _record_change(db: Session, clipboard_id: str, card_id: int, op: str) -> int:
+    """Single-change form of _record_changes; returns the new version"""
+    return _record_changes(db, clipboard_id, [(card_id, op)])[0]
+
+
+def _card_event(event_type: str, card: database.Card, version: int) -> dict:
+    return {
+        "type": event_type,
+        "version": version,
+        "card": schemas.CardResponse.model_validate(card).model_dump(mode="json"),
+    }
+
+
+def _card_deleted_event(clipboard_id: str, card_id: int, version: int) -> dict:
+    return {
+        "type": "card.deleted",
+        "version": version,
+        "card_id": card_id,
+        "clipboard_id": clipboard_id,
+    }
+
+
+def _clipboard_changed(clipboard_id: str, *events: dict) -> None:
+    """
+    Drop cached responses of a clipboard and notify stream subscribers.
+    Call after committing.
+    """
+    response_cache.invalidate(clipboard_id)
+    for event in events:
+        hub.publish(clipboard_id, event)
+
+
+def delete_clipboard(db: Session, clipboard_id: str) -> bool:
+    """Delete a clipboard and all its cards"""
+    clipboard = get_clipboard(db, clipboard_id)
+
+    if clipboard:
+        database.delete_clipboards(db, [clipboard_id])
+        db.commit()
+        _clipboard_changed(
+            clipboard_id, {"type": "clipboard.deleted", "clipboard_id": clipboard_id}
+        )
+        return True
+
+    return False
+
+
 # Card operations
 def create_card(
     db: Session, clipboard_id: str, content: str, user_name: Optional[str] = None
@@ -69,12 +260,17 @@ def create_card(
     if not clipboard:
         return None
 
+    (content_hash,) = database.acquire_blobs(db, [content])
     db_card = database.Card(
-        clipboard_id=clipboard_id, content=content, user_name=user_name
+        clipboard_id=clipboard_id, content_hash=content_hash, user_name=user_name
     )
     db.add(db_card)
+    db.flush()
+    search.index_cards(db, [(db_card.id, clipboard_id, content)])
+    version = _record_change(db, clipboard_id, db_card.id, "created")
     db.commit()
     db.refresh(db_card)
+    _clipboard_changed(clipboard_id, _card_event("card.created", db_card, version))
     return db_card
 
 
@@ -83,10 +279,56 @@ def get_cards(db: Session, clipboard_id: str) -> List[database.Card]:
     return (
         db.query(database.Card)
         .filter(database.Card.clipboard_id == clipboard_id)
-        .order_by(database.Card.created_at.asc())
+        .order_by(database.Card.created_at.asc(), database.Card.id.asc())
+        .all()
+    )
+
+
+def encode_card_cursor(card: database.Card) -> str:
+    """Opaque keyset cursor pointing just after `card`"""
+    raw = f"{card.created_at.isoformat()}|{card.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_card_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_card_cursor; raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, card_id = (
+            base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        )
+        return datetime.fromisoformat(created_at), int(card_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+
+
+def get_card_page(
+    db: Session, clipboard_id: str, after: Optional[str] = None, limit: int = 50
+) -> Tuple[List[database.Card], Optional[str]]:
+    """
+    Get one page of a clipboard's cards in display order.
+    Returns the cards and the cursor of the next page (None on the last page).
+    """
+    query = db.query(database.Card).filter(database.Card.clipboard_id == clipboard_id)
+
+    if after:
+        created_at, card_id = decode_card_cursor(after)
+        query = query.filter(
+            tuple_(database.Card.created_at, database.Card.id) > (created_at, card_id)
+        )
+
+    cards = (
+        query.order_by(database.Card.created_at.asc(), database.Card.id.asc())
+        .limit(limit + 1)
         .all()
     )
 
+    if len(cards) > limit:
+        cards = cards[:limit]
+        return cards, encode_card_cursor(cards[-1])
+
+    return cards, None
+
 
 def get_card(db: Session, card_id: int) -> Optional[database.Card]:
     """Get a specific card by ID"""
@@ -98,21 +340,408 @@ def update_card(db: Session, card_id: int, content: str) -> Optional[database.Ca
     db_card = get_card(db, card_id)
 
     if db_card:
-        db_card.content = content
+        new_hash = database.content_hash(content)
+        old_hash = db_card.content_hash
+        if new_hash != old_hash:
+            database.acquire_blobs(db, [content])
+            db_card.content_hash = new_hash
+            db_card.legacy_content = None
+            database.release_blobs(db, {old_hash: 1})
+            search.index_cards(db, [(card_id, db_card.clipboard_id, content)])
+        db_card.version = database.Card.version + 1
+        version = _record_change(db, db_card.clipboard_id, card_id, "updated")
         db.commit()
         db.refresh(db_card)
+        _clipboard_changed(
+            db_card.clipboard_id, _card_event("card.updated", db_card, version)
+        )
         return db_card
 
     return None
 
 
+def patch_card(
+    db: Session, card_id: int, base_version: int, ops: List[DeltaOp]
+) -> Optional[database.Card]:
+    """
+    Apply a text delta to version `base_version` of a card's content.
+    Raises StaleCardVersion if the card has moved on, and ValueError if the
+    delta doesn't fit the content.
+    """
+    db_card = get_card(db, card_id)
+
+    if not db_card:
+        return None
+
+    if db_card.version != base_version:
+        raise StaleCardVersion(db_card, base_version)
+
+    content = apply_text_delta(db_card.content, ops)
+    old_hash = db_card.content_hash
+    (new_hash,) = database.acquire_blobs(db, [content])
+
+    # Compare-and-swap on the version, in case a concurrent write got in
+    # between the read above and this update
+    cards = database.Card.__table__
+    result = db.execute(
+        update(cards)
+        .where(cards.c.id == card_id, cards.c.version == base_version)
+        .values(
+            content=None,
+            content_hash=new_hash,
+            version=cards.c.version + 1,
+            updated_at=datetime.utcnow(),
+        )
+    )
+
+    if result.rowcount == 0:
+        db.rollback()
+        db_card = get_card(db, card_id)
+        if not db_card:
+            return None
+        raise StaleCardVersion(db_card, base_version)
+
+    database.release_blobs(db, {old_hash: 1})
+    search.index_cards(db, [(card_id, db_card.clipboard_id, content)])
+    version = _record_change(db, db_card.clipboard_id, card_id, "updated")
+    db.commit()
+    db.refresh(db_card)
+    _clipboard_changed(
+        db_card.clipboard_id, _card_event("card.updated", db_card, version)
+    )
+    return db_card
+
+
 def delete_card(db: Session, card_id: int) -> bool:
     """Delete a card"""
     db_card = get_card(db, card_id)
 
     if db_card:
+        clipboard_id = db_card.clipboard_id
+        database.release_attachments(db, card_ids=[card_id])
+        search.unindex_cards(db, [card_id])
         db.delete(db_card)
+        database.release_blobs(db, {db_card.content_hash: 1})
+        version = _record_change(db, clipboard_id, card_id, "deleted")
+        db.commit()
+        _clipboard_changed(
+            clipboard_id, _card_deleted_event(clipboard_id, card_id, version)
+        )
+        return True
+
+    return False
+
+
+# Attachment operations
+def create_attachment(
+    db: Session,
+    card_id: int,
+    filename: str,
+    content_type: str,
+    size: int,
+    sha256: str,
+    storage_key: str,
+) -> Optional[database.Attachment]:
+    """Record an attachment whose file is already in the blob store"""
+    db_card = get_card(db, card_id)
+    if not db_card:
+        return None
+
+    attachment = database.Attachment(
+        card_id=card_id,
+        clipboard_id=db_card.clipboard_id,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        sha256=sha256,
+        storage_key=storage_key,
+    )
+    db.add(attachment)
+    db.commit()
+    db.refresh(attachment)
+    return attachment
+
+
+def get_attachment(db: Session, attachment_id: int) -> Optional[database.Attachment]:
+    """Get an attachment by ID"""
+    return (
+        db.query(database.Attachment)
+        .filter(database.Attachment.id == attachment_id)
+        .first()
+    )
+
+
+def get_attachments(db: Session, card_id: int) -> List[database.Attachment]:
+    """Get all attachments of a card, oldest first"""
+    return (
+        db.query(database.Attachment)
+        .filter(database.Attachment.card_id == card_id)
+        .order_by(database.Attachment.id.asc())
+        .all()
+    )
+
+
+def delete_attachment(db: Session, attachment_id: int) -> bool:
+    """Delete an attachment and, after commit, its file"""
+    attachment = get_attachment(db, attachment_id)
+
+    if attachment:
+        db.delete(attachment)
+        database.purge_blobs_after_commit(db, [attachment.storage_key])
         db.commit()
         return True
 
     return False
+
+
+def apply_card_batch(
+    db: Session, clipboard_id: str, operations: List[schemas.CardOperation]
+) -> Optional[schemas.CardBatchResponse]:
+    """
+    Apply a list of card creates, updates and deletes to one clipboard in a
+    single transaction, using one bulk statement per kind of operation.
+    Operations on cards that don't exist in the clipboard (or were deleted
+    earlier in the batch) fail individually with 404.
+    """
+    clipboard = get_clipboard(db, clipboard_id)
+    if not clipboard:
+        return None
+
+    cards = database.Card.__table__
+    now = datetime.utcnow()
+
+    target_ids = {op.card_id for op in operations if op.op != "create"}
+    existing = {}
+    if target_ids:
+        existing = dict(
+            db.query(database.Card.id, database.Card.content_hash).filter(
+                database.Card.clipboard_id == clipboard_id,
+                database.Card.id.in_(target_ids),
+            )
+        )
+
+    results: List[Optional[schemas.CardOperationResult]] = [None] * len(operations)
+    creates: List[int] = []
+    updates = {}
+    deleted = set()
+    for index, operation in enumerate(operations):
+        if operation.op == "create":
+            creates.append(index)
+        elif operation.card_id not in existing or operation.card_id in deleted:
+            results[index] = schemas.CardOperationResult(
+                index=index,
+                op=operation.op,
+                status=404,
+                card_id=operation.card_id,
+                detail=f"Card with id '{operation.card_id}' not found",
+            )
+        elif operation.op == "update":
+            # Later updates of the same card win
+            updates[operation.card_id] = operation.content
+        else:
+            updates.pop(operation.card_id, None)
+            deleted.add(operation.card_id)
+
+    # Identical content keeps its blob; everything else swaps references
+    created_hashes = database.acquire_blobs(
+        db, [operations[index].content for index in creates]
+    )
+    new_hashes = {
+        card_id: database.content_hash(content) for card_id, content in updates.items()
+    }
+    changed = [
+        card_id for card_id in updates if new_hashes[card_id] != existing[card_id]
+    ]
+    database.acquire_blobs(db, [updates[card_id] for card_id in changed])
+
+    created_ids: List[int] = []
+    if creates:
+        # Returned in parameter order, still as a multi-row INSERT
+        created_ids = list(
+            db.scalars(
+                insert(cards).returning(cards.c.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "clipboard_id": clipboard_id,
+                        "content_hash": blob_hash,
+                        "user_name": operations[index].user_name,
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                    for index, blob_hash in zip(creates, created_hashes)
+                ],
+            )
+        )
+
+    if updates:
+        db.execute(
+            update(cards)
+            .where(cards.c.id == bindparam("card_id"))
+            .values(
+                content=None,
+                content_hash=bindparam("new_hash"),
+                version=cards.c.version + 1,
+                updated_at=now,
+            ),
+            [
+                {"card_id": card_id, "new_hash": new_hashes[card_id]}
+                for card_id in updates
+            ],
+        )
+
+    if deleted:
+        database.release_attachments(db, card_ids=list(deleted))
+        search.unindex_cards(db, list(deleted))
+        db.execute(delete(cards).where(cards.c.id.in_(deleted)))
+
+    search.index_cards(
+        db,
+        [
+            (card_id, clipboard_id, operations[index].content)
+            for index, card_id in zip(creates, created_ids)
+        ]
+        + [(card_id, clipboard_id, updates[card_id]) for card_id in changed],
+    )
+
+    database.release_blobs(
+        db,
+        Counter(
+            [existing[card_id] for card_id in changed]
+            + [existing[card_id] for card_id in deleted]
+        ),
+    )
+
+    changes = (
+        [(card_id, "created") for card_id in created_ids]
+        + [(card_id, "updated") for card_id in updates]
+        + [(card_id, "deleted") for card_id in deleted]
+    )
+    versions = _record_changes(db, clipboard_id, changes) if changes else []
+    db.commit()
+
+    # Load the written cards back in one query for the results and events
+    written = {}
+    if created_ids or updates:
+        written = {
+            card.id: card
+            for card in db.query(database.Card).filter(
+                database.Card.id.in_(created_ids + list(updates))
+            )
+        }
+
+    _clipboard_changed(
+        clipboard_id,
+        *(
+            _card_deleted_event(clipboard_id, card_id, version)
+            if op == "deleted"
+            else _card_event(f"card.{op}", written[card_id], version)
+            for (card_id, op), version in zip(changes, versions)
+        ),
+    )
+
+    for index, card_id in zip(creates, created_ids):
+        results[index] = schemas.CardOperationResult(
+            index=index, op="create", status=201, card_id=card_id, card=written[card_id]
+        )
+    for index, operation in enumerate(operations):
+        if results[index] is not None:
+            continue
+        if operation.op == "update" and operation.card_id in deleted:
+            # Deleted later in the batch: the update never took effect
+            results[index] = schemas.CardOperationResult(
+                index=index,
+                op=operation.op,
+                status=204,
+                card_id=operation.card_id,
+                detail="Superseded by a delete later in the batch",
+            )
+            continue
+        card = written.get(operation.card_id)
+        results[index] = schemas.CardOperationResult(
+            index=index,
+            op=operation.op,
+            status=200 if operation.op == "update" else 204,
+            card_id=operation.card_id,
+            card=card,
+        )
+
+    return schemas.CardBatchResponse(
+        clipboard_id=clipboard_id,
+        version=versions[-1] if versions else clipboard.version,
+        results=results,
+    )
+
+
+def get_changes(
+    db: Session, clipboard: database.Clipboard, since: int
+) -> schemas.ClipboardChangesResponse:
+    """
+    Get the net card changes of a clipboard after version `since`.
+    Costs O(changes) rather than O(cards). Sets `reset` when the log can no
+    longer answer (compacted, or `since` is from the future) and the client
+    must refetch the whole clipboard.
+    """
+    response = schemas.ClipboardChangesResponse(
+        clipboard_id=clipboard.id, version=clipboard.version
+    )
+
+    if since < clipboard.log_floor or since > clipboard.version:
+        response.reset = True
+        return response
+
+    if since == clipboard.version:
+        return response
+
+    entries = (
+        db.query(database.CardChange)
+        .filter(
+            database.CardChange.clipboard_id == clipboard.id,
+            database.CardChange.seq > since,
+        )
+        .order_by(database.CardChange.seq.asc())
+        .all()
+    )
+
+    # Only the newest entry per card matters
+    latest = {}
+    for entry in entries:
+        latest[entry.card_id] = entry
+
+    live_ids = [card_id for card_id, entry in latest.items() if entry.op != "deleted"]
+    cards = {}
+    if live_ids:
+        cards = {
+            card.id: card
+            for card in db.query(database.Card).filter(database.Card.id.in_(live_ids))
+        }
+
+    for entry in sorted(latest.values(), key=lambda e: e.seq):
+        card = cards.get(entry.card_id)
+        response.changes.append(
+            schemas.CardChangeResponse(
+                seq=entry.seq,
+                op=entry.op if card or entry.op == "deleted" else "deleted",
+                card_id=entry.card_id,
+                card=schemas.CardResponse.model_validate(card) if card else None,
+            )
+        )
+
+    return response
+
+
+def search_cards(
+    db: Session, clipboard_id: str, query: str, limit: int = 20, offset: int = 0
+) -> schemas.CardSearchResponse:
+    """
+    Ranked full-text search within one clipboard; see app/search.py.
+    Raises search.SearchUnavailable when the database has no index.
+    """
+    rows = search.search_cards(db, clipboard_id, query, limit, offset)
+    has_more = len(rows) > limit
+
+    return schemas.CardSearchResponse(
+        clipboard_id=clipboard_id,
+        query=query,
+        results=[schemas.CardSearchResult.model_validate(row) for row in rows[:limit]],
+        next_offset=offset + limit if has_more else None,
+    )
@@ -1,34 +1,331 @@
+from collections import Counter
 from datetime import datetime
-from dotenv import load_dotenv
+import hashlib
+import importlib
+import logging
 from pathlib import Path
 import os
+import threading
+import time
 
 from sqlalchemy import (
     Column,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
+    TypeDecorator,
+    bindparam,
     create_engine,
+    delete,
+    event,
+    exc,
+    func,
+    insert,
+    inspect,
+    select,
+    update,
 )
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import Session, aliased, relationship, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from . import metrics, profiling, search
+from .compression import compress_text, decompress_text
+
+logger = logging.getLogger(__name__)
 
 # SQLite database URL
 env_path = Path(__file__).resolve().parents[1] / ".env"
-load_dotenv(dotenv_path=env_path)
+if env_path.exists():
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=env_path)
 
 DATABASE_URI = os.getenv("DATABASE_URI")
 
 SQLALCHEMY_DATABASE_URL = DATABASE_URI
-# Create engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
-)
 
-# Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Serve the core routes with async endpoints on an async engine
+ASYNC_DB = os.getenv("ASYNC_DB", "").lower() in ("1", "true", "yes")
+
+# Async drivers used for each sync backend in async mode
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+# Connection pool profile (server databases such as PostgreSQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+# 0 disables the server-side statement timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+# SQLite profile, applied as PRAGMAs on every new connection
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    # Negative values are KiB: 64 MiB of page cache per connection
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-64000"),
+    # Enforce foreign keys so ON DELETE CASCADE applies
+    "foreign_keys": "ON",
+}
+
+# Card content of at least this many bytes is stored zlib-compressed;
+# negative values disable compression of new writes
+STORAGE_COMPRESSION_THRESHOLD = int(os.getenv("STORAGE_COMPRESSION_THRESHOLD", "1024"))
+STORAGE_COMPRESSION_LEVEL = int(os.getenv("STORAGE_COMPRESSION_LEVEL", "6"))
+
+
+class _TimedCheckoutMixin:
+    """Records how long each pool checkout waited for a connection"""
+
+    stats_key = "sync"
+
+    def _do_get(self):
+        stats = metrics.pool_stats[self.stats_key]
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            stats.record_wait(time.perf_counter() - started)
+
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    stats_key = "sync"
+
+
+class TimedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    stats_key = "async"
+
+
+def _is_sqlite(url):
+    return url.get_backend_name() == "sqlite"
+
+
+def _engine_options(url, is_async=False):
+    """create_engine keyword arguments for the configured backend"""
+    if _is_sqlite(url):
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases keep SQLAlchemy's single-connection pool
+            return {}
+        return {
+            "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        }
+
+    options = {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS and url.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {
+                "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+            }
+        else:
+            options["connect_args"] = {
+                "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+            }
+    return options
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            if value:
+                cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def async_database_url(url):
+    """Map a sync DATABASE_URI onto its async driver"""
+    url = make_url(url)
+    backend = url.drivername.split("+")[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{url.drivername}'")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+# Engines and session factories are created on first use, so that importing
+# the app stays cheap (serverless cold starts); see get_engine()
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+_engines = {}
+_engine_lock = threading.RLock()
+
+
+def get_engine():
+    """The sync engine, created on first call"""
+    engine = _engines.get("sync")
+    if engine is not None:
+        return engine
+
+    with _engine_lock:
+        if "sync" not in _engines:
+            engine = create_engine(_url, **_engine_options(_url))
+            metrics.instrument_engine(engine, "sync")
+            profiling.instrument_engine(engine)
+            if _is_sqlite(_url):
+                event.listen(engine, "connect", _apply_sqlite_pragmas)
+            _engines["sync"] = engine
+    return _engines["sync"]
+
+
+def get_async_engine():
+    """The async engine, created on first call; None unless ASYNC_DB is set"""
+    if not ASYNC_DB:
+        return None
+    engine = _engines.get("async")
+    if engine is not None:
+        return engine
+
+    with _engine_lock:
+        if "async" not in _engines:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            async_url = async_database_url(_url)
+            engine = create_async_engine(
+                async_url, **_engine_options(async_url, is_async=True)
+            )
+            metrics.instrument_engine(engine.sync_engine, "async")
+            profiling.instrument_engine(engine.sync_engine)
+            if _is_sqlite(async_url):
+                event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+            _engines["async"] = engine
+    return _engines["async"]
+
+
+_session_factories = {}
+
+
+def get_sessionmaker():
+    """Factory of sync sessions; the first call also makes sure of the schema"""
+    factory = _session_factories.get("sync")
+    if factory is None:
+        ensure_schema()
+        factory = _session_factories.setdefault(
+            "sync", sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+        )
+    return factory
+
+
+def get_async_sessionmaker():
+    """Factory of async sessions; None unless ASYNC_DB is set"""
+    if not ASYNC_DB:
+        return None
+    factory = _session_factories.get("async")
+    if factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        # Blocks the event loop once, on the first request of the process
+        ensure_schema()
+        # Objects stay readable after commit without a lazy refresh (no implicit IO)
+        factory = _session_factories.setdefault(
+            "async",
+            async_sessionmaker(
+                bind=get_async_engine(), autoflush=False, expire_on_commit=False
+            ),
+        )
+    return factory
+
+
+_lazy_attributes = {
+    "engine": get_engine,
+    "async_engine": get_async_engine,
+    "SessionLocal": get_sessionmaker,
+    "AsyncSessionLocal": get_async_sessionmaker,
+}
+
+
+def __getattr__(name):
+    # `database.engine` and friends keep working, created on first access
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def dispose_engine():
+    """Close the sync engine's pooled connections, if it was created"""
+    engine = _engines.get("sync")
+    if engine is not None:
+        engine.dispose()
+
+
+async def dispose_async_engine():
+    engine = _engines.get("async")
+    if engine is not None:
+        await engine.dispose()
+
+
+def pool_status():
+    """Current pool occupancy and checkout wait statistics per engine"""
+    status = {}
+    for key in ("sync", "async"):
+        pooled_engine = _engines.get(key)
+        if pooled_engine is None:
+            continue
+        pool = pooled_engine.pool
+        entry = {"pool": pool.__class__.__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        entry.update(metrics.pool_stats[key].snapshot())
+        status[key] = entry
+    return status
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text column that compresses large values on write and decodes them on
+    read, so models and queries keep dealing in plain strings
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(
+            value, STORAGE_COMPRESSION_THRESHOLD, STORAGE_COMPRESSION_LEVEL
+        )
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
+
 
 # Create Base class
 Base = declarative_base()
@@ -41,78 +338,608 @@ class Clipboard(Base):
     id = Column(String, primary_key=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    last_accessed = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_accessed = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+    # Bumped by every card write; exposed as the clipboard's ETag
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Change log entries up to this version have been compacted away
+    log_floor = Column(Integer, nullable=False, default=0, server_default="0")
 
-    # Relationship to cards
+    # Relationship to cards; deletes cascade in the database, not in Python
     cards = relationship(
-        "Card", back_populates="clipboard", cascade="all, delete-orphan"
+        "Card",
+        back_populates="clipboard",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="[Card.created_at, Card.id]",
+    )
+    changes = relationship(
+        "CardChange", cascade="all, delete-orphan", passive_deletes=True
     )
 
 
 class Card(Base):
     __tablename__ = "cards"
+    __table_args__ = (
+        # Serves per-clipboard listing in display order, including keyset pages
+        Index("ix_cards_clipboard_id_created_at", "clipboard_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    clipboard_id = Column(String, ForeignKey("clipboards.id"), nullable=False)
-    content = Column(Text, default="")
+    clipboard_id = Column(
+        String, ForeignKey("clipboards.id", ondelete="CASCADE"), nullable=False
+    )
+    # Content of cards written before blobs existed; see `content`
+    legacy_content = Column("content", CompressedText, nullable=True)
+    content_hash = Column(
+        String(64), ForeignKey("card_blobs.hash"), nullable=True, index=True
+    )
     user_name = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped on every content change; PATCH deltas are applied against it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     # Relationship to clipboard
     clipboard = relationship("Clipboard", back_populates="cards")
+    # Loaded in the same query as the card
+    blob = relationship("CardBlob", lazy="joined")
+
+    @property
+    def content(self) -> str:
+        if self.content_hash is not None:
+            return self.blob.content
+        return self.legacy_content or ""
+
+
+class Attachment(Base):
+    """A file attached to a card; the bytes live in the blob store"""
+
+    __tablename__ = "attachments"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    card_id = Column(
+        Integer, ForeignKey("cards.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    # Denormalized so clipboard deletes can find attachments without a join
+    clipboard_id = Column(
+        String,
+        ForeignKey("clipboards.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    # Key of the file in the blob store
+    storage_key = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CardBlob(Base):
+    """Card content stored once per distinct body, shared by reference count"""
+
+    __tablename__ = "card_blobs"
+
+    # sha256 of the UTF-8 content
+    hash = Column(String(64), primary_key=True)
+    content = Column(CompressedText, nullable=False)
+    # Size in bytes of the uncompressed UTF-8 content
+    size = Column(Integer, nullable=False)
+    # Number of cards pointing at this blob; deleted when it drops to 0
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CardChange(Base):
+    """One entry of a clipboard's change log, used for delta sync"""
+
+    __tablename__ = "card_changes"
+    __table_args__ = (
+        Index("ix_card_changes_clipboard_id_seq", "clipboard_id", "seq"),
+        Index("ix_card_changes_clipboard_id_card_id", "clipboard_id", "card_id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    clipboard_id = Column(
+        String, ForeignKey("clipboards.id", ondelete="CASCADE"), nullable=False
+    )
+    # Clipboard version produced by this change
+    seq = Column(Integer, nullable=False)
+    # Not a foreign key: deletes are kept as tombstones
+    card_id = Column(Integer, nullable=False)
+    op = Column(String(16), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedClipboard(Base):
+    """An idle clipboard moved out of the hot tables; see app/archive.py"""
+
+    __tablename__ = "archived_clipboards"
+
+    id = Column(String, primary_key=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    last_accessed = Column(DateTime, index=True)
+    version = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    card_count = Column(Integer, nullable=False, default=0)
+    # Size in bytes of the uncompressed payload
+    size = Column(Integer, nullable=False, default=0)
+    # zlib-compressed JSON of the cards and their attachments
+    payload = Column(LargeBinary, nullable=False)
 
 
 # Dependency to get database session
 def get_db():
-    db = SessionLocal()
+    db = get_sessionmaker()()
     try:
         yield db
     finally:
         db.close()
 
 
+# Async dependency to get database session
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+class SchemaState(Base):
+    """Fingerprint of the schema last created by init_db()"""
+
+    __tablename__ = "schema_state"
+
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SchemaMigration(Base):
+    """A migration of app/migrations.py applied to this database"""
+
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+    seconds = Column(Float, nullable=False, default=0.0)
+
+
+def schema_fingerprint():
+    """
+    Digest of the tables, columns and indexes the models declare, and of the
+    search index, so that any model change makes ensure_schema() run init_db()
+    """
+    parts = [f"search:{search.SEARCH_ENABLED}:{search.TABLE}:{search.INDEX_VERSION}"]
+    for table in Base.metadata.sorted_tables:
+        parts.append(f"table:{table.name}")
+        for column in table.columns:
+            parts.append(
+                f"column:{column.name}:{column.type.__class__.__name__}:"
+                f"{column.nullable}:{column.primary_key}"
+            )
+        for index in sorted(table.indexes, key=lambda index: index.name or ""):
+            parts.append(f"index:{index.name}:{index.unique}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
 # Create all tables
 def init_db():
+    """
+    Create missing tables and indexes. Tables that already exist are left
+    as they are; migrate_db.py brings those of older releases up to date.
+    """
+    from . import migrations
+
+    global _schema_ready
+    engine = get_engine()
+    fresh = not inspect(engine).has_table(Clipboard.__tablename__)
     Base.metadata.create_all(bind=engine)
+    search.create_index(engine)
 
+    pending = [] if fresh else migrations.pending_migrations(engine)
 
-# Cleanup functions
-def cleanup_old_clipboards(db, days=7):
+    table = SchemaState.__table__
+    try:
+        with engine.begin() as connection:
+            if fresh:
+                # Created with the current schema: nothing to migrate
+                migrations.mark_all_applied(connection)
+            connection.execute(delete(table))
+            # Not current until migrated: every process checks again
+            if not pending:
+                connection.execute(
+                    insert(table).values(id=1, fingerprint=schema_fingerprint())
+                )
+    except exc.IntegrityError:
+        # Another process initialized the schema at the same time
+        pass
+    _schema_ready = True
+
+    if pending:
+        logger.warning(
+            "%d schema migration(s) pending; run `python migrate_db.py`",
+            len(pending),
+        )
+
+
+def ensure_schema():
     """
-    Delete clipboards that haven't been accessed in the specified number of days.
-    Returns the number of clipboards deleted.
+    Run init_db() unless the database records the current schema
+    fingerprint. Checked once per process: a single query on a cold start
+    instead of create_all's round trip per table.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with _schema_lock:
+        if _schema_ready:
+            return
+        table = SchemaState.__table__
+        try:
+            with get_engine().connect() as connection:
+                stored = connection.scalar(
+                    select(table.c.fingerprint).where(table.c.id == 1)
+                )
+        except exc.DBAPIError:
+            # No schema_state table yet
+            stored = None
+
+        if stored == schema_fingerprint():
+            _schema_ready = True
+        else:
+            init_db()
+
+
+def dialect_insert(dialect_name, target):
+    """INSERT of the sqlite or postgresql dialect, which has ON CONFLICT"""
+    # Loaded by the engine already; not imported upfront, to keep imports cheap
+    return importlib.import_module(f"sqlalchemy.dialects.{dialect_name}").insert(target)
+
+
+# Content blobs
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def acquire_blobs(db, contents):
+    """
+    Take one blob reference per item of `contents`, storing bodies not
+    seen before. Returns the content hashes in order. The caller commits.
+    """
+    hashes = [content_hash(content) for content in contents]
+    if not hashes:
+        return hashes
+
+    bodies = dict(zip(hashes, contents))
+    rows = [
+        {
+            "hash": blob_hash,
+            "content": bodies[blob_hash],
+            "size": len(bodies[blob_hash].encode("utf-8")),
+            "refcount": count,
+            "created_at": datetime.utcnow(),
+        }
+        for blob_hash, count in Counter(hashes).items()
+    ]
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        upsert = dialect_insert(dialect, CardBlob)
+        db.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[CardBlob.hash],
+                set_={"refcount": CardBlob.refcount + upsert.excluded.refcount},
+            ),
+            rows,
+        )
+    else:
+        blobs = CardBlob.__table__
+        for row in rows:
+            added = db.execute(
+                update(blobs)
+                .where(blobs.c.hash == row["hash"])
+                .values(refcount=blobs.c.refcount + row["refcount"])
+            ).rowcount
+            if not added:
+                db.execute(insert(blobs), [row])
+
+    return hashes
+
+
+def release_blobs(db, counts):
+    """
+    Drop blob references, given as {hash: number of references}, and delete
+    blobs nothing points at anymore. The caller commits.
+    """
+    counts = {blob_hash: n for blob_hash, n in counts.items() if blob_hash and n}
+    if not counts:
+        return
+
+    # Card rows must be gone before their blobs can be deleted
+    db.flush()
+
+    blobs = CardBlob.__table__
+    db.execute(
+        update(blobs)
+        .where(blobs.c.hash == bindparam("blob_hash"))
+        .values(refcount=blobs.c.refcount - bindparam("released")),
+        [{"blob_hash": h, "released": n} for h, n in counts.items()],
+    )
+    db.execute(
+        delete(blobs).where(blobs.c.hash.in_(list(counts)), blobs.c.refcount <= 0)
+    )
+
+
+def blob_stats(db):
+    """How much card content deduplication saves"""
+    blobs, stored, logical = db.query(
+        func.count(CardBlob.hash),
+        func.coalesce(func.sum(CardBlob.size), 0),
+        func.coalesce(func.sum(CardBlob.size * CardBlob.refcount), 0),
+    ).one()
+    cards, legacy = db.query(
+        func.count(Card.id),
+        func.count(Card.id).filter(Card.content_hash.is_(None)),
+    ).one()
+    return {
+        "cards": cards,
+        "legacy_cards": legacy,
+        "blobs": blobs,
+        "logical_bytes": logical,
+        "stored_bytes": stored,
+        "dedup_ratio": logical / stored if stored else 1.0,
+    }
+
+
+# Attachments
+def release_attachments(db, card_ids=None, clipboard_ids=None):
+    """
+    Delete the attachment rows of some cards or clipboards and remove their
+    files once the transaction commits. The caller commits.
     """
+    condition = (
+        Attachment.card_id.in_(card_ids)
+        if card_ids is not None
+        else Attachment.clipboard_id.in_(clipboard_ids)
+    )
+    keys = [key for (key,) in db.query(Attachment.storage_key).filter(condition)]
+    if not keys:
+        return
+
+    db.execute(
+        delete(Attachment).where(condition).execution_options(synchronize_session=False)
+    )
+    purge_blobs_after_commit(db, keys)
+
+
+def purge_blobs_after_commit(db, keys):
+    """Remove blob store files when `db` commits; a rollback keeps them"""
+    db.info.setdefault("purge_blob_keys", []).extend(keys)
+
+
+@event.listens_for(Session, "after_commit")
+def _purge_blobs(session):
+    keys = session.info.pop("purge_blob_keys", None)
+    if keys:
+        from .blobstore import blob_store
+
+        for key in keys:
+            blob_store.delete(key)
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_blobs(session):
+    session.info.pop("purge_blob_keys", None)
+
+
+# Cleanup functions
+
+# Clipboards deleted per transaction by the cleanup functions
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "500"))
+
+
+def _old_clipboards_filter(days):
     from datetime import timedelta
 
     cutoff_date = datetime.utcnow() - timedelta(days=days)
+    return Clipboard.last_accessed < cutoff_date
+
+
+def _empty_clipboards_filter(min_age_minutes=0):
+    from datetime import timedelta
+
+    condition = ~select(Card.id).where(Card.clipboard_id == Clipboard.id).exists()
+    if min_age_minutes:
+        created_before = datetime.utcnow() - timedelta(minutes=min_age_minutes)
+        condition = condition & (Clipboard.created_at < created_before)
+    return condition
+
 
-    old_clipboards = (
-        db.query(Clipboard).filter(Clipboard.last_accessed < cutoff_date).all()
+def delete_clipboards(db, clipboard_ids):
+    """
+    Delete clipboards and their dependent rows with set-based statements.
+    Children are deleted explicitly as well, for schemas created before
+    ON DELETE CASCADE was declared. The caller commits.
+    Returns the number of clipboards deleted.
+    """
+    if not clipboard_ids:
+        return 0
+
+    released = dict(
+        db.query(Card.content_hash, func.count(Card.id))
+        .filter(Card.clipboard_id.in_(clipboard_ids), Card.content_hash.isnot(None))
+        .group_by(Card.content_hash)
+        .all()
     )
 
-    count = len(old_clipboards)
+    release_attachments(db, clipboard_ids=clipboard_ids)
+    search.unindex_clipboards(db, clipboard_ids)
 
-    for clipboard in old_clipboards:
-        db.delete(clipboard)
+    for model in (CardChange, Card):
+        db.execute(
+            delete(model)
+            .where(model.clipboard_id.in_(clipboard_ids))
+            .execution_options(synchronize_session=False)
+        )
 
-    db.commit()
+    release_blobs(db, released)
+
+    return db.execute(
+        delete(Clipboard)
+        .where(Clipboard.id.in_(clipboard_ids))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _delete_matching(db, condition, batch_size, time_budget):
+    """
+    Delete clipboards matching `condition` in chunks of `batch_size`, one
+    transaction per chunk, stopping early once `time_budget` seconds passed.
+    """
+    from .cache import response_cache
+    from .events import hub
+
+    deadline = time.monotonic() + time_budget if time_budget else None
+    total = 0
+
+    while True:
+        clipboard_ids = list(
+            db.scalars(select(Clipboard.id).where(condition).limit(batch_size))
+        )
+        if not clipboard_ids:
+            break
+
+        total += delete_clipboards(db, clipboard_ids)
+        db.commit()
+        for clipboard_id in clipboard_ids:
+            response_cache.invalidate(clipboard_id)
+            # Like crud.delete_clipboard: open streams close on this event
+            hub.publish(
+                clipboard_id,
+                {"type": "clipboard.deleted", "clipboard_id": clipboard_id},
+            )
+
+        if len(clipboard_ids) < batch_size:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+
+    return total
+
+
+def cleanup_old_clipboards(db, days=7, batch_size=CLEANUP_BATCH_SIZE, time_budget=None):
+    """
+    Delete clipboards that haven't been accessed in the specified number of days.
+    Archived clipboards are left alone: see archive.purge_old_archived.
+    Works in chunks of `batch_size` and stops after `time_budget` seconds if given.
+    Returns the number of clipboards deleted.
+    """
+    from .access import tracker
+
+    # Make buffered accesses visible before judging what is old
+    tracker.flush()
 
+    count = _delete_matching(db, _old_clipboards_filter(days), batch_size, time_budget)
+    metrics.cleanup_deleted.inc("old", amount=count)
     return count
 
 
-def cleanup_empty_clipboards(db):
+def cleanup_empty_clipboards(
+    db, batch_size=CLEANUP_BATCH_SIZE, time_budget=None, min_age_minutes=0
+):
     """
-    Delete clipboards that have no cards.
+    Delete clipboards that have no cards, optionally only those created more
+    than `min_age_minutes` ago.
+    Works in chunks of `batch_size` and stops after `time_budget` seconds if given.
     Returns the number of clipboards deleted.
     """
-    empty_clipboards = db.query(Clipboard).filter(~Clipboard.cards.any()).all()
+    count = _delete_matching(
+        db, _empty_clipboards_filter(min_age_minutes), batch_size, time_budget
+    )
+    metrics.cleanup_deleted.inc("empty", amount=count)
+    return count
+
+
+def count_old_clipboards(db, days=7):
+    """Number of clipboards cleanup_old_clipboards would delete"""
+    from .access import tracker
 
-    count = len(empty_clipboards)
+    tracker.flush()
 
-    for clipboard in empty_clipboards:
-        db.delete(clipboard)
+    return db.scalar(
+        select(func.count()).select_from(Clipboard).where(_old_clipboards_filter(days))
+    )
+
+
+def count_empty_clipboards(db, min_age_minutes=0):
+    """Number of clipboards cleanup_empty_clipboards would delete"""
+    return db.scalar(
+        select(func.count())
+        .select_from(Clipboard)
+        .where(_empty_clipboards_filter(min_age_minutes))
+    )
+
+
+def compact_change_log(db, hours=24):
+    """
+    Drop change log entries older than the given number of hours, and entries
+    superseded by a later change of the same card.
+    Returns the number of entries deleted.
+    """
+    from datetime import timedelta
+
+    cutoff_date = datetime.utcnow() - timedelta(hours=hours)
+    expired = CardChange.created_at < cutoff_date
+
+    # Clients that synced before the dropped entries must refetch everything
+    latest_expired = (
+        select(func.max(CardChange.seq))
+        .where(CardChange.clipboard_id == Clipboard.id, expired)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Clipboard)
+        .where(Clipboard.id.in_(select(CardChange.clipboard_id).where(expired)))
+        .values(
+            log_floor=latest_expired,
+            updated_at=Clipboard.updated_at,
+            last_accessed=Clipboard.last_accessed,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    count = (
+        db.query(CardChange)
+        .filter(expired)
+        .delete(synchronize_session=False)
+    )
+
+    # Delta sync only needs the newest entry per card
+    newer = aliased(CardChange)
+    superseded = (
+        select(newer.id)
+        .where(
+            newer.clipboard_id == CardChange.clipboard_id,
+            newer.card_id == CardChange.card_id,
+            newer.seq > CardChange.seq,
+        )
+        .exists()
+    )
+    count += (
+        db.query(CardChange)
+        .filter(superseded)
+        .delete(synchronize_session=False)
+    )
 
     db.commit()
+    metrics.cleanup_deleted.inc("changes", amount=count)
 
     return count
@@ -0,0 +1,38 @@
+"""
+ETag helpers for conditional clipboard reads.
+"""
+
+from typing import Optional
+
+from fastapi import Response, status
+
+
+def version_etag(version: int) -> str:
+    """Strong ETag of a clipboard at `version`"""
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def etag_headers(etag: str) -> dict:
+    """Headers sent with every clipboard read; clients must revalidate"""
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag)
+    )
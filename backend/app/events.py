@@ -0,0 +1,84 @@
+"""
+In-process pub/sub hub for clipboard change events.
+
+CRUD functions publish small per-card events after they commit, and the
+`/clipboard/{clipboard_id}/stream` endpoint fans them out to every open
+connection of that clipboard. The hub lives in the worker process, so each
+worker only sees the writes it handled itself.
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Optional, Set
+
+# Events buffered per subscriber before it is told to resync
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscription:
+    """A single listener on one clipboard"""
+
+    def __init__(self, clipboard_id: str, loop: asyncio.AbstractEventLoop):
+        self.clipboard_id = clipboard_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def _deliver(self, event: Dict[str, Any]) -> None:
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client fell behind; drop the backlog and ask it to refetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "clipboard_id": self.clipboard_id})
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Wait for the next event, or return None after `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ClipboardHub:
+    """Routes events to the subscribers of each clipboard"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, clipboard_id: str) -> Subscription:
+        """Register a listener; must be called from a running event loop"""
+        subscription = Subscription(clipboard_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[clipboard_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.clipboard_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.clipboard_id]
+
+    def publish(self, clipboard_id: str, event: Dict[str, Any]) -> None:
+        """
+        Deliver an event to all subscribers of a clipboard.
+        Safe to call from worker threads (sync endpoints run in a threadpool).
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(clipboard_id, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+            except RuntimeError:
+                # Loop already closed; the stream is gone
+                self.unsubscribe(subscription)
+
+
+hub = ClipboardHub()
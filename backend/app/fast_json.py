@@ -0,0 +1,31 @@
+"""
+JSON encoding of responses built straight from database rows.
+
+Uses orjson when it is installed, and the standard library encoder
+otherwise. Both produce the bytes Pydantic's `model_dump_json` writes for
+the same data: compact separators, raw UTF-8, and ISO 8601 for the naive
+datetimes the models store.
+"""
+
+import json
+from datetime import datetime
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is slower
+    orjson = None
+
+
+def _default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(
+        value, ensure_ascii=False, separators=(",", ":"), default=_default
+    ).encode()
@@ -0,0 +1,140 @@
+"""
+File responses with HTTP Range support.
+
+When the ASGI server offers the `http.response.zerocopysend` extension the
+file descriptor is handed to it and the kernel copies the bytes (sendfile);
+otherwise the file is streamed in chunks read off the event loop.
+"""
+
+import os
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Response, status
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range lies outside the file"""
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header into an inclusive (start, end) pair.
+    Returns None when the whole file should be sent: no header, a malformed
+    one, or several ranges (which are not supported and may be ignored).
+    Raises RangeNotSatisfiable for ranges outside the file.
+    """
+    if not header:
+        return None
+
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix == 0:
+                raise RangeNotSatisfiable(header)
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if start < 0 or end < start:
+        return None
+
+    return start, min(end, size - 1)
+
+
+def range_not_satisfiable(size: int) -> Response:
+    return Response(
+        status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+        headers={"Content-Range": f"bytes */{size}"},
+    )
+
+
+class RangeFileResponse(Response):
+    """Sends a file, or one byte range of it with 206 Partial Content"""
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        byte_range: Optional[Tuple[int, int]] = None,
+        media_type: Optional[str] = None,
+        filename: Optional[str] = None,
+        headers: Optional[dict] = None,
+    ):
+        super().__init__(
+            status_code=status.HTTP_206_PARTIAL_CONTENT
+            if byte_range
+            else status.HTTP_200_OK,
+            media_type=media_type or "application/octet-stream",
+            headers=headers,
+        )
+        self.path = path
+        self.start, self.end = byte_range or (0, size - 1)
+
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+        if byte_range:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        if filename:
+            self.headers["content-disposition"] = (
+                f"attachment; filename*=utf-8''{quote(filename)}"
+            )
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+
+        count = self.end - self.start + 1
+        if scope["method"] == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+            try:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": fd,
+                        "offset": self.start,
+                        "count": count,
+                    }
+                )
+            finally:
+                os.close(fd)
+            return
+
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.start)
+            remaining = count
+            while remaining:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body", "body": b""})
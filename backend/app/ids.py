@@ -0,0 +1,157 @@
+"""
+Clipboard ID allocation.
+
+IDs are random strings drawn with `secrets` and claimed with a single
+`INSERT ... ON CONFLICT DO NOTHING`, so a collision costs one extra insert
+instead of a lookup per attempt, and concurrent creators can never end up
+with the same ID.
+
+The length starts at CLIPBOARD_ID_LENGTH and grows by one character
+whenever the table would fill more than CLIPBOARD_ID_MAX_LOAD of the ID
+space, which keeps the collision chance of every attempt below that
+fraction. The clipboard count behind that decision, archived clipboards
+included, is cached for CLIPBOARD_ID_COUNT_TTL seconds. On PostgreSQL it
+is the planner's estimate from pg_class rather than an exact count(*),
+which would scan both tables on the request path. IDs of archived
+clipboards are never handed out again, so their links keep working.
+"""
+
+import os
+import secrets
+import string
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import exc, func, insert, literal, select, text
+from sqlalchemy.orm import Session
+
+from . import database
+
+ID_ALPHABET = string.ascii_letters + string.digits  # a-z, A-Z, 0-9
+CLIPBOARD_ID_LENGTH = int(os.getenv("CLIPBOARD_ID_LENGTH", "6"))
+CLIPBOARD_ID_MAX_LOAD = float(os.getenv("CLIPBOARD_ID_MAX_LOAD", "0.01"))
+CLIPBOARD_ID_COUNT_TTL = float(os.getenv("CLIPBOARD_ID_COUNT_TTL", "300"))
+# Attempts before giving up; each retry after a collision adds a character
+CLIPBOARD_ID_MAX_ATTEMPTS = 5
+
+
+def random_id(length: int) -> str:
+    return "".join(secrets.choice(ID_ALPHABET) for _ in range(length))
+
+
+class ClipboardIdAllocator:
+    """Inserts clipboards under fresh random IDs"""
+
+    def __init__(
+        self,
+        min_length: int = CLIPBOARD_ID_LENGTH,
+        max_load: float = CLIPBOARD_ID_MAX_LOAD,
+        count_ttl: float = CLIPBOARD_ID_COUNT_TTL,
+    ):
+        self.min_length = min_length
+        self.max_load = max_load
+        self.count_ttl = count_ttl
+        self.collisions = 0
+        self._count: Optional[int] = None
+        self._counted_at = 0.0
+        self._lock = threading.Lock()
+
+    def length_for(self, count: int) -> int:
+        """Shortest ID length keeping `count` IDs under the load factor"""
+        length = self.min_length
+        while count > self.max_load * len(ID_ALPHABET) ** length:
+            length += 1
+        return length
+
+    def current_length(self, db: Session) -> int:
+        with self._lock:
+            expired = time.monotonic() - self._counted_at > self.count_ttl
+            count = self._count
+
+        if count is None or expired:
+            count = self._count_clipboards(db)
+            with self._lock:
+                self._count, self._counted_at = count, time.monotonic()
+
+        return self.length_for(count)
+
+    def _count_clipboards(self, db: Session) -> int:
+        """Live plus archived clipboards, estimated on PostgreSQL"""
+        tables = [database.Clipboard, database.ArchivedClipboard]
+        estimates = {}
+        if db.get_bind().dialect.name == "postgresql":
+            # reltuples is -1 until a table was first vacuumed or analyzed
+            estimates = dict(
+                db.execute(
+                    text(
+                        "SELECT relname, reltuples FROM pg_class "
+                        "WHERE relname IN (:live, :archived) AND relkind = 'r' "
+                        "AND pg_table_is_visible(oid) AND reltuples >= 0"
+                    ),
+                    {
+                        "live": database.Clipboard.__tablename__,
+                        "archived": database.ArchivedClipboard.__tablename__,
+                    },
+                ).all()
+            )
+
+        count = 0
+        for table in tables:
+            estimate = estimates.get(table.__tablename__)
+            if estimate is None:
+                estimate = db.scalar(select(func.count()).select_from(table))
+            count += int(estimate)
+        return count
+
+    def insert_clipboard(self, db: Session) -> str:
+        """
+        Insert a new clipboard row and return its ID. The caller commits.
+        Raises RuntimeError if no free ID was found.
+        """
+        length = self.current_length(db)
+
+        for _ in range(CLIPBOARD_ID_MAX_ATTEMPTS):
+            clipboard_id = random_id(length)
+            if self._try_insert(db, clipboard_id):
+                with self._lock:
+                    if self._count is not None:
+                        self._count += 1
+                return clipboard_id
+
+            # Collisions mean the cached count is behind; widen the space
+            with self._lock:
+                self.collisions += 1
+            length += 1
+
+        raise RuntimeError("Could not allocate a free clipboard ID")
+
+    def _try_insert(self, db: Session, clipboard_id: str) -> bool:
+        dialect = db.get_bind().dialect.name
+        archived = database.ArchivedClipboard
+        # The ID of an archived clipboard counts as taken
+        unarchived = select(literal(clipboard_id)).where(
+            ~select(archived.id).where(archived.id == clipboard_id).exists()
+        )
+
+        if dialect in ("sqlite", "postgresql"):
+            statement = (
+                database.dialect_insert(dialect, database.Clipboard)
+                .from_select([database.Clipboard.id], unarchived)
+                .on_conflict_do_nothing(index_elements=[database.Clipboard.id])
+            )
+            return db.execute(statement).rowcount == 1
+
+        try:
+            with db.begin_nested():
+                inserted = db.execute(
+                    insert(database.Clipboard).from_select(
+                        [database.Clipboard.id], unarchived
+                    )
+                ).rowcount
+            return inserted == 1
+        except exc.IntegrityError:
+            return False
+
+
+id_allocator = ClipboardIdAllocator()
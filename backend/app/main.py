@@ -1,11 +1,59 @@
-from fastapi import Depends, FastAPI, HTTPException, status
+import json
+import os
+from typing import List, Optional
+
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from . import crud, database, schemas
-
-# Initialize database
-database.init_db()
+from . import (
+    admission,
+    archive,
+    crud,
+    database,
+    metrics,
+    profiling,
+    schemas,
+    search,
+)
+from .access import tracker
+from .blobstore import ATTACHMENT_MAX_BYTES, BlobTooLarge, blob_store, new_blob_key
+from .cache import response_cache
+from .compression import CompressionMiddleware
+from .etags import etag_headers, etag_matches, not_modified, version_etag
+from .events import hub
+from .file_response import (
+    RangeFileResponse,
+    RangeNotSatisfiable,
+    parse_byte_range,
+    range_not_satisfiable,
+)
+from .scheduler import scheduler
+
+# Seconds between keep-alive comments on idle event streams
+STREAM_KEEPALIVE_SECONDS = 15
+# Page size bounds for paginated card listings
+CARD_PAGE_DEFAULT = 50
+CARD_PAGE_MAX = 500
+# Page size bounds for search results
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+# Smaller responses are sent uncompressed
+COMPRESSION_MIN_SIZE = 500
+
+# The database engine and schema are set up lazily, by the first request
+# that opens a session (see database.ensure_schema)
 
 # Create FastAPI app
 app = FastAPI(
@@ -14,6 +62,10 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# Added before CORS so that it runs inside it: rejections carry CORS headers
+# and preflight requests are never limited
+app.add_middleware(admission.AdmissionMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -21,7 +73,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Range", "Content-Disposition", "Retry-After"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+app.add_middleware(profiling.ProfilingMiddleware)
+# Added last so it wraps everything else and times whole requests
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+# In async mode the async core routes are matched before the sync ones below
+if database.ASYNC_DB:
+    from . import async_routes
+
+    app.include_router(async_routes.router)
+
+
+@app.on_event("startup")
+def start_cleanup_scheduler():
+    if scheduler.enabled:
+        scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_cleanup_scheduler():
+    scheduler.stop()
+
+
+@app.on_event("shutdown")
+def flush_access_tracker():
+    """Write buffered clipboard accesses before the process exits"""
+    tracker.close()
+
+
+@app.on_event("shutdown")
+def dispose_engine():
+    """Close pooled connections; runs after in-flight requests have drained"""
+    database.dispose_engine()
+
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await database.dispose_async_engine()
 
 
 @app.get("/")
@@ -32,12 +124,32 @@ def read_root():
         "endpoints": {
             "POST /clipboard/new": "Create a new clipboard",
             "GET /clipboard/{clipboard_id}": "Get clipboard with all cards",
+            "GET /clipboard/{clipboard_id}/stream": "Stream card changes (SSE)",
+            "GET /clipboard/{clipboard_id}/changes": "Get card changes since a version",
+            "GET /clipboard/{clipboard_id}/paged": "Get clipboard with first page of cards",
+            "GET /clipboard/{clipboard_id}/cards": "List cards page by page",
+            "GET /clipboard/{clipboard_id}/search": "Full-text search in the cards",
             "POST /clipboard/{clipboard_id}/cards": "Add a new card",
+            "POST /clipboard/{clipboard_id}/cards:batch": "Apply many card changes at once",
             "PUT /cards/{card_id}": "Update a card",
+            "PATCH /cards/{card_id}": "Apply a text delta to a card",
             "DELETE /cards/{card_id}": "Delete a card",
+            "POST /cards/{card_id}/attachments": "Upload a file to a card",
+            "GET /cards/{card_id}/attachments": "List a card's attachments",
+            "GET /attachments/{attachment_id}": "Download an attachment",
+            "DELETE /attachments/{attachment_id}": "Delete an attachment",
             "DELETE /clipboard/{clipboard_id}": "Delete entire clipboard",
             "POST /admin/cleanup/old": "Cleanup old clipboards (7+ days)",
+            "POST /admin/cleanup/archive": "Archive idle clipboards (30+ days)",
             "POST /admin/cleanup/empty": "Cleanup empty clipboards",
+            "POST /admin/cleanup/changes": "Compact the card change log",
+            "GET /admin/metrics/pool": "Connection pool usage and checkout waits",
+            "GET /admin/metrics/cache": "Response cache hit and miss counters",
+            "GET /admin/metrics/storage": "Card deduplication and archive sizes",
+            "GET /admin/profiles": "Recently profiled requests",
+            "GET /admin/profiles/{profile_id}": "SQL log and N+1 report of a profile",
+            "GET /admin/profiles/{profile_id}/collapsed": "Profile stacks (flamegraph)",
+            "GET /metrics": "Prometheus metrics",
         },
     }
 
@@ -56,11 +168,99 @@ def create_new_clipboard(db: Session = Depends(database.get_db)):
     return schemas.ClipboardIDResponse(id=clipboard.id)
 
 
-@app.get("/clipboard/{clipboard_id}", response_model=schemas.ClipboardResponse)
-def get_clipboard(clipboard_id: str, db: Session = Depends(database.get_db)):
+@app.get(
+    "/clipboard/{clipboard_id}",
+    response_model=schemas.ClipboardResponse,
+    responses={304: {"description": "Clipboard unchanged since the given ETag"}},
+)
+def get_clipboard(
+    clipboard_id: str,
+    if_none_match: Optional[str] = Header(default=None),
+    db: Session = Depends(database.get_db),
+):
     """
     Get the clipboard by its ID with all cards.
     If the clipboard doesn't exist, returns 404.
+    Send the last ETag in `If-None-Match` to get a 304 when nothing changed.
+    """
+    cached = response_cache.get_clipboard(clipboard_id)
+
+    if cached:
+        tracker.touch(clipboard_id)
+        etag, body = cached
+    else:
+        read = response_cache.start_read(clipboard_id)
+
+        # Conditional requests are answered from the version alone
+        if if_none_match:
+            version = crud.get_clipboard_version(db, clipboard_id)
+            if version is not None and etag_matches(
+                if_none_match, version_etag(version)
+            ):
+                return not_modified(version_etag(version))
+
+        # One projected query, encoded straight to JSON without the ORM
+        result = crud.get_clipboard_json(db, clipboard_id)
+
+        if result is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Clipboard with id '{clipboard_id}' not found",
+            )
+
+        version, body = result
+        etag = version_etag(version)
+        response_cache.put_clipboard(clipboard_id, etag, body, read)
+
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    return Response(
+        content=body, media_type="application/json", headers=etag_headers(etag)
+    )
+
+
+@app.get(
+    "/clipboard/{clipboard_id}/paged", response_model=schemas.ClipboardPageResponse
+)
+def get_clipboard_paged(
+    clipboard_id: str,
+    limit: int = Query(default=CARD_PAGE_DEFAULT, ge=1, le=CARD_PAGE_MAX),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Get the clipboard with only its first `limit` cards.
+    Fetch the rest from `/clipboard/{clipboard_id}/cards?after=<next_cursor>`.
+    """
+    clipboard = crud.get_clipboard(db, clipboard_id)
+
+    if not clipboard:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clipboard with id '{clipboard_id}' not found",
+        )
+
+    cards, next_cursor = crud.get_card_page(db, clipboard_id, limit=limit)
+    return schemas.ClipboardPageResponse(
+        id=clipboard.id,
+        created_at=clipboard.created_at,
+        updated_at=clipboard.updated_at,
+        version=clipboard.version,
+        cards=cards,
+        next_cursor=next_cursor,
+    )
+
+
+@app.get("/clipboard/{clipboard_id}/cards", response_model=schemas.CardPageResponse)
+def list_cards(
+    clipboard_id: str,
+    after: Optional[str] = None,
+    limit: int = Query(default=CARD_PAGE_DEFAULT, ge=1, le=CARD_PAGE_MAX),
+    db: Session = Depends(database.get_db),
+):
+    """
+    List the cards of a clipboard in pages, oldest first.
+    Pass the previous page's `next_cursor` as `after` to continue.
     """
     clipboard = crud.get_clipboard(db, clipboard_id)
 
@@ -70,7 +270,109 @@ def get_clipboard(clipboard_id: str, db: Session = Depends(database.get_db)):
             detail=f"Clipboard with id '{clipboard_id}' not found",
         )
 
-    return clipboard
+    try:
+        cards, next_cursor = crud.get_card_page(db, clipboard_id, after, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return schemas.CardPageResponse(cards=cards, next_cursor=next_cursor)
+
+
+@app.get(
+    "/clipboard/{clipboard_id}/changes",
+    response_model=schemas.ClipboardChangesResponse,
+)
+def get_clipboard_changes(
+    clipboard_id: str, since: int = 0, db: Session = Depends(database.get_db)
+):
+    """
+    Get the cards created, updated or deleted after clipboard version `since`.
+    If `reset` is true the changes are no longer available and the client
+    should refetch the whole clipboard.
+    """
+    clipboard = crud.get_clipboard(db, clipboard_id)
+
+    if not clipboard:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clipboard with id '{clipboard_id}' not found",
+        )
+
+    return crud.get_changes(db, clipboard, since)
+
+
+@app.get(
+    "/clipboard/{clipboard_id}/search", response_model=schemas.CardSearchResponse
+)
+def search_clipboard(
+    clipboard_id: str,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(default=SEARCH_PAGE_DEFAULT, ge=1, le=SEARCH_PAGE_MAX),
+    offset: int = Query(default=0, ge=0),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Search the cards of a clipboard for all words of `q` (the last one as a
+    prefix), best match first, with the matches highlighted in `snippet`.
+    Fetch further pages with `offset=next_offset`.
+    """
+    clipboard = crud.get_clipboard(db, clipboard_id)
+
+    if not clipboard:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clipboard with id '{clipboard_id}' not found",
+        )
+
+    try:
+        return crud.search_cards(db, clipboard_id, q, limit, offset)
+    except search.SearchUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+
+
+def _clipboard_exists(clipboard_id: str) -> bool:
+    db = database.SessionLocal()
+    try:
+        return crud.get_clipboard(db, clipboard_id) is not None
+    finally:
+        db.close()
+
+
+@app.get("/clipboard/{clipboard_id}/stream")
+async def stream_clipboard(clipboard_id: str, request: Request):
+    """
+    Stream card changes of a clipboard as Server-Sent Events.
+    Emits `card.created`, `card.updated`, `card.deleted`, `clipboard.deleted`
+    and `resync` (the client fell behind and should refetch).
+    """
+    # Use a short-lived session so the stream does not pin a pooled connection
+    if not await run_in_threadpool(_clipboard_exists, clipboard_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clipboard with id '{clipboard_id}' not found",
+        )
+
+    subscription = hub.subscribe(clipboard_id)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] == "clipboard.deleted":
+                    break
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post(
@@ -97,6 +399,29 @@ def create_card(
     return card
 
 
+@app.post(
+    "/clipboard/{clipboard_id}/cards:batch", response_model=schemas.CardBatchResponse
+)
+def batch_cards(
+    clipboard_id: str,
+    batch: schemas.CardBatchRequest,
+    db: Session = Depends(database.get_db),
+):
+    """
+    Create, update and delete many cards of a clipboard in one transaction.
+    Each operation gets its own result with an HTTP-style status.
+    """
+    result = crud.apply_card_batch(db, clipboard_id, batch.operations)
+
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clipboard with id '{clipboard_id}' not found",
+        )
+
+    return result
+
+
 @app.put("/cards/{card_id}", response_model=schemas.CardResponse)
 def update_card(
     card_id: int,
@@ -117,6 +442,34 @@ def update_card(
     return card
 
 
+@app.patch("/cards/{card_id}", response_model=schemas.CardResponse)
+def patch_card(
+    card_id: int,
+    patch: schemas.CardPatch,
+    db: Session = Depends(database.get_db),
+):
+    """
+    Apply a text delta to a card's content instead of resending all of it.
+    Returns 409 if the card is no longer at `base_version`.
+    """
+    try:
+        card = crud.patch_card(db, card_id, patch.base_version, patch.ops)
+    except crud.StaleCardVersion as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+
+    if not card:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Card with id '{card_id}' not found",
+        )
+
+    return card
+
+
 @app.delete("/cards/{card_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_card(card_id: int, db: Session = Depends(database.get_db)):
     """
@@ -133,26 +486,187 @@ def delete_card(card_id: int, db: Session = Depends(database.get_db)):
     return None
 
 
+def _card_exists(card_id: int) -> bool:
+    db = database.SessionLocal()
+    try:
+        return crud.get_card(db, card_id) is not None
+    finally:
+        db.close()
+
+
+def _create_attachment(card_id: int, **fields) -> Optional[database.Attachment]:
+    db = database.SessionLocal()
+    try:
+        return crud.create_attachment(db, card_id, **fields)
+    finally:
+        db.close()
+
+
+@app.post(
+    "/cards/{card_id}/attachments",
+    response_model=schemas.AttachmentResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+async def upload_attachment(
+    card_id: int,
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    content_type: Optional[str] = Header(default=None),
+    content_length: Optional[int] = Header(default=None),
+):
+    """
+    Attach a file to a card. Send the raw file as the request body (not
+    multipart); it is streamed to storage without being held in memory.
+    """
+    if content_length is not None and content_length > ATTACHMENT_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Attachments are limited to {ATTACHMENT_MAX_BYTES} bytes",
+        )
+    # Reject before reading the body; the card is checked again on insert
+    if not await run_in_threadpool(_card_exists, card_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Card with id '{card_id}' not found",
+        )
+
+    key = new_blob_key()
+    try:
+        size, sha256 = await blob_store.save(
+            key, request.stream(), ATTACHMENT_MAX_BYTES
+        )
+    except BlobTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+        )
+
+    try:
+        attachment = await run_in_threadpool(
+            _create_attachment,
+            card_id,
+            filename=filename,
+            content_type=content_type or "application/octet-stream",
+            size=size,
+            sha256=sha256,
+            storage_key=key,
+        )
+    except Exception:
+        blob_store.delete(key)
+        raise
+
+    if not attachment:
+        blob_store.delete(key)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Card with id '{card_id}' not found",
+        )
+
+    return attachment
+
+
+@app.get(
+    "/cards/{card_id}/attachments",
+    response_model=List[schemas.AttachmentResponse],
+)
+def list_attachments(card_id: int, db: Session = Depends(database.get_db)):
+    """
+    List the attachments of a card.
+    """
+    if not crud.get_card(db, card_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Card with id '{card_id}' not found",
+        )
+
+    return crud.get_attachments(db, card_id)
+
+
+@app.get("/attachments/{attachment_id}")
+def download_attachment(
+    attachment_id: int,
+    range: Optional[str] = Header(default=None),
+    if_range: Optional[str] = Header(default=None),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Download an attachment. Supports single `Range` requests (206) so
+    large downloads can be resumed.
+    """
+    attachment = crud.get_attachment(db, attachment_id)
+    path = blob_store.path(attachment.storage_key) if attachment else None
+
+    if not attachment or not os.path.exists(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Attachment with id '{attachment_id}' not found",
+        )
+
+    etag = f'"{attachment.sha256}"'
+    # A stale If-Range means the client's partial copy is outdated
+    if if_range is not None and if_range != etag:
+        range = None
+
+    try:
+        byte_range = parse_byte_range(range, attachment.size)
+    except RangeNotSatisfiable:
+        return range_not_satisfiable(attachment.size)
+
+    return RangeFileResponse(
+        path,
+        attachment.size,
+        byte_range,
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+        headers={
+            "ETag": etag,
+            "Cache-Control": "private, max-age=3600",
+            # Served with the uploader's content type: don't let browsers sniff
+            "X-Content-Type-Options": "nosniff",
+        },
+    )
+
+
+@app.delete("/attachments/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_attachment(attachment_id: int, db: Session = Depends(database.get_db)):
+    """
+    Delete an attachment.
+    """
+    success = crud.delete_attachment(db, attachment_id)
+
+    if not success:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Attachment with id '{attachment_id}' not found",
+        )
+
+    return None
+
+
 @app.delete("/clipboard/{clipboard_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_clipboard(clipboard_id: str, db: Session = Depends(database.get_db)):
     """
     Delete an entire clipboard and all its cards.
     """
-    clipboard = crud.get_clipboard(db, clipboard_id)
+    success = crud.delete_clipboard(db, clipboard_id)
 
-    if not clipboard:
+    if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Clipboard with id '{clipboard_id}' not found",
         )
 
-    db.delete(clipboard)
-    db.commit()
-
     return None
 
 
-@app.post("/admin/cleanup/old")
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    if not profiling.has_admin_token(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="A valid X-Admin-Token header is required",
+        )
+
+
+@app.post("/admin/cleanup/old", dependencies=[Depends(require_admin_token)])
 def cleanup_old_clipboards(days: int = 7, db: Session = Depends(database.get_db)):
     """
     Delete clipboards that haven't been accessed in the specified number of days.
@@ -166,7 +680,22 @@ def cleanup_old_clipboards(days: int = 7, db: Session = Depends(database.get_db)
     }
 
 
-@app.post("/admin/cleanup/empty")
+@app.post("/admin/cleanup/archive", dependencies=[Depends(require_admin_token)])
+def archive_idle_clipboards(days: int = 30, db: Session = Depends(database.get_db)):
+    """
+    Move clipboards that haven't been accessed in the specified number of
+    days to the archive. They are restored on their next read.
+    Default is 30 days.
+    """
+    count = archive.archive_idle_clipboards(db, days)
+    return {
+        "message": f"Archived {count} idle clipboard(s)",
+        "days": days,
+        "archived": count,
+    }
+
+
+@app.post("/admin/cleanup/empty", dependencies=[Depends(require_admin_token)])
 def cleanup_empty_clipboards(db: Session = Depends(database.get_db)):
     """
     Delete clipboards that have no cards.
@@ -178,6 +707,139 @@ def cleanup_empty_clipboards(db: Session = Depends(database.get_db)):
     }
 
 
+@app.post("/admin/cleanup/changes", dependencies=[Depends(require_admin_token)])
+def compact_change_log(hours: int = 24, db: Session = Depends(database.get_db)):
+    """
+    Drop card change log entries older than the given number of hours,
+    and entries superseded by a newer change of the same card.
+    Default is 24 hours.
+    """
+    count = database.compact_change_log(db, hours)
+    return {
+        "message": f"Compacted {count} change log entr{'y' if count == 1 else 'ies'}",
+        "hours": hours,
+        "deleted": count,
+    }
+
+
+@app.get("/admin/metrics/pool", dependencies=[Depends(require_admin_token)])
+def pool_metrics():
+    """
+    Connection pool occupancy and checkout wait time histograms
+    (seconds, cumulative buckets) per engine.
+    """
+    return database.pool_status()
+
+
+@app.get("/admin/metrics/cache", dependencies=[Depends(require_admin_token)])
+def cache_metrics():
+    """
+    Clipboard response cache statistics: backend, hits, misses,
+    invalidations and, for the in-process backend, its current size.
+    """
+    return response_cache.stats()
+
+
+@app.get("/admin/metrics/storage", dependencies=[Depends(require_admin_token)])
+def storage_metrics(db: Session = Depends(database.get_db)):
+    """
+    Card content deduplication: distinct blobs, bytes stored versus bytes
+    referenced by cards, and their ratio. Also the size of the archive.
+    """
+    return {**database.blob_stats(db), **archive.archive_stats(db)}
+
+
+def _get_profile(profile_id: str) -> profiling.Profile:
+    profile = profiling.profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Profile with id '{profile_id}' not found",
+        )
+    return profile
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin_token)])
+def list_profiles():
+    """
+    Summaries of the most recently profiled requests of this worker,
+    newest first. Requests are profiled when they send
+    `X-Profile: <ADMIN_TOKEN>` or are picked by PROFILING_SAMPLE_RATE.
+    """
+    return [profile.summary() for profile in profiling.profiles.list()]
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin_token)])
+def get_profile(profile_id: str):
+    """
+    One profile: timings, every SQL statement with its duration and
+    parameters, and the statements repeated often enough to suggest N+1.
+    """
+    return _get_profile(profile_id).report()
+
+
+@app.get(
+    "/admin/profiles/{profile_id}/collapsed",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_admin_token)],
+)
+def get_profile_stacks(profile_id: str):
+    """Sampled stacks of a profile in the collapsed (flamegraph) format"""
+    return _get_profile(profile_id).collapsed()
+
+
+def _collect_pool_and_cache_metrics():
+    """Scrape-time samples of the pool and response cache state"""
+    pools = database.pool_status()
+    occupancy = {}
+    for key, pool in pools.items():
+        for state in ("checked_out", "checked_in"):
+            if state in pool:
+                occupancy[(key, state)] = pool[state]
+    yield from metrics.sample_lines(
+        "db_pool_connections",
+        "Pooled connections by engine and state",
+        "gauge",
+        ("engine", "state"),
+        occupancy,
+    )
+    yield from metrics.histogram_lines(
+        "db_pool_checkout_wait_seconds",
+        "Time spent waiting for a pooled connection",
+        ("engine",),
+        {(key,): metrics.pool_stats[key].checkout_wait for key in pools},
+    )
+    yield from metrics.sample_lines(
+        "db_pool_timeouts_total",
+        "Pool checkouts that timed out",
+        "counter",
+        ("engine",),
+        {(key,): metrics.pool_stats[key].timeouts for key in pools},
+    )
+
+    cache = response_cache.stats()
+    yield from metrics.sample_lines(
+        "response_cache_events_total",
+        "Clipboard response cache lookups and invalidations",
+        "counter",
+        ("event",),
+        {(event,): cache[event] for event in ("hits", "misses", "invalidations")},
+    )
+
+
+metrics.collectors.append(_collect_pool_and_cache_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """
+    Request latency per route template, requests in flight, SQL statements
+    and time per request, pool, cache and cleanup counters, in the
+    Prometheus text format.
+    """
+    return Response(metrics.exposition(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
@@ -0,0 +1,373 @@
+"""
+Lightweight in-process metrics.
+
+Besides the JSON snapshots used by the /admin/metrics endpoints, every
+metric family defined here is rendered in the Prometheus text format by
+`exposition()`, which backs GET /metrics. Recording is a dictionary lookup
+and a short lock per observation, cheap enough to leave on in production.
+
+`MetricsMiddleware` times each request under its route template, and
+`instrument_engine` counts the SQL statements a request runs (and their
+time) through SQLAlchemy cursor events and a context variable.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Upper bounds, in seconds, of the latency buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the statements-per-request buckets
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Requests that matched no route share one label value
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Starlette appends the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            total, maximum = self._sum, self._max
+
+        count = sum(counts)
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+
+        return {
+            "count": count,
+            "sum": total,
+            "max": maximum,
+            "avg": total / count if count else 0.0,
+            "buckets": cumulative,
+        }
+
+
+class PoolStats:
+    """Checkout wait times and timeouts of one connection pool"""
+
+    def __init__(self):
+        self.checkout_wait = Histogram()
+        self.timeouts = 0
+        # Moving average of recent waits, read by admission control
+        self._recent_wait = 0.0
+        self._recent_wait_at = float("-inf")
+
+    def record_wait(self, seconds: float) -> None:
+        self.checkout_wait.observe(seconds)
+        self._recent_wait = 0.8 * self._recent_wait + 0.2 * seconds
+        self._recent_wait_at = time.monotonic()
+
+    def recent_wait(self, window: float) -> float:
+        """Average of recent checkout waits; 0 without a checkout for `window` s"""
+        if time.monotonic() - self._recent_wait_at > window:
+            return 0.0
+        return self._recent_wait
+
+    def snapshot(self) -> Dict:
+        return {"checkout_wait": self.checkout_wait.snapshot(), "timeouts": self.timeouts}
+
+
+# Keyed by engine: "sync" or "async"
+pool_stats: Dict[str, PoolStats] = {"sync": PoolStats(), "async": PoolStats()}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def sample_lines(
+    name: str,
+    documentation: str,
+    kind: str,
+    labelnames: Sequence[str],
+    samples: Dict[Tuple, float],
+) -> List[str]:
+    """Text format lines of a counter or gauge family"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for values, value in sorted(samples.items()):
+        lines.append(f"{name}{_labels(labelnames, values)} {_number(value)}")
+    return lines
+
+
+def histogram_lines(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str],
+    histograms: Dict[Tuple, Histogram],
+) -> List[str]:
+    """Text format lines of a histogram family"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    for values, histogram in sorted(histograms.items()):
+        snapshot = histogram.snapshot()
+        for bound, count in snapshot["buckets"].items():
+            labels = _labels(labelnames, values, f'le="{bound}"')
+            lines.append(f"{name}_bucket{labels} {count}")
+        labels = _labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_number(snapshot['sum'])}")
+        lines.append(f"{name}_count{labels} {snapshot['count']}")
+    return lines
+
+
+class _Family:
+    """A named metric with one child per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+
+class Counter(_Family):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            samples = dict(self._values)
+        return sample_lines(
+            self.name, self.documentation, "counter", self.labelnames, samples
+        )
+
+
+class Gauge(Counter):
+    def dec(self, *labelvalues: str, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            samples = dict(self._values)
+        return sample_lines(
+            self.name, self.documentation, "gauge", self.labelnames, samples
+        )
+
+
+class HistogramFamily(_Family):
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple, Histogram] = {}
+
+    def labels(self, *labelvalues: str) -> Histogram:
+        histogram = self._children.get(labelvalues)
+        if histogram is None:
+            with self._lock:
+                histogram = self._children.setdefault(
+                    labelvalues, Histogram(self.buckets)
+                )
+        return histogram
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            children = dict(self._children)
+        return histogram_lines(
+            self.name, self.documentation, self.labelnames, children
+        )
+
+
+registry: List[_Family] = []
+# Callables returning extra text format lines, gathered at scrape time
+collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def exposition() -> str:
+    """All metrics in the Prometheus text format"""
+    lines: List[str] = []
+    for family in registry:
+        lines.extend(family.collect())
+    for collector in collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter(
+    "http_requests_total",
+    "HTTP requests by method, route template and status code",
+    ("method", "route", "status"),
+)
+http_request_duration = HistogramFamily(
+    "http_request_duration_seconds",
+    "Time from receiving a request to the end of its response",
+    ("method", "route"),
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled, including open event streams",
+    ("method",),
+)
+http_requests_rejected = Counter(
+    "http_requests_rejected_total",
+    "Requests turned away by rate limits or admission control, by reason",
+    ("reason",),
+)
+http_requests_queued = Gauge(
+    "http_requests_queued",
+    "Requests waiting for an admission slot",
+)
+http_request_db_statements = HistogramFamily(
+    "http_request_db_statements",
+    "SQL statements executed per request",
+    ("method", "route"),
+    buckets=STATEMENT_COUNT_BUCKETS,
+)
+http_request_db_duration = HistogramFamily(
+    "http_request_db_duration_seconds",
+    "Time spent executing SQL statements per request",
+    ("method", "route"),
+)
+db_statement_duration = HistogramFamily(
+    "db_statement_duration_seconds",
+    "Execution time of single SQL statements",
+    ("engine",),
+)
+db_statement_errors = Counter(
+    "db_statement_errors_total", "SQL statements that raised an error", ("engine",)
+)
+cleanup_deleted = Counter(
+    "cleanup_deleted_total",
+    "Rows removed by the cleanup jobs: clipboards (old, empty, archive) "
+    "or change log entries",
+    ("job",),
+)
+archive_events = Counter(
+    "archive_clipboards_total",
+    "Clipboards moved to the archive (archived) or back (rehydrated)",
+    ("event",),
+)
+cleanup_runs = Counter(
+    "cleanup_runs_total", "Scheduled cleanup ticks by outcome", ("result",)
+)
+cleanup_run_duration = HistogramFamily(
+    "cleanup_run_duration_seconds", "Duration of scheduled cleanup ticks"
+)
+
+
+class RequestStats:
+    """SQL work done on behalf of one request"""
+
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# Set by MetricsMiddleware; the threadpool running sync endpoints copies the
+# context, so it sees (and updates) the same RequestStats object
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def instrument_engine(engine, key: str) -> None:
+    """Record statement counts and times of a (sync) engine under `key`"""
+    histogram = db_statement_duration.labels(key)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        histogram.observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += elapsed
+
+    def handle_error(context):
+        db_statement_errors.inc(key)
+        connection = context.connection
+        if connection is not None and connection.info.get("metrics_started"):
+            connection.info["metrics_started"].pop()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class MetricsMiddleware:
+    """Counts and times requests by method and route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        http_requests_in_flight.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec(method)
+            _request_stats.reset(token)
+
+            # The router stores the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            http_requests.inc(method, route, str(status_code))
+            http_request_duration.labels(method, route).observe(elapsed)
+            http_request_db_statements.labels(method, route).observe(stats.statements)
+            http_request_db_duration.labels(method, route).observe(stats.seconds)
@@ -0,0 +1,396 @@
+"""
+Versioned schema migrations for databases created by older releases.
+
+init_db() creates missing tables, but never alters existing ones; the
+columns and indexes added to them since are applied here, in version order,
+by `python migrate_db.py`. Applied versions are recorded in the
+`schema_migrations` table. A database created from scratch by init_db()
+already has the current schema, so init_db() records every migration as
+applied there.
+
+Migrations are made of steps, each of which can run without taking the
+tables offline:
+
+- AddColumn: a nullable column, or one with a constant default (no table
+  rewrite on PostgreSQL 11+). Takes a brief exclusive lock, so on
+  PostgreSQL it gives up after MIGRATION_LOCK_TIMEOUT_MS instead of queueing
+  behind long queries (and every query behind it), and retries.
+- CreateIndex: `CREATE INDEX CONCURRENTLY` on PostgreSQL, which doesn't
+  block writes; an invalid index left by an interrupted build is dropped
+  and rebuilt.
+- Backfill: an UPDATE run in primary key ranges of `batch_size` rows, one
+  transaction per batch, with an optional pause in between. Its WHERE
+  condition must exclude rows already done, so an interrupted backfill
+  resumes where it stopped.
+
+Every step checks whether its work is already done, so rerunning a
+migration that failed halfway is safe. On PostgreSQL, concurrent runners
+are kept apart by an advisory lock.
+"""
+
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import exc, insert, inspect, select, text
+
+from . import database
+
+# PostgreSQL: how long ALTER TABLE may wait for its lock before retrying
+MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("MIGRATION_LOCK_TIMEOUT_MS", "5000"))
+MIGRATION_LOCK_RETRIES = 5
+# Backfill defaults, overridden by migrate_db.py's options
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+MIGRATION_PAUSE = float(os.getenv("MIGRATION_PAUSE", "0"))
+# Key of the PostgreSQL advisory lock held while migrating
+ADVISORY_LOCK_KEY = 0x636C6970
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Context:
+    """What a step runs against, and where it reports progress"""
+
+    def __init__(
+        self,
+        engine,
+        batch_size: int = MIGRATION_BATCH_SIZE,
+        pause: float = MIGRATION_PAUSE,
+        log: Callable[[str], None] = print,
+    ):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.batch_size = batch_size
+        self.pause = pause
+        self.log = log
+
+
+class AddColumn:
+    def __init__(self, table: str, column: str, definition: str):
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def describe(self) -> str:
+        return f"add column {self.table}.{self.column} {self.definition}"
+
+    def _exists(self, context: Context) -> bool:
+        columns = inspect(context.engine).get_columns(self.table)
+        return self.column in [column["name"] for column in columns]
+
+    def status(self, context: Context) -> str:
+        """What applying the step would do, for dry runs"""
+        return "already present" if self._exists(context) else "pending"
+
+    def apply(self, context: Context) -> None:
+        if self._exists(context):
+            return
+        statement = (
+            f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}"
+        )
+        if context.dialect != "postgresql":
+            with context.engine.begin() as connection:
+                connection.exec_driver_sql(statement)
+            return
+
+        for attempt in range(1, MIGRATION_LOCK_RETRIES + 1):
+            try:
+                with context.engine.begin() as connection:
+                    connection.exec_driver_sql(
+                        f"SET LOCAL lock_timeout = {MIGRATION_LOCK_TIMEOUT_MS}"
+                    )
+                    connection.exec_driver_sql(statement)
+                return
+            except exc.OperationalError:
+                if attempt == MIGRATION_LOCK_RETRIES:
+                    raise
+                context.log(f"    lock not granted, retry {attempt}")
+                time.sleep(attempt)
+
+
+class CreateIndex:
+    def __init__(self, name: str, table: str, columns: Sequence[str], unique=False):
+        self.name = name
+        self.table = table
+        self.columns = tuple(columns)
+        self.unique = unique
+
+    def describe(self) -> str:
+        kind = "unique index" if self.unique else "index"
+        return f"create {kind} {self.name} on {self.table} ({', '.join(self.columns)})"
+
+    def _valid(self, connection) -> Optional[bool]:
+        """PostgreSQL: whether the index exists (None) and finished building"""
+        return connection.scalar(
+            text(
+                "SELECT i.indisvalid FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ),
+            {"name": self.name},
+        )
+
+    def _exists(self, context: Context) -> bool:
+        indexes = inspect(context.engine).get_indexes(self.table)
+        return self.name in [index["name"] for index in indexes]
+
+    def status(self, context: Context) -> str:
+        if context.dialect == "postgresql":
+            with context.engine.connect() as connection:
+                valid = self._valid(connection)
+            if valid is False:
+                return "invalid, will be rebuilt"
+            return "already present" if valid else "pending"
+        return "already present" if self._exists(context) else "pending"
+
+    def apply(self, context: Context) -> None:
+        unique = "UNIQUE " if self.unique else ""
+        columns = ", ".join(self.columns)
+        if context.dialect != "postgresql":
+            if not self._exists(context):
+                with context.engine.begin() as connection:
+                    connection.exec_driver_sql(
+                        f"CREATE {unique}INDEX {self.name} ON {self.table} ({columns})"
+                    )
+            return
+
+        # CONCURRENTLY can't run inside a transaction block
+        with context.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            valid = self._valid(connection)
+            if valid:
+                return
+            if valid is False:
+                context.log(f"    dropping invalid index {self.name} of a failed build")
+                connection.exec_driver_sql(f"DROP INDEX CONCURRENTLY {self.name}")
+            connection.exec_driver_sql(
+                f"CREATE {unique}INDEX CONCURRENTLY {self.name} "
+                f"ON {self.table} ({columns})"
+            )
+
+
+class Backfill:
+    """
+    `UPDATE table SET assignments WHERE condition`, in primary key ranges.
+    `params` are bound into both; a callable value is evaluated once per run.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        assignments: str,
+        condition: str,
+        params: Optional[Dict] = None,
+        key: str = "id",
+    ):
+        self.table = table
+        self.assignments = assignments
+        self.condition = condition
+        self.params = params or {}
+        self.key = key
+
+    def describe(self) -> str:
+        return f"backfill {self.table}: SET {self.assignments} WHERE {self.condition}"
+
+    def _remaining(self, connection, params) -> int:
+        return connection.scalar(
+            text(f"SELECT count(*) FROM {self.table} WHERE {self.condition}"), params
+        )
+
+    def _params(self) -> Dict:
+        return {
+            name: value() if callable(value) else value
+            for name, value in self.params.items()
+        }
+
+    def status(self, context: Context) -> str:
+        try:
+            with context.engine.connect() as connection:
+                remaining = self._remaining(connection, self._params())
+        except exc.DBAPIError:
+            # Columns the steps before this one add don't exist yet
+            return "pending, every row"
+        if remaining == 0:
+            return "nothing to update"
+        return f"{remaining} row(s) to update"
+
+    def apply(self, context: Context) -> None:
+        params = self._params()
+        with context.engine.connect() as connection:
+            total = self._remaining(connection, params)
+        if total == 0:
+            return
+
+        # Each batch covers the next `batch_size` keys, updated or not, so
+        # every statement reads a bounded range of the primary key index
+        upper_bound = text(
+            f"SELECT max({self.key}) FROM (SELECT {self.key} FROM {self.table} "
+            f"WHERE {self.key} > :after ORDER BY {self.key} LIMIT :batch_size) AS batch"
+        )
+        update = text(
+            f"UPDATE {self.table} SET {self.assignments} "
+            f"WHERE {self.key} > :after AND {self.key} <= :upto AND ({self.condition})"
+        )
+        first_key = text(f"SELECT min({self.key}) FROM {self.table}")
+
+        updated = 0
+        started = time.monotonic()
+        with context.engine.connect() as connection:
+            after = connection.scalar(first_key)
+        if after is None:
+            return
+        # Start just below the first key: strings and numbers both sort after ""
+        after = "" if isinstance(after, str) else after - 1
+
+        while True:
+            with context.engine.begin() as connection:
+                upto = connection.scalar(
+                    upper_bound, {"after": after, "batch_size": context.batch_size}
+                )
+                if upto is None:
+                    break
+                updated += connection.execute(
+                    update, dict(params, after=after, upto=upto)
+                ).rowcount
+            after = upto
+
+            elapsed = time.monotonic() - started
+            rate = updated / elapsed if elapsed else 0.0
+            context.log(
+                f"    ... {updated}/{total} row(s) updated, up to {self.key} "
+                f"{upto} ({rate:.0f} rows/s)"
+            )
+            if context.pause:
+                time.sleep(context.pause)
+
+
+class Migration:
+    def __init__(self, version: int, name: str, steps: List):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "clipboard last access time",
+        [
+            AddColumn("clipboards", "last_accessed", "TIMESTAMP"),
+            # Counts existing clipboards as used now, so cleanup spares them
+            Backfill(
+                "clipboards",
+                "last_accessed = :now",
+                "last_accessed IS NULL",
+                {"now": datetime.utcnow},
+            ),
+        ],
+    ),
+    Migration(
+        2,
+        "versions and content-addressed card storage",
+        [
+            AddColumn("clipboards", "version", "INTEGER NOT NULL DEFAULT 0"),
+            AddColumn("clipboards", "log_floor", "INTEGER NOT NULL DEFAULT 0"),
+            AddColumn("cards", "version", "INTEGER NOT NULL DEFAULT 1"),
+            AddColumn(
+                "cards", "content_hash", "VARCHAR(64) REFERENCES card_blobs (hash)"
+            ),
+        ],
+    ),
+    Migration(
+        3,
+        "card listing, cleanup and blob lookup indexes",
+        [
+            CreateIndex(
+                "ix_cards_clipboard_id_created_at",
+                "cards",
+                ("clipboard_id", "created_at", "id"),
+            ),
+            CreateIndex(
+                "ix_clipboards_last_accessed", "clipboards", ("last_accessed",)
+            ),
+            CreateIndex("ix_cards_content_hash", "cards", ("content_hash",)),
+        ],
+    ),
+]
+
+
+def applied_versions(connection) -> set:
+    table = database.SchemaMigration.__table__
+    # Missing until init_db() first runs on a database of an older release
+    if not inspect(connection).has_table(table.name):
+        return set()
+    return set(connection.scalars(select(table.c.version)))
+
+
+def pending_migrations(engine) -> List[Migration]:
+    with engine.connect() as connection:
+        applied = applied_versions(connection)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _record(connection, migration: Migration, seconds: float = 0.0) -> None:
+    connection.execute(
+        insert(database.SchemaMigration.__table__).values(
+            version=migration.version,
+            name=migration.name,
+            applied_at=datetime.utcnow(),
+            seconds=seconds,
+        )
+    )
+
+
+def mark_all_applied(connection) -> None:
+    """Record every migration; for databases created with the current schema"""
+    applied = applied_versions(connection)
+    for migration in MIGRATIONS:
+        if migration.version not in applied:
+            _record(connection, migration)
+
+
+def plan(context: Context, target: Optional[int] = None):
+    """[(migration, [(step description, status)])] of the pending migrations"""
+    result = []
+    for migration in pending_migrations(context.engine):
+        if target is not None and migration.version > target:
+            break
+        steps = [(step.describe(), step.status(context)) for step in migration.steps]
+        result.append((migration, steps))
+    return result
+
+
+def _advisory_lock(connection, context: Context) -> None:
+    if context.dialect != "postgresql":
+        return
+    if not connection.scalar(
+        text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}
+    ):
+        raise MigrationError("Another migration is running on this database")
+
+
+def migrate(context: Context, target: Optional[int] = None) -> List[Migration]:
+    """Apply the pending migrations up to `target`; returns those applied"""
+    applied = []
+    # Session-level lock, released when this connection closes. Autocommit,
+    # since an open transaction would hold up CREATE INDEX CONCURRENTLY
+    with context.engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as lock_connection:
+        _advisory_lock(lock_connection, context)
+
+        for migration in pending_migrations(context.engine):
+            if target is not None and migration.version > target:
+                break
+            context.log(f"Migration {migration.version}: {migration.name}")
+            started = time.monotonic()
+            for step in migration.steps:
+                context.log(f"  {step.describe()}")
+                step.apply(context)
+            with context.engine.begin() as connection:
+                _record(connection, migration, time.monotonic() - started)
+            applied.append(migration)
+    return applied
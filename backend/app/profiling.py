@@ -0,0 +1,291 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries `X-Profile: <ADMIN_TOKEN>`, or at
+random with probability PROFILING_SAMPLE_RATE. While it runs, a sampler
+thread records the Python stacks of busy threads every PROFILING_INTERVAL
+seconds, and every SQL statement the request executes is logged with its
+duration. Statements repeated PROFILING_REPEAT_THRESHOLD times or more
+(after replacing literals and IN lists with placeholders) are flagged as
+N+1 patterns.
+
+The last PROFILING_MAX_RECORDS profiles are kept in memory per process and
+served by the /admin/profiles endpoints; stacks are available in the
+collapsed format read by flamegraph.pl and speedscope. Profiled responses
+carry an `X-Profile-Id` header.
+
+Samples cover every busy thread of the process, so requests running
+concurrently on the same worker show up in them too.
+"""
+
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Shared secret for the X-Profile header and the /admin/profiles endpoints;
+# unset disables header-triggered profiling
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Fraction of requests profiled without the header
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+# Seconds between stack samples
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.002"))
+# Sampling stops after this many seconds (long-lived event streams)
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "30"))
+PROFILING_MAX_RECORDS = int(os.getenv("PROFILING_MAX_RECORDS", "50"))
+PROFILING_REPEAT_THRESHOLD = int(os.getenv("PROFILING_REPEAT_THRESHOLD", "5"))
+# Logged SQL parameters are cut to this many characters
+PROFILING_PARAMETERS_LENGTH = 200
+
+# Innermost frames in these files mean the thread is waiting for work
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def statement_shape(statement: str) -> str:
+    """A statement with literals and IN lists reduced to placeholders"""
+    shape = _LITERALS.sub("?", statement)
+    shape = re.sub(r"%\(\w+\)s|\$\d+|:\w+", "?", shape)
+    shape = _PLACEHOLDER_LISTS.sub("(?)", shape)
+    return " ".join(shape.split())
+
+
+def has_admin_token(value: Optional[str]) -> bool:
+    if not ADMIN_TOKEN or not value:
+        return False
+    return secrets.compare_digest(value.encode(), ADMIN_TOKEN.encode())
+
+
+class Profile:
+    """Stacks and SQL statements recorded for one request"""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status: Optional[int] = None
+        self.started_at = datetime.utcnow()
+        self.duration = 0.0
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.statements: List[Dict] = []
+        self._started = time.perf_counter()
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._sampler = threading.Thread(
+            target=self._sample, name=f"profiler-{self.id}", daemon=True
+        )
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """Tell the sampler to stop; returns at once, see join()"""
+        self.duration = time.perf_counter() - self._started
+        self._stopped.set()
+
+    def join(self) -> None:
+        """Wait for the sampler to exit; blocks, keep it off the event loop"""
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.monotonic() + PROFILING_MAX_SECONDS
+
+        while not self._stopped.wait(PROFILING_INTERVAL):
+            if time.monotonic() > deadline:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = [names.get(ident, str(ident))]
+                frames = []
+                while frame is not None:
+                    frames.append(frame)
+                    frame = frame.f_back
+                for frame in reversed(frames):
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def record_statement(self, statement: str, parameters, elapsed: float) -> None:
+        self.statements.append(
+            {
+                "at_ms": round((time.perf_counter() - self._started) * 1000, 3),
+                "duration_ms": round(elapsed * 1000, 3),
+                "statement": statement,
+                "parameters": repr(parameters)[:PROFILING_PARAMETERS_LENGTH],
+            }
+        )
+
+    def repeated_statements(self) -> List[Dict]:
+        """Statement shapes run at least PROFILING_REPEAT_THRESHOLD times"""
+        groups: Dict[str, List[Dict]] = {}
+        for entry in self.statements:
+            groups.setdefault(statement_shape(entry["statement"]), []).append(entry)
+
+        return sorted(
+            (
+                {
+                    "statement": shape,
+                    "count": len(entries),
+                    "total_ms": round(sum(e["duration_ms"] for e in entries), 3),
+                }
+                for shape, entries in groups.items()
+                if len(entries) >= PROFILING_REPEAT_THRESHOLD
+            ),
+            key=lambda group: group["count"],
+            reverse=True,
+        )
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format: one `frame;frame;... count` per line"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "samples": self.samples,
+            "statements": len(self.statements),
+            "sql_ms": round(sum(e["duration_ms"] for e in self.statements), 3),
+            "n_plus_one": len(self.repeated_statements()),
+        }
+
+    def report(self) -> Dict:
+        report = self.summary()
+        report["n_plus_one"] = self.repeated_statements()
+        report["statements"] = self.statements
+        return report
+
+
+class ProfileStore:
+    """The most recent profiles of this process"""
+
+    def __init__(self, max_records: int = PROFILING_MAX_RECORDS):
+        self._profiles: deque = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            for profile in self._profiles:
+                if profile.id == profile_id:
+                    return profile
+        return None
+
+    def list(self) -> List[Profile]:
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+profiles = ProfileStore()
+
+_current_profile: ContextVar[Optional[Profile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def instrument_engine(engine) -> None:
+    """Log the statements of profiled requests run on a (sync) engine"""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if _current_profile.get() is not None:
+            conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        profile = _current_profile.get()
+        if profile is not None and conn.info.get("profiling_started"):
+            elapsed = time.perf_counter() - conn.info["profiling_started"].pop()
+            profile.record_statement(statement, parameters, elapsed)
+
+    def handle_error(context):
+        connection = context.connection
+        if connection is not None and connection.info.get("profiling_started"):
+            connection.info["profiling_started"].pop()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class ProfilingMiddleware:
+    """Profiles requests asking for it with the admin token, and a sample"""
+
+    def __init__(self, app, sample_rate: float = PROFILING_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    def _wants_profile(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return has_admin_token(value.decode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile.id.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        token = _current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.stop()
+            _current_profile.reset(token)
+            await run_in_threadpool(profile.join)
+            profile.route = getattr(scope.get("route"), "path", None)
+            profiles.add(profile)
+
+            repeated = profile.repeated_statements()
+            if repeated:
+                logger.warning(
+                    "Profile %s: %s %s ran %d statement(s) %d+ times (N+1?)",
+                    profile.id,
+                    profile.method,
+                    profile.path,
+                    len(repeated),
+                    PROFILING_REPEAT_THRESHOLD,
+                )
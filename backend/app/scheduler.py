@@ -0,0 +1,159 @@
+"""
+Optional in-process scheduler for the cleanup jobs.
+
+When CLEANUP_SCHEDULER_ENABLED is set, a background thread runs the
+cleanup functions, and archival when CLEANUP_ARCHIVE_DAYS is set, every
+CLEANUP_INTERVAL seconds. Archived clipboards are only deleted when
+CLEANUP_ARCHIVE_RETENTION_DAYS is set. Each tick works in small
+transactions and stops after CLEANUP_TIME_BUDGET seconds, leaving the rest
+for the next tick, so it never holds locks for long.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from . import archive, database, metrics
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_SCHEDULER_ENABLED = os.getenv("CLEANUP_SCHEDULER_ENABLED", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Seconds between ticks
+CLEANUP_INTERVAL = float(os.getenv("CLEANUP_INTERVAL", "3600"))
+# Seconds of work allowed per tick
+CLEANUP_TIME_BUDGET = float(os.getenv("CLEANUP_TIME_BUDGET", "5"))
+# Clipboards idle for this many days are archived; 0 disables
+CLEANUP_ARCHIVE_DAYS = int(os.getenv("CLEANUP_ARCHIVE_DAYS", "0"))
+# Archived clipboards idle for this many days are deleted; 0 keeps them forever
+CLEANUP_ARCHIVE_RETENTION_DAYS = int(os.getenv("CLEANUP_ARCHIVE_RETENTION_DAYS", "0"))
+# Live clipboards idle for this many days are deleted; 0 disables
+CLEANUP_OLD_DAYS = int(os.getenv("CLEANUP_OLD_DAYS", "7"))
+# Empty clipboards older than this many minutes are deleted; 0 disables
+CLEANUP_EMPTY_AFTER_MINUTES = int(os.getenv("CLEANUP_EMPTY_AFTER_MINUTES", "1440"))
+
+
+class CleanupScheduler:
+    """Runs the cleanup jobs periodically within a time budget"""
+
+    def __init__(
+        self,
+        interval: float = CLEANUP_INTERVAL,
+        time_budget: float = CLEANUP_TIME_BUDGET,
+        old_days: int = CLEANUP_OLD_DAYS,
+        empty_after_minutes: int = CLEANUP_EMPTY_AFTER_MINUTES,
+        archive_days: int = CLEANUP_ARCHIVE_DAYS,
+        archive_retention_days: int = CLEANUP_ARCHIVE_RETENTION_DAYS,
+    ):
+        self.interval = interval
+        self.time_budget = time_budget
+        self.old_days = old_days
+        self.archive_days = archive_days
+        self.archive_retention_days = archive_retention_days
+        # Whether the app starts it; serve.py leaves it on in one worker only
+        self.enabled = CLEANUP_SCHEDULER_ENABLED
+        self.empty_after_minutes = empty_after_minutes
+        self.last_run: Optional[Dict] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check_settings(self) -> None:
+        """Warn about retention settings that defeat archival"""
+        if self.archive_days and self.old_days and self.old_days <= self.archive_days:
+            logger.warning(
+                "CLEANUP_OLD_DAYS (%d) <= CLEANUP_ARCHIVE_DAYS (%d): idle clipboards "
+                "are deleted before they can be archived, and their links break. "
+                "Set CLEANUP_OLD_DAYS=0 or above CLEANUP_ARCHIVE_DAYS.",
+                self.old_days,
+                self.archive_days,
+            )
+        retention = self.archive_retention_days
+        if self.archive_days and retention and retention <= self.archive_days:
+            logger.warning(
+                "CLEANUP_ARCHIVE_RETENTION_DAYS (%d) <= CLEANUP_ARCHIVE_DAYS (%d): "
+                "clipboards are deleted as soon as they are archived",
+                retention,
+                self.archive_days,
+            )
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.check_settings()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="cleanup-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.time_budget + 5)
+            self._thread = None
+
+    def tick(self) -> Dict:
+        """Run one round of cleanup and return what it did"""
+        started = time.monotonic()
+        result = {"archived": 0, "purged": 0, "old": 0, "empty": 0}
+
+        db = database.SessionLocal()
+        try:
+            if self.archive_days:
+                result["archived"] = archive.archive_idle_clipboards(
+                    db, self.archive_days, time_budget=self.time_budget
+                )
+
+            remaining = self.time_budget - (time.monotonic() - started)
+            if self.archive_retention_days and remaining > 0:
+                result["purged"] = archive.purge_old_archived(
+                    db, self.archive_retention_days, time_budget=remaining
+                )
+
+            remaining = self.time_budget - (time.monotonic() - started)
+            if self.old_days and remaining > 0:
+                result["old"] = database.cleanup_old_clipboards(
+                    db, self.old_days, time_budget=remaining
+                )
+
+            remaining = self.time_budget - (time.monotonic() - started)
+            if self.empty_after_minutes and remaining > 0:
+                result["empty"] = database.cleanup_empty_clipboards(
+                    db,
+                    time_budget=remaining,
+                    min_age_minutes=self.empty_after_minutes,
+                )
+        finally:
+            db.close()
+
+        result["seconds"] = round(time.monotonic() - started, 3)
+        self.last_run = result
+        return result
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            started = time.monotonic()
+            try:
+                result = self.tick()
+                metrics.cleanup_runs.inc("ok")
+                logger.info(
+                    "Cleanup archived %d idle clipboard(s), purged %d archived, "
+                    "removed %d old and %d empty clipboard(s) in %.3fs",
+                    result["archived"],
+                    result["purged"],
+                    result["old"],
+                    result["empty"],
+                    result["seconds"],
+                )
+            except Exception:
+                metrics.cleanup_runs.inc("error")
+                logger.exception("Scheduled cleanup failed")
+            metrics.cleanup_run_duration.labels().observe(time.monotonic() - started)
+
+
+scheduler = CleanupScheduler()
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, StrictInt, StrictStr, model_validator
 
 
 # Card schemas
@@ -18,9 +18,20 @@ class CardUpdate(BaseModel):
     content: str
 
 
+class CardPatch(BaseModel):
+    """
+    Text delta against version `base_version` of a card: positive ints
+    retain, negative ints delete and strings insert (see app/text_delta.py)
+    """
+
+    base_version: int
+    ops: List[Union[StrictInt, StrictStr]] = Field(..., min_length=1)
+
+
 class CardResponse(CardBase):
     id: int
     clipboard_id: str
+    version: int
     created_at: datetime
     updated_at: datetime
 
@@ -28,16 +39,116 @@ class CardResponse(CardBase):
         from_attributes = True
 
 
+class CardOperation(BaseModel):
+    """One operation of a batch card mutation"""
+
+    op: Literal["create", "update", "delete"]
+    card_id: Optional[int] = None
+    content: Optional[str] = None
+    user_name: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.op != "create" and self.card_id is None:
+            raise ValueError(f"'{self.op}' operations require card_id")
+        if self.op != "delete" and self.content is None:
+            raise ValueError(f"'{self.op}' operations require content")
+        return self
+
+
+class CardBatchRequest(BaseModel):
+    operations: List[CardOperation] = Field(..., min_length=1, max_length=500)
+
+
+class CardOperationResult(BaseModel):
+    index: int
+    op: str
+    status: int
+    card_id: Optional[int] = None
+    card: Optional[CardResponse] = None
+    detail: Optional[str] = None
+
+
+class CardBatchResponse(BaseModel):
+    clipboard_id: str
+    version: int
+    results: List[CardOperationResult] = []
+
+
+# Attachment schemas
+class AttachmentResponse(BaseModel):
+    id: int
+    card_id: int
+    clipboard_id: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 # Clipboard schemas
 class ClipboardResponse(BaseModel):
     id: str
     created_at: datetime
     updated_at: datetime
+    version: int
     cards: List[CardResponse] = []
 
     class Config:
         from_attributes = True
 
 
+class ClipboardPageResponse(ClipboardResponse):
+    """A clipboard with only its first page of cards"""
+
+    next_cursor: Optional[str] = None
+
+
+class CardPageResponse(BaseModel):
+    cards: List[CardResponse] = []
+    next_cursor: Optional[str] = None
+
+
 class ClipboardIDResponse(BaseModel):
     id: str
+
+
+# Search schemas
+class CardSearchResult(BaseModel):
+    card_id: int
+    user_name: Optional[str] = None
+    version: int
+    created_at: datetime
+    updated_at: datetime
+    # Matching excerpt with the matched words wrapped in <mark></mark>
+    snippet: str
+    score: float
+
+    class Config:
+        from_attributes = True
+
+
+class CardSearchResponse(BaseModel):
+    clipboard_id: str
+    query: str
+    results: List[CardSearchResult] = []
+    next_offset: Optional[int] = None
+
+
+# Delta sync schemas
+class CardChangeResponse(BaseModel):
+    seq: int
+    op: str
+    card_id: int
+    card: Optional[CardResponse] = None
+
+
+class ClipboardChangesResponse(BaseModel):
+    clipboard_id: str
+    version: int
+    reset: bool = False
+    changes: List[CardChangeResponse] = []
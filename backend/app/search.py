@@ -0,0 +1,315 @@
+"""
+Full-text search over the cards of a clipboard.
+
+- SQLite: a contentless FTS5 table `card_search` whose rowid is the card
+  ID. The clipboard ID is an indexed column too, so a query only walks the
+  posting lists of its terms within that clipboard.
+- PostgreSQL: a `card_search` table with a tsvector column under a GIN
+  index, next to an indexed clipboard ID.
+- Other backends, or SQLite builds without FTS5: search is unavailable.
+
+The index holds terms and positions only, not a copy of the card text,
+which stays compressed and deduplicated in card_blobs; snippets are cut
+from that for the cards of the result page. SQLite older than 3.43 can't
+delete from contentless tables, so there the FTS5 table stores the text
+as well, roughly doubling the space cards take. crud.py updates the index
+in the same transaction as the card writes; `python reindex_search.py`
+fills it for cards written before it existed.
+
+Queries are reduced to their words, all of which must match; the last one
+also matches as a prefix, so results show up while typing. Snippets are
+HTML-escaped card text with the words matching the query (lowercased and
+without diacritics) wrapped in <mark> tags.
+"""
+
+import html
+import logging
+import os
+import re
+import sqlite3
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, bindparam, inspect, select, text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# Text search configuration of the PostgreSQL index; "simple" does no stemming
+SEARCH_PG_CONFIG = os.getenv("SEARCH_PG_CONFIG", "simple")
+# Words of a query beyond this many are ignored
+SEARCH_MAX_TERMS = 16
+# Approximate length, in words, of result snippets
+SEARCH_SNIPPET_WORDS = 24
+SEARCH_MARK_START = "<mark>"
+SEARCH_MARK_END = "</mark>"
+# Placeholders the database puts around matches, replaced by the tags once
+# the snippet has been escaped (private use characters)
+_SELECTION_START = "\ue000"
+_SELECTION_END = "\ue001"
+
+TABLE = "card_search"
+# Changes whenever the layout of the index table does
+INDEX_VERSION = 2
+# Contentless FTS5 tables that support DELETE appeared in SQLite 3.43
+_FTS5_CONTENTLESS = sqlite3.sqlite_version_info >= (3, 43, 0)
+
+_WORDS = re.compile(r"\w+")
+# Whether the index exists, keyed by database URL
+_available: Dict[str, bool] = {}
+
+
+class SearchUnavailable(Exception):
+    """The database has no search index"""
+
+
+def _backend(db) -> Optional[str]:
+    """'sqlite' or 'postgresql' when the index can be used, None otherwise"""
+    bind = db.get_bind()
+    dialect = bind.dialect.name
+    if not SEARCH_ENABLED or dialect not in ("sqlite", "postgresql"):
+        return None
+
+    key = str(bind.url)
+    if key not in _available:
+        _available[key] = inspect(db.connection()).has_table(TABLE)
+    return dialect if _available[key] else None
+
+
+def create_index(engine) -> None:
+    """Create the index table if it is missing; part of init_db"""
+    dialect = engine.dialect.name
+    if not SEARCH_ENABLED or dialect not in ("sqlite", "postgresql"):
+        return
+
+    with engine.begin() as connection:
+        if dialect == "sqlite":
+            options = "content='', contentless_delete=1, " if _FTS5_CONTENTLESS else ""
+            try:
+                connection.exec_driver_sql(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+                    f"clipboard, content, {options}"
+                    "tokenize='unicode61 remove_diacritics 2')"
+                )
+            except OperationalError:
+                logger.warning("SQLite was built without FTS5; search is disabled")
+                _available[str(engine.url)] = False
+                return
+        else:
+            connection.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+                "card_id INTEGER PRIMARY KEY REFERENCES cards (id) ON DELETE CASCADE, "
+                "clipboard_id VARCHAR NOT NULL, "
+                "document TSVECTOR NOT NULL)"
+            )
+            # Indexes of older releases kept a copy of the text
+            connection.exec_driver_sql(
+                f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS content"
+            )
+            connection.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{TABLE}_document "
+                f"ON {TABLE} USING gin (document)"
+            )
+            connection.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{TABLE}_clipboard_id "
+                f"ON {TABLE} (clipboard_id)"
+            )
+
+    _available[str(engine.url)] = True
+
+
+def index_cards(db, cards: Iterable[Tuple[int, str, str]]) -> None:
+    """Add or replace the index entries of (card_id, clipboard_id, content)"""
+    backend = _backend(db)
+    rows = [
+        {"card_id": card_id, "clipboard_id": clipboard_id, "content": content}
+        for card_id, clipboard_id, content in cards
+    ]
+    if backend is None or not rows:
+        return
+
+    if backend == "sqlite":
+        statement = text(
+            f"INSERT OR REPLACE INTO {TABLE} (rowid, clipboard, content) "
+            "VALUES (:card_id, :clipboard_id, :content)"
+        )
+    else:
+        statement = text(
+            f"INSERT INTO {TABLE} (card_id, clipboard_id, document) "
+            "VALUES (:card_id, :clipboard_id, "
+            "to_tsvector(CAST(:config AS regconfig), :content)) "
+            "ON CONFLICT (card_id) DO UPDATE SET document = excluded.document"
+        )
+        for row in rows:
+            row["config"] = SEARCH_PG_CONFIG
+    db.execute(statement, rows)
+
+
+def unindex_cards(db, card_ids: List[int]) -> None:
+    """Drop the index entries of cards about to be deleted"""
+    backend = _backend(db)
+    if backend is None or not card_ids:
+        return
+
+    column = "rowid" if backend == "sqlite" else "card_id"
+    db.execute(
+        text(f"DELETE FROM {TABLE} WHERE {column} IN :card_ids").bindparams(
+            bindparam("card_ids", expanding=True)
+        ),
+        {"card_ids": list(card_ids)},
+    )
+
+
+def unindex_clipboards(db, clipboard_ids: List[str]) -> None:
+    """Drop the index entries of all cards of clipboards about to be deleted"""
+    backend = _backend(db)
+    if backend is None or not clipboard_ids:
+        return
+
+    if backend == "sqlite":
+        # Found through the cards' clipboard index; the FTS column isn't exact
+        statement = text(
+            f"DELETE FROM {TABLE} WHERE rowid IN "
+            "(SELECT id FROM cards WHERE clipboard_id IN :clipboard_ids)"
+        )
+    else:
+        statement = text(f"DELETE FROM {TABLE} WHERE clipboard_id IN :clipboard_ids")
+    db.execute(
+        statement.bindparams(bindparam("clipboard_ids", expanding=True)),
+        {"clipboard_ids": list(clipboard_ids)},
+    )
+
+
+def count_indexed(db) -> Optional[int]:
+    """Number of indexed cards; None when the database has no index"""
+    if _backend(db) is None:
+        return None
+    return db.scalar(text(f"SELECT count(*) FROM {TABLE}"))
+
+
+def query_terms(query: str) -> List[str]:
+    return _WORDS.findall(query)[:SEARCH_MAX_TERMS]
+
+
+def search_cards(db, clipboard_id: str, query: str, limit: int, offset: int = 0):
+    """
+    Cards of a clipboard matching all words of `query`, best match first.
+    Returns up to `limit` dicts (card_id, user_name, version, created_at,
+    updated_at, snippet, score), plus one more if further results exist.
+    Raises SearchUnavailable when the database has no index.
+    """
+    backend = _backend(db)
+    if backend is None:
+        raise SearchUnavailable("Search is not available on this database")
+
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    params = {"clipboard_id": clipboard_id, "limit": limit + 1, "offset": offset}
+
+    if backend == "sqlite":
+        phrases = " ".join(f'"{term}"' for term in terms) + "*"
+        clipboard = clipboard_id.replace('"', '""')
+        params["match"] = f'clipboard : "{clipboard}" AND content : ({phrases})'
+        statement = text(
+            "SELECT cards.id AS card_id, cards.user_name, cards.version, "
+            "cards.created_at, cards.updated_at, "
+            f"-bm25({TABLE}, 0.0, 1.0) AS score "
+            f"FROM {TABLE} JOIN cards ON cards.id = {TABLE}.rowid "
+            f"WHERE {TABLE} MATCH :match AND cards.clipboard_id = :clipboard_id "
+            "ORDER BY score DESC, cards.id "
+            "LIMIT :limit OFFSET :offset"
+        )
+    else:
+        params["tsquery"] = " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+        params["config"] = SEARCH_PG_CONFIG
+        statement = text(
+            "SELECT cards.id AS card_id, cards.user_name, cards.version, "
+            "cards.created_at, cards.updated_at, "
+            "ts_rank_cd(indexed.document, query) AS score "
+            f"FROM {TABLE} AS indexed "
+            "JOIN cards ON cards.id = indexed.card_id, "
+            "to_tsquery(CAST(:config AS regconfig), :tsquery) AS query "
+            "WHERE indexed.clipboard_id = :clipboard_id AND indexed.document @@ query "
+            "ORDER BY score DESC, cards.id "
+            "LIMIT :limit OFFSET :offset"
+        )
+
+    statement = statement.columns(created_at=DateTime, updated_at=DateTime)
+    rows = db.execute(statement, params).all()
+    contents = _contents(db, [row.card_id for row in rows])
+    return [
+        dict(row._mapping, snippet=highlight(_snippet(contents[row.card_id], terms)))
+        for row in rows
+    ]
+
+
+def _contents(db, card_ids: List[int]) -> Dict[int, str]:
+    """Text of cards, read from their blobs"""
+    from . import database
+
+    card, blob = database.Card, database.CardBlob
+    rows = db.execute(
+        select(card.id, blob.content, card.legacy_content)
+        .outerjoin(blob, blob.hash == card.content_hash)
+        .where(card.id.in_(card_ids))
+    )
+    return {
+        card_id: content if content is not None else legacy or ""
+        for card_id, content, legacy in rows
+    }
+
+
+def _fold(word: str) -> str:
+    """Lowercase a word and strip its diacritics, like the SQLite tokenizer"""
+    decomposed = unicodedata.normalize("NFKD", word.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _snippet(content: str, terms: List[str]) -> str:
+    """
+    About SEARCH_SNIPPET_WORDS words of `content` from just before its first
+    match, with the words matching `terms` between selection placeholders
+    """
+    words = list(_WORDS.finditer(content))
+    exact = {_fold(term) for term in terms[:-1]}
+    prefix = _fold(terms[-1]) if terms else ""
+    hits = [
+        index
+        for index, word in enumerate(words)
+        if _fold(word.group()) in exact or _fold(word.group()).startswith(prefix)
+    ]
+
+    # Start a few words before the first match, without running past the end
+    first = max(0, hits[0] - SEARCH_SNIPPET_WORDS // 4) if hits else 0
+    last = min(len(words), first + SEARCH_SNIPPET_WORDS)
+    first = max(0, last - SEARCH_SNIPPET_WORDS)
+
+    position = words[first].start() if first else 0
+    end = words[last - 1].end() if last < len(words) else len(content)
+    parts = ["…"] if first else []
+    for index in hits:
+        if first <= index < last:
+            word = words[index]
+            parts += [
+                content[position : word.start()],
+                _SELECTION_START,
+                word.group(),
+                _SELECTION_END,
+            ]
+            position = word.end()
+    parts.append(content[position:end])
+    if last < len(words):
+        parts.append("…")
+    return "".join(parts)
+
+
+def highlight(snippet: str) -> str:
+    """Escape a snippet for HTML, then turn its match placeholders into tags"""
+    return (
+        html.escape(snippet)
+        .replace(_SELECTION_START, SEARCH_MARK_START)
+        .replace(_SELECTION_END, SEARCH_MARK_END)
+    )
@@ -0,0 +1,46 @@
+"""
+Compact text deltas used by PATCH /cards/{card_id}.
+
+A delta is a list of operations walked from the start of the text:
+- a positive int retains that many characters
+- a negative int deletes that many characters
+- a string inserts itself
+
+Whatever follows the last operation is kept. Lengths count Unicode code
+points, which is what Python string indexing and JavaScript `Array.from`
+both use.
+"""
+
+from typing import List, Union
+
+DeltaOp = Union[int, str]
+
+
+def apply_text_delta(text: str, ops: List[DeltaOp]) -> str:
+    """Apply a delta to `text`; raises ValueError if it doesn't fit"""
+    parts = []
+    position = 0
+
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            if position + op > len(text):
+                raise ValueError(
+                    f"Retain of {op} at offset {position} runs past the end "
+                    f"of the text ({len(text)} characters)"
+                )
+            parts.append(text[position : position + op])
+            position += op
+        elif op < 0:
+            if position - op > len(text):
+                raise ValueError(
+                    f"Delete of {-op} at offset {position} runs past the end "
+                    f"of the text ({len(text)} characters)"
+                )
+            position -= op
+        else:
+            raise ValueError("Delta operations can't be 0")
+
+    parts.append(text[position:])
+    return "".join(parts)
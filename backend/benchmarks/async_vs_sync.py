@@ -0,0 +1,100 @@
+"""
+Compare request throughput of the sync and async (ASYNC_DB) modes.
+
+Starts a uvicorn server per mode against a fresh SQLite database, drives it
+with concurrent HTTP clients for a fixed duration, and prints the results
+as JSON.
+
+Usage:
+    python benchmarks/async_vs_sync.py
+    python benchmarks/async_vs_sync.py --concurrency 64 --duration 20
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+import httpx
+
+from bench_utils import start_server
+
+
+async def drive(base_url, concurrency, duration, write_ratio):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        clipboard_id = (await client.post("/clipboard/new")).json()["id"]
+        for i in range(20):
+            await client.post(
+                f"/clipboard/{clipboard_id}/cards", json={"content": f"card {i}"}
+            )
+
+        stop_at = time.monotonic() + duration
+        counts = {"requests": 0, "errors": 0}
+        write_every = round(1 / write_ratio) if write_ratio > 0 else 0
+
+        async def worker(worker_id):
+            n = 0
+            while time.monotonic() < stop_at:
+                n += 1
+                if write_every and n % write_every == 0:
+                    response = await client.post(
+                        f"/clipboard/{clipboard_id}/cards",
+                        json={"content": f"worker {worker_id} write {n}"},
+                    )
+                else:
+                    response = await client.get(f"/clipboard/{clipboard_id}")
+                counts["requests"] += 1
+                if response.status_code >= 400:
+                    counts["errors"] += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return {
+        "requests": counts["requests"],
+        "errors": counts["errors"],
+        "seconds": round(elapsed, 3),
+        "rps": round(counts["requests"] / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.1, help="Share of requests that write"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    results = {}
+    for mode, async_db in (("sync", False), ("async", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_uri = f"sqlite:///{tmp}/bench.db"
+            server = start_server(
+                args.port,
+                {"DATABASE_URI": database_uri, "ASYNC_DB": "1" if async_db else "0"},
+            )
+            try:
+                results[mode] = asyncio.run(
+                    drive(
+                        f"http://127.0.0.1:{args.port}",
+                        args.concurrency,
+                        args.duration,
+                        args.write_ratio,
+                    )
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Helpers shared by the benchmark scripts in this directory.
+"""
+
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+
+def summarize(latencies: List[float], elapsed: Optional[float] = None) -> Dict:
+    """Latency percentiles in milliseconds, plus throughput if `elapsed` is given"""
+    ordered = sorted(latencies)
+    count = len(ordered)
+
+    def percentile(p):
+        if not count:
+            return 0.0
+        return round(ordered[min(int(count * p / 100), count - 1)] * 1000, 3)
+
+    summary = {
+        "count": count,
+        "mean_ms": round(sum(ordered) / count * 1000, 3) if count else 0.0,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1] * 1000, 3) if count else 0.0,
+    }
+    if elapsed is not None:
+        summary["per_second"] = round(count / elapsed, 1) if elapsed else 0.0
+    return summary
+
+
+def run_metadata() -> Dict:
+    """Where and on what a benchmark ran, to tell result files apart"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def start_server(port: int, env: Dict[str, str], workers: int = 1):
+    """Start the API with uvicorn and wait until /health answers"""
+    import httpx
+
+    # All load comes from one address, so per-client rate limits are off
+    # unless the environment asks for them
+    server_env = {"RATE_LIMIT_BACKEND": "none"}
+    server_env.update(os.environ)
+    server_env.update(env)
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=BACKEND_DIR,
+        env=server_env,
+    )
+
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError("Server did not start in time")
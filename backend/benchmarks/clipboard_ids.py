@@ -0,0 +1,157 @@
+"""
+Measure clipboard creation throughput with many existing clipboards.
+
+Seeds a fresh SQLite database with --existing clipboards (1M by default),
+then creates --creates more with the previous lookup-then-insert loop and
+with the conflict-checked allocator in app/ids.py, and prints the results
+as JSON.
+
+Usage:
+    python benchmarks/clipboard_ids.py
+    python benchmarks/clipboard_ids.py --existing 5000000 --creates 20000
+    python benchmarks/clipboard_ids.py --threads 8
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+SEED_BATCH = 50_000
+
+
+def seed(engine, existing):
+    """Insert `existing` clipboards with random 6 character IDs"""
+    alphabet = string.ascii_letters + string.digits
+    now = datetime.utcnow().isoformat(" ")
+    seen = set()
+    connection = engine.raw_connection()
+    try:
+        while len(seen) < existing:
+            batch = []
+            while len(batch) < SEED_BATCH and len(seen) < existing:
+                clipboard_id = "".join(random.choices(alphabet, k=6))
+                if clipboard_id not in seen:
+                    seen.add(clipboard_id)
+                    batch.append((clipboard_id, now, now, now))
+            connection.cursor().executemany(
+                "INSERT INTO clipboards (id, created_at, updated_at, last_accessed, "
+                "version, log_floor) VALUES (?, ?, ?, ?, 0, 0)",
+                batch,
+            )
+            connection.commit()
+    finally:
+        connection.close()
+
+
+def legacy_create(db, database):
+    """The previous create_clipboard: look IDs up until one is free"""
+    alphabet = string.ascii_letters + string.digits
+    clipboard_id = "".join(random.choices(alphabet, k=6))
+    while db.get(database.Clipboard, clipboard_id):
+        clipboard_id = "".join(random.choices(alphabet, k=6))
+    db.add(database.Clipboard(id=clipboard_id))
+    db.commit()
+
+
+def run(label, create, session_factory, creates, threads):
+    latencies = []
+    errors = []
+    per_thread = creates // threads
+
+    def worker():
+        db = session_factory()
+        try:
+            for _ in range(per_thread):
+                started = time.perf_counter()
+                try:
+                    create(db)
+                except Exception as e:  # races surface here
+                    db.rollback()
+                    errors.append(type(e).__name__)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            db.close()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "mode": label,
+        "creates": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "creates_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--existing", type=int, default=1_000_000)
+    parser.add_argument("--creates", type=int, default=10_000)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URI"] = f"sqlite:///{tmp}/bench.db"
+        os.environ["CLEANUP_SCHEDULER_ENABLED"] = "0"
+
+        from app import crud, database
+        from app.ids import id_allocator
+
+        database.init_db()
+        started = time.perf_counter()
+        seed(database.engine, args.existing)
+        seeded_in = time.perf_counter() - started
+
+        results = {
+            "existing": args.existing,
+            "seed_seconds": round(seeded_in, 1),
+            "threads": args.threads,
+            "runs": [
+                run(
+                    "lookup_loop",
+                    lambda db: legacy_create(db, database),
+                    database.SessionLocal,
+                    args.creates,
+                    args.threads,
+                ),
+                run(
+                    "insert_on_conflict",
+                    crud.create_clipboard,
+                    database.SessionLocal,
+                    args.creates,
+                    args.threads,
+                ),
+            ],
+        }
+        with database.SessionLocal() as db:
+            results["allocator"] = {
+                "id_length": id_allocator.current_length(db),
+                "collisions": id_allocator.collisions,
+            }
+        database.engine.dispose()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Micro-benchmarks of the crud functions and of clipboard serialization.
+
+The crud cases run against a temporary SQLite database (or --database-uri);
+each one creates the data it needs up front and then times every call. The
+serialization cases time `ClipboardResponse` validation and JSON encoding
+of clipboards with varying card counts and sizes. Results are printed (or
+written to --output) as JSON.
+
+Usage:
+    python benchmarks/crud_micro.py
+    python benchmarks/crud_micro.py --iterations 2000 --output crud.json
+    python benchmarks/crud_micro.py --only get_card_page,patch_card
+    python benchmarks/crud_micro.py --cards 10,100,1000 --sizes 64,4096
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench_utils import BACKEND_DIR, run_metadata, summarize
+
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Card count times card size above this is skipped by the serialization cases
+MAX_SERIALIZED_BYTES = 32 * 1024 * 1024
+
+
+def time_calls(function, iterations):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        function(i)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def crud_cases(crud, database, schemas, iterations):
+    """(name, setup) pairs; setup gets a session and returns the timed call"""
+
+    def clipboard_with_cards(db, count):
+        clipboard = crud.create_clipboard(db)
+        if count:
+            operations = [
+                schemas.CardOperation(op="create", content=f"card {i}")
+                for i in range(count)
+            ]
+            crud.apply_card_batch(db, clipboard.id, operations)
+        return clipboard.id
+
+    def create_clipboard(db):
+        return lambda i: crud.create_clipboard(db)
+
+    def get_clipboard(db):
+        clipboard_id = clipboard_with_cards(db, 0)
+        return lambda i: crud.get_clipboard(db, clipboard_id)
+
+    def create_card(db):
+        clipboard_id = clipboard_with_cards(db, 0)
+        return lambda i: crud.create_card(db, clipboard_id, f"card {i}", "bench")
+
+    def get_cards(db):
+        clipboard_id = clipboard_with_cards(db, 100)
+        return lambda i: crud.get_cards(db, clipboard_id)
+
+    def get_card_page(db):
+        clipboard_id = clipboard_with_cards(db, 500)
+        cursors = [None]
+
+        def call(i):
+            cards, cursor = crud.get_card_page(db, clipboard_id, cursors[-1], 50)
+            cursors.append(cursor)
+
+        return call
+
+    def update_card(db):
+        clipboard_id = clipboard_with_cards(db, 1)
+        card_id = crud.get_cards(db, clipboard_id)[0].id
+        return lambda i: crud.update_card(db, card_id, f"updated {i}")
+
+    def patch_card(db):
+        clipboard_id = clipboard_with_cards(db, 0)
+        card = crud.create_card(db, clipboard_id, "x" * 10_000)
+        state = {"version": card.version}
+
+        def call(i):
+            patched = crud.patch_card(db, card.id, state["version"], [5000, "y", -1])
+            state["version"] = patched.version
+
+        return call
+
+    def delete_card(db):
+        clipboard_id = clipboard_with_cards(db, iterations)
+        card_ids = [card.id for card in crud.get_cards(db, clipboard_id)]
+        return lambda i: crud.delete_card(db, card_ids[i])
+
+    def apply_card_batch(db):
+        clipboard_id = clipboard_with_cards(db, 0)
+        operations = [
+            schemas.CardOperation(op="create", content=f"batch card {i}")
+            for i in range(50)
+        ]
+        return lambda i: crud.apply_card_batch(db, clipboard_id, operations)
+
+    def get_changes(db):
+        clipboard_id = clipboard_with_cards(db, 200)
+        clipboard = crud.get_clipboard(db, clipboard_id)
+        return lambda i: crud.get_changes(db, clipboard, clipboard.version - 50)
+
+    def delete_clipboard(db):
+        clipboard_ids = [clipboard_with_cards(db, 10) for _ in range(iterations)]
+        return lambda i: crud.delete_clipboard(db, clipboard_ids[i])
+
+    return [
+        ("create_clipboard", create_clipboard),
+        ("get_clipboard", get_clipboard),
+        ("create_card", create_card),
+        ("get_cards[100]", get_cards),
+        ("get_card_page[50 of 500]", get_card_page),
+        ("update_card", update_card),
+        ("patch_card[10KB]", patch_card),
+        ("delete_card", delete_card),
+        ("apply_card_batch[50 creates]", apply_card_batch),
+        ("get_changes[50 of 200]", get_changes),
+        ("delete_clipboard[10 cards]", delete_clipboard),
+    ]
+
+
+def serialization_cases(crud, schemas, db, card_counts, sizes, iterations):
+    results = []
+    for count in card_counts:
+        for size in sizes:
+            if count * size > MAX_SERIALIZED_BYTES:
+                continue
+
+            clipboard = crud.create_clipboard(db)
+            if count:
+                content = "x" * size
+                operations = [
+                    schemas.CardOperation(op="create", content=f"{i:08d}{content}")
+                    for i in range(count)
+                ]
+                crud.apply_card_batch(db, clipboard.id, operations)
+            db.expire_all()
+            clipboard = crud.get_clipboard(db, clipboard.id)
+            clipboard.cards  # load outside the timed calls
+
+            # Fewer rounds for big payloads, so every case takes similar time
+            rounds = max(5, min(iterations, iterations * 100 // max(count, 1)))
+            body = crud.serialize_clipboard(clipboard)
+            model = schemas.ClipboardResponse.model_validate(clipboard)
+            results.append(
+                {
+                    "cards": count,
+                    "card_bytes": size,
+                    "body_bytes": len(body),
+                    "validate": time_calls(
+                        lambda i: schemas.ClipboardResponse.model_validate(clipboard),
+                        rounds,
+                    ),
+                    "dump_json": time_calls(lambda i: model.model_dump_json(), rounds),
+                    "serialize_clipboard": time_calls(
+                        lambda i: crud.serialize_clipboard(clipboard), rounds
+                    ),
+                    # Query included, unlike the ORM variants above
+                    "get_clipboard_json": time_calls(
+                        lambda i: crud.get_clipboard_json(db, clipboard.id), rounds
+                    ),
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument(
+        "--only", help="Comma-separated crud case name prefixes to run", default=None
+    )
+    parser.add_argument("--cards", default="0,10,100,1000")
+    parser.add_argument("--sizes", default="64,4096,65536")
+    parser.add_argument(
+        "--database-uri",
+        help="Run against this database instead of a temporary SQLite file",
+    )
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URI"] = args.database_uri or f"sqlite:///{tmp}/bench.db"
+        # Measure the functions themselves, not the response cache
+        os.environ.setdefault("CACHE_BACKEND", "none")
+
+        from app import crud, database, schemas
+        from app.access import tracker
+
+        database.init_db()
+        results = {"meta": run_metadata(), "database": database.engine.dialect.name}
+        results["meta"]["iterations"] = args.iterations
+
+        only = args.only.split(",") if args.only else None
+        results["crud"] = {}
+        for name, setup in crud_cases(crud, database, schemas, args.iterations):
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            db = database.SessionLocal()
+            try:
+                call = setup(db)
+                results["crud"][name] = time_calls(call, args.iterations)
+            finally:
+                db.close()
+            print(f"  {name}: done", file=sys.stderr)
+
+        db = database.SessionLocal()
+        try:
+            results["serialization"] = serialization_cases(
+                crud,
+                schemas,
+                db,
+                [int(n) for n in args.cards.split(",")],
+                [int(n) for n in args.sizes.split(",")],
+                args.iterations,
+            )
+        finally:
+            db.close()
+
+        tracker.close()
+        database.engine.dispose()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
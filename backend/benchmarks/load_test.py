@@ -0,0 +1,194 @@
+"""
+Drive the API over HTTP with concurrent clients and report latency and RPS.
+
+Starts a uvicorn server per backend (a temporary SQLite database, plus
+PostgreSQL when --postgres-url is given), seeds a set of clipboards, and runs
+each load profile for --duration seconds with --concurrency clients. Results
+(p50/p95/p99 latency and requests per second, overall and per operation) are
+printed, or written to --output, as JSON.
+
+Profiles:
+    create       only POST /clipboard/new
+    read-heavy   95% GET /clipboard/{id}, 5% new cards
+    write-heavy  20% reads, 60% new cards, 20% card updates
+    mixed        70% reads, 15% new cards, 10% card updates, 5% new clipboards
+
+Usage:
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --profiles read-heavy,mixed --duration 30
+    python benchmarks/load_test.py --postgres-url postgresql://localhost/bench
+    python benchmarks/load_test.py --async --output load.json
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+from bench_utils import run_metadata, start_server, summarize
+
+PROFILES = {
+    "create": {"create_clipboard": 100},
+    "read-heavy": {"read_clipboard": 95, "create_card": 5},
+    "write-heavy": {"read_clipboard": 20, "create_card": 60, "update_card": 20},
+    "mixed": {
+        "read_clipboard": 70,
+        "create_card": 15,
+        "update_card": 10,
+        "create_clipboard": 5,
+    },
+}
+
+SEED_CLIPBOARDS = 20
+SEED_CARDS = 20
+
+
+async def seed(client):
+    """Create the clipboards and cards the profiles read and update"""
+    clipboard_ids, card_ids = [], []
+    for _ in range(SEED_CLIPBOARDS):
+        clipboard_id = (await client.post("/clipboard/new")).json()["id"]
+        clipboard_ids.append(clipboard_id)
+        for i in range(SEED_CARDS):
+            response = await client.post(
+                f"/clipboard/{clipboard_id}/cards", json={"content": f"card {i}"}
+            )
+            card_ids.append(response.json()["id"])
+    return clipboard_ids, card_ids
+
+
+async def drive(base_url, profile, concurrency, duration, content_size):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        clipboard_ids, card_ids = await seed(client)
+        content = "x" * content_size
+
+        operations = {
+            "create_clipboard": lambda rng: client.post("/clipboard/new"),
+            "read_clipboard": lambda rng: client.get(
+                f"/clipboard/{rng.choice(clipboard_ids)}"
+            ),
+            "create_card": lambda rng: client.post(
+                f"/clipboard/{rng.choice(clipboard_ids)}/cards",
+                json={"content": content, "user_name": "load"},
+            ),
+            "update_card": lambda rng: client.put(
+                f"/cards/{rng.choice(card_ids)}", json={"content": content}
+            ),
+        }
+        names = list(PROFILES[profile])
+        weights = [PROFILES[profile][name] for name in names]
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        stop_at = time.monotonic() + duration
+
+        async def worker(worker_id):
+            rng = random.Random(worker_id)
+            while time.monotonic() < stop_at:
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await operations[name](rng)
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                latencies[name].append(time.perf_counter() - started)
+                if failed:
+                    errors[name] += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    everything = [latency for values in latencies.values() for latency in values]
+    return {
+        "requests": len(everything),
+        "errors": sum(errors.values()),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(everything) / elapsed, 1),
+        "latency": summarize(everything),
+        "operations": {
+            name: dict(summarize(values, elapsed), errors=errors[name])
+            for name, values in sorted(latencies.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument(
+        "--content-size", type=int, default=256, help="Bytes per written card"
+    )
+    parser.add_argument(
+        "--postgres-url",
+        help="Also run against this (empty) PostgreSQL database",
+    )
+    parser.add_argument(
+        "--async", dest="async_db", action="store_true", help="Run with ASYNC_DB=1"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    profiles = args.profiles.split(",")
+    unknown = set(profiles) - set(PROFILES)
+    if unknown:
+        parser.error(f"unknown profiles: {', '.join(sorted(unknown))}")
+
+    results = {"meta": run_metadata(), "results": {}}
+    results["meta"].update(
+        concurrency=args.concurrency,
+        duration=args.duration,
+        content_size=args.content_size,
+        async_db=args.async_db,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [("sqlite", f"sqlite:///{tmp}/load.db")]
+        if args.postgres_url:
+            backends.append(("postgresql", args.postgres_url))
+
+        for backend, database_uri in backends:
+            server = start_server(
+                args.port,
+                {
+                    "DATABASE_URI": database_uri,
+                    "ASYNC_DB": "1" if args.async_db else "0",
+                    "CLEANUP_SCHEDULER_ENABLED": "0",
+                },
+            )
+            try:
+                for profile in profiles:
+                    results["results"][f"{backend}/{profile}"] = asyncio.run(
+                        drive(
+                            f"http://127.0.0.1:{args.port}",
+                            profile,
+                            args.concurrency,
+                            args.duration,
+                            args.content_size,
+                        )
+                    )
+            finally:
+                server.terminate()
+                server.wait()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
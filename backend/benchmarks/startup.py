@@ -0,0 +1,174 @@
+"""
+Cold start benchmark: how long a fresh process takes to serve its first
+request, as on a serverless deploy.
+
+Every run starts a new Python process, which times the import of
+`app.main` and then two `GET /clipboard/{id}` requests sent straight to the
+ASGI app (no server, no lifespan events). The first request includes engine
+creation, the schema check and the first connection. One more run against
+an empty database times schema creation. Results are printed (or written
+to --output) as JSON.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --output startup.json
+    python benchmarks/startup.py --database-uri postgresql://localhost/bench
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_utils import BACKEND_DIR, run_metadata, summarize
+
+# Cards of the clipboard read by the measured requests
+SEED_CARDS = 20
+
+
+def _get(app, path):
+    """Send one GET request to an ASGI app and return its status code"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    asyncio.get_event_loop().run_until_complete(app(scope, receive, send))
+    return messages[0]["status"]
+
+
+def child_seed():
+    from app import crud, database
+
+    db = database.SessionLocal()
+    try:
+        clipboard = crud.create_clipboard(db)
+        for i in range(SEED_CARDS):
+            crud.create_card(db, clipboard.id, f"card {i}")
+        print(json.dumps({"clipboard_id": clipboard.id}))
+    finally:
+        db.close()
+
+
+def child_measure(clipboard_id):
+    started = time.perf_counter()
+    from app.main import app
+
+    imported = time.perf_counter()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    status = _get(app, f"/clipboard/{clipboard_id}")
+    first = time.perf_counter()
+    _get(app, f"/clipboard/{clipboard_id}")
+    second = time.perf_counter()
+
+    # What the lifespan shutdown would do; aiosqlite threads block the exit
+    from app import database
+    from app.access import tracker
+
+    tracker.close()
+    database.dispose_engine()
+    loop.run_until_complete(database.dispose_async_engine())
+
+    print(
+        json.dumps(
+            {
+                "status": status,
+                "import": imported - started,
+                "first_request": first - imported,
+                "second_request": second - first,
+            }
+        )
+    )
+
+
+def run_child(env, *args):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", *args],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--database-uri",
+        help="Run against this database instead of a temporary SQLite file",
+    )
+    parser.add_argument(
+        "--async", dest="async_db", action="store_true", help="Set ASYNC_DB"
+    )
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, str(BACKEND_DIR))
+        if args.child[0] == "seed":
+            child_seed()
+        else:
+            child_measure(args.child[1])
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, ASYNC_DB="true" if args.async_db else "false")
+        env["DATABASE_URI"] = args.database_uri or f"sqlite:///{tmp}/bench.db"
+
+        # First process against an empty database: creates the schema
+        empty = run_child(env, "seed")
+        clipboard_id = empty.pop("clipboard_id")
+
+        runs = [run_child(env, "measure", clipboard_id) for _ in range(args.runs)]
+        if any(run["status"] != 200 for run in runs):
+            raise RuntimeError(f"Unexpected status: {runs[0]['status']}")
+
+    results = {
+        "meta": run_metadata(),
+        "async": args.async_db,
+        "runs": args.runs,
+        "seed_process_ms": round(empty["process"] * 1000, 3),
+    }
+    results["meta"]["database"] = (args.database_uri or "sqlite").split(":")[0]
+    for name in ("process", "import", "first_request", "second_request"):
+        results[name] = summarize([run[name] for run in runs])
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,28 +5,52 @@ This script can be run as a cron job or scheduled task to automatically
 clean up old and unused clipboards to free up database space.
 
 Usage:
+    python cleanup.py --archive 30 # Archive clipboards idle for 30 days
+    python cleanup.py --purge-archive 365  # Delete archived clipboards idle for a year
     python cleanup.py --old 7      # Delete clipboards older than 7 days
     python cleanup.py --empty      # Delete empty clipboards
+    python cleanup.py --changes 24 # Compact change log entries older than 24 hours
     python cleanup.py --all        # Run all cleanup tasks
 """
 
 import argparse
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from app import database
-from app.database import cleanup_empty_clipboards, cleanup_old_clipboards
+from app import archive, database
+from app.database import (
+    cleanup_empty_clipboards,
+    cleanup_old_clipboards,
+    compact_change_log,
+    count_empty_clipboards,
+    count_old_clipboards,
+)
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Cleanup old and unused clipboards from the database"
     )
+    parser.add_argument(
+        "--archive",
+        type=int,
+        metavar="DAYS",
+        help="Move clipboards not accessed in specified days to the archive",
+        default=None,
+    )
     parser.add_argument(
         "--old",
         type=int,
         metavar="DAYS",
-        help="Delete clipboards not accessed in specified days (default: 7)",
+        help="Delete clipboards not accessed in specified days (default: 7); "
+        "archived ones are kept",
+        default=None,
+    )
+    parser.add_argument(
+        "--purge-archive",
+        type=int,
+        metavar="DAYS",
+        help="Delete archived clipboards not accessed in specified days",
         default=None,
     )
     parser.add_argument(
@@ -34,11 +58,24 @@ def main():
         action="store_true",
         help="Delete clipboards with no cards",
     )
+    parser.add_argument(
+        "--changes",
+        type=int,
+        metavar="HOURS",
+        help="Compact card change log entries older than specified hours",
+        default=None,
+    )
     parser.add_argument(
         "--all",
         action="store_true",
         help="Run all cleanup tasks (old + empty)",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=database.CLEANUP_BATCH_SIZE,
+        help="Clipboards deleted or archived per transaction (default: %(default)s)",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -48,7 +85,14 @@ def main():
     args = parser.parse_args()
 
     # If no arguments provided, show help
-    if not args.old and not args.empty and not args.all:
+    if (
+        not args.archive
+        and not args.old
+        and not args.purge_archive
+        and not args.empty
+        and args.changes is None
+        and not args.all
+    ):
         parser.print_help()
         sys.exit(0)
 
@@ -58,6 +102,7 @@ def main():
 
     try:
         total_deleted = 0
+        total_archived = 0
 
         print("=" * 60)
         print("Shared Clipboard - Cleanup Script")
@@ -69,30 +114,68 @@ def main():
             print("DRY RUN MODE - No actual deletions will occur")
             print()
 
+        # Archive idle clipboards, before old ones are deleted
+        if args.archive:
+            print(f"Archiving clipboards not accessed in {args.archive} days...")
+
+            if args.dry_run:
+                count = archive.count_idle_clipboards(db, args.archive)
+                print(f"  Would archive {count} idle clipboard(s)")
+            else:
+                count = archive.archive_idle_clipboards(
+                    db, args.archive, batch_size=args.batch_size
+                )
+                print(f"  Archived {count} idle clipboard(s)")
+                total_archived += count
+
+            print()
+
+        # Delete archived clipboards past their retention
+        if args.purge_archive:
+            days = args.purge_archive
+            print(f"Deleting archived clipboards not accessed in {days} days...")
+
+            if args.dry_run:
+                count = archive.count_old_archived(db, days)
+                print(f"  Would delete {count} archived clipboard(s)")
+            else:
+                count = archive.purge_old_archived(
+                    db, days, batch_size=args.batch_size
+                )
+                print(f"  Deleted {count} archived clipboard(s)")
+                total_deleted += count
+
+            print()
+
         # Cleanup old clipboards
         if args.old or args.all:
             days = args.old if args.old else 7
             print(f"Cleaning up clipboards not accessed in {days} days...")
+            if args.archive and days <= args.archive:
+                print(
+                    f"  WARNING: --old {days} <= --archive {args.archive}: clipboards "
+                    "are deleted before they can be archived"
+                )
 
             if args.dry_run:
-                from datetime import timedelta
-
-                cutoff_date = datetime.utcnow() - timedelta(days=days)
-                old_clipboards = (
-                    db.query(database.Clipboard)
-                    .filter(database.Clipboard.last_accessed < cutoff_date)
-                    .all()
-                )
-                count = len(old_clipboards)
+                count = count_old_clipboards(db, days)
                 print(f"  Would delete {count} old clipboard(s)")
-                for clipboard in old_clipboards[:5]:  # Show first 5
+                sample = (
+                    db.query(database.Clipboard.id, database.Clipboard.last_accessed)
+                    .filter(
+                        database.Clipboard.last_accessed
+                        < datetime.utcnow() - timedelta(days=days)
+                    )
+                    .limit(5)
+                )
+                for clipboard in sample:  # Show first 5
                     print(
                         f"    - {clipboard.id} (last accessed: {clipboard.last_accessed})"
                     )
                 if count > 5:
                     print(f"    ... and {count - 5} more")
             else:
-                count = cleanup_old_clipboards(db, days)
+                count = cleanup_old_clipboards(db, days, batch_size=args.batch_size)
                 print(f"  Deleted {count} old clipboard(s)")
                 total_deleted += count
 
@@ -103,30 +186,44 @@ def main():
             print("Cleaning up empty clipboards (no cards)...")
 
             if args.dry_run:
-                empty_clipboards = (
-                    db.query(database.Clipboard)
+                count = count_empty_clipboards(db)
+                print(f"  Would delete {count} empty clipboard(s)")
+                sample = (
+                    db.query(database.Clipboard.id, database.Clipboard.created_at)
                     .filter(~database.Clipboard.cards.any())
-                    .all()
+                    .limit(5)
                 )
-                count = len(empty_clipboards)
-                print(f"  Would delete {count} empty clipboard(s)")
-                for clipboard in empty_clipboards[:5]:  # Show first 5
+                for clipboard in sample:  # Show first 5
                     print(f"    - {clipboard.id} (created: {clipboard.created_at})")
                 if count > 5:
                     print(f"    ... and {count - 5} more")
             else:
-                count = cleanup_empty_clipboards(db)
+                count = cleanup_empty_clipboards(db, batch_size=args.batch_size)
                 print(f"  Deleted {count} empty clipboard(s)")
                 total_deleted += count
 
             print()
 
+        # Compact the change log
+        if args.changes is not None:
+            print(f"Compacting change log entries older than {args.changes} hours...")
+
+            if args.dry_run:
+                print("  Skipped in dry run")
+            else:
+                count = compact_change_log(db, args.changes)
+                print(f"  Removed {count} change log entr{'y' if count == 1 else 'ies'}")
+
+            print()
+
         # Summary
         print("=" * 60)
         if args.dry_run:
             print("DRY RUN COMPLETE - No changes made")
         else:
             print(f"CLEANUP COMPLETE - Total deleted: {total_deleted} clipboard(s)")
+            if args.archive:
+                print(f"Total archived: {total_archived} clipboard(s)")
         print(f"Finished at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("=" * 60)
 
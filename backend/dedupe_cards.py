@@ -0,0 +1,126 @@
+"""
+Move card content written before content-addressed storage into the shared
+blob table.
+
+Cards created since then already point at a blob; older cards keep their
+text in the legacy content column until this script (or their next edit)
+moves it. Works in batches, one transaction per batch, and can be stopped
+and rerun at any time.
+
+Usage:
+    python dedupe_cards.py                  # Move all legacy card content
+    python dedupe_cards.py --dry-run        # Count cards left to move
+    python dedupe_cards.py --batch-size 200
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, update
+
+from app import database
+
+
+def dedupe(db, batch_size, pause=0.0):
+    """Point legacy cards at blobs in batches; returns the number moved"""
+    cards = database.Card.__table__
+    moved = 0
+
+    while True:
+        rows = db.execute(
+            select(cards.c.id, cards.c.content)
+            .where(cards.c.content_hash.is_(None))
+            .order_by(cards.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        hashes = database.acquire_blobs(db, [content or "" for _, content in rows])
+        # Same content, so updated_at and the card version stay as they are
+        db.execute(
+            update(cards)
+            .where(cards.c.id == bindparam("card_id"))
+            .values(
+                content=None,
+                content_hash=bindparam("blob_hash"),
+                updated_at=cards.c.updated_at,
+            ),
+            [
+                {"card_id": card_id, "blob_hash": blob_hash}
+                for (card_id, _), blob_hash in zip(rows, hashes)
+            ],
+        )
+        db.commit()
+
+        moved += len(rows)
+        print(f"  ... moved {moved} card(s), up to card {rows[-1][0]}")
+
+        if pause:
+            time.sleep(pause)
+
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move legacy card content into deduplicated blob storage"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Cards moved per transaction (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pause",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Sleep between batches to limit load (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the cards that still need moving",
+    )
+
+    args = parser.parse_args()
+
+    database.init_db()
+    db = database.SessionLocal()
+
+    try:
+        print("=" * 60)
+        print("Shared Clipboard - Deduplicate Card Content")
+        print("=" * 60)
+        print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print()
+
+        if args.dry_run:
+            stats = database.blob_stats(db)
+            print(f"Cards still holding their own content: {stats['legacy_cards']}")
+        else:
+            moved = dedupe(db, args.batch_size, args.pause)
+            stats = database.blob_stats(db)
+            print()
+            print(f"Moved {moved} card(s)")
+
+        print(
+            f"Blobs: {stats['blobs']}, stored {stats['stored_bytes']} bytes for "
+            f"{stats['logical_bytes']} referenced (ratio {stats['dedup_ratio']:.2f})"
+        )
+        print(f"Finished at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
+
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
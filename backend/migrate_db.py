@@ -1,77 +1,128 @@
 """
-Database migration script to add last_accessed column to existing clipboards.
+Database migration script: brings databases created by older releases up
+to date with the current schema. Works on SQLite and PostgreSQL.
 
-Run this script once to update your existing database schema.
+Applies the migrations of app/migrations.py that the database hasn't
+recorded yet, in order, without taking the tables offline: backfills run
+in batches of rows, one transaction per batch, and PostgreSQL indexes are
+built concurrently. Safe to rerun after an interruption. Run
+dedupe_cards.py afterwards to move existing card content into the shared
+blob table.
 
 Usage:
-    python migrate_db.py
+    python migrate_db.py                  # Apply all pending migrations
+    python migrate_db.py --dry-run        # Show what would be done
+    python migrate_db.py --to 2           # Stop after migration 2
+    python migrate_db.py --batch-size 500 --pause 0.1
 """
 
-import sqlite3
-from datetime import datetime
-
-
-def migrate():
-    """Add last_accessed column to clipboards table"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import inspect
+
+from app import database, migrations
+
+
+def print_plan(context, target):
+    """What a run would do; only reads the database"""
+    existing = set(inspect(context.engine).get_table_names())
+    if database.Clipboard.__tablename__ not in existing:
+        print("✓ New database: the current schema would be created, with")
+        print("  every migration recorded as applied")
+        return
+
+    for table in database.Base.metadata.sorted_tables:
+        if table.name not in existing:
+            print(f"Create table {table.name}")
+
+    pending = migrations.plan(context, target)
+    if not pending:
+        print("✓ Database is up to date")
+        return
+
+    for migration, steps in pending:
+        print(f"Migration {migration.version}: {migration.name}")
+        for description, status in steps:
+            print(f"  {description}  [{status}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Apply pending schema migrations to the database"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=migrations.MIGRATION_BATCH_SIZE,
+        help="Rows updated per transaction by backfills (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pause",
+        type=float,
+        default=migrations.MIGRATION_PAUSE,
+        metavar="SECONDS",
+        help="Sleep between backfill batches to limit load (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--to",
+        type=int,
+        default=None,
+        metavar="VERSION",
+        help="Stop after this migration (default: apply all)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show the pending migrations and their steps without applying them",
+    )
+
+    args = parser.parse_args()
 
     print("=" * 60)
     print("Database Migration Script")
     print("=" * 60)
+    print(f"Started at: {time.strftime('%Y-%m-%d %H:%M:%S')}")
     print()
 
-    # Connect to database
-    conn = sqlite3.connect("clipboard.db")
-    cursor = conn.cursor()
-
-    try:
-        # Check if column already exists
-        cursor.execute("PRAGMA table_info(clipboards)")
-        columns = [column[1] for column in cursor.fetchall()]
-
-        if "last_accessed" in columns:
-            print("✓ Column 'last_accessed' already exists")
-            print("  No migration needed!")
-        else:
-            print("Adding 'last_accessed' column to clipboards table...")
-
-            # Add the column
-            cursor.execute("""
-                ALTER TABLE clipboards
-                ADD COLUMN last_accessed DATETIME
-            """)
-
-            # Update existing clipboards with current timestamp
-            current_time = datetime.utcnow().isoformat()
-            cursor.execute(
-                """
-                UPDATE clipboards
-                SET last_accessed = ?
-                WHERE last_accessed IS NULL
-            """,
-                (current_time,),
-            )
-
-            rows_updated = cursor.rowcount
-
-            conn.commit()
-
-            print(f"✓ Column added successfully")
-            print(f"✓ Updated {rows_updated} existing clipboard(s)")
+    context = migrations.Context(
+        database.engine, batch_size=args.batch_size, pause=args.pause
+    )
 
+    if args.dry_run:
+        print("DRY RUN MODE - No changes will be made")
         print()
-        print("=" * 60)
-        print("Migration Complete!")
-        print("=" * 60)
+        print_plan(context, args.to)
+        return
 
+    # Creates missing tables, schema_migrations among them
+    database.init_db()
+    started = time.monotonic()
+    try:
+        applied = migrations.migrate(context, args.to)
+    except migrations.MigrationError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
     except Exception as e:
-        print(f"✗ Migration failed: {str(e)}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+        print(f"✗ Migration failed: {e}")
+        print("  Completed migrations are recorded; rerun to resume.")
+        sys.exit(1)
 
-    return True
+    # Records the schema as current, once nothing is pending anymore
+    database.init_db()
+
+    print()
+    print("=" * 60)
+    if applied:
+        print(
+            f"Migration Complete! Applied {len(applied)} migration(s) "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+    else:
+        print("Database is already up to date")
+    print("=" * 60)
 
 
 if __name__ == "__main__":
-    migrate()
+    main()
@@ -0,0 +1,172 @@
+"""
+Re-encode stored card content with the current compression settings.
+
+Card content is compressed transparently on write, but rows written before
+that (or under a different STORAGE_COMPRESSION_THRESHOLD) keep their old
+encoding until they change. This script walks the card blobs and the legacy
+content of cards in batches, one transaction per batch, and rewrites only
+the rows whose encoding would change. It can be stopped and rerun at any
+time.
+
+Usage:
+    python recompress_cards.py                 # Compress per current settings
+    python recompress_cards.py --dry-run       # Report what would change
+    python recompress_cards.py --decompress    # Store everything uncompressed
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, column, select, table, update
+
+from app import database
+from app.compression import compress_text, decompress_text, is_compressed
+
+# Tables holding card content, keyed by their first column, with content
+# typed as plain text to see stored values
+RAW_TABLES = [
+    table("card_blobs", column("hash"), column("content")),
+    table("cards", column("id"), column("content")),
+]
+
+
+def recompress(db, raw_table, threshold, level, batch_size, dry_run=False, pause=0.0):
+    """
+    Re-encode the content of one table. Returns the number of rows scanned,
+    rewritten and compressed afterwards, and the bytes saved.
+    """
+    key, content = raw_table.c
+    scanned = rewritten = compressed = saved = 0
+    last_key = None
+
+    while True:
+        query = select(key, content).order_by(key).limit(batch_size)
+        if last_key is not None:
+            query = query.where(key > last_key)
+        rows = db.execute(query).all()
+        if not rows:
+            break
+
+        changed = []
+        for row_key, stored in rows:
+            if stored is None:
+                continue
+            encoded = compress_text(decompress_text(stored), threshold, level)
+            compressed += is_compressed(encoded)
+            if encoded != stored:
+                changed.append({"row_key": row_key, "encoded": encoded})
+                saved += len(stored.encode("utf-8")) - len(encoded.encode("utf-8"))
+
+        if changed and not dry_run:
+            # Touches content only: updated_at and card versions are unchanged
+            db.execute(
+                update(raw_table)
+                .where(key == bindparam("row_key"))
+                .values(content=bindparam("encoded")),
+                changed,
+            )
+            db.commit()
+
+        scanned += len(rows)
+        rewritten += len(changed)
+        last_key = rows[-1][0]
+        print(f"  ... {raw_table.name}: {rewritten} of {scanned} rewritten")
+
+        if pause:
+            time.sleep(pause)
+
+    return scanned, rewritten, compressed, saved
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-encode stored card content with the compression settings"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=database.STORAGE_COMPRESSION_THRESHOLD,
+        help="Compress content of at least this many bytes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--level",
+        type=int,
+        default=database.STORAGE_COMPRESSION_LEVEL,
+        help="zlib compression level (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--decompress",
+        action="store_true",
+        help="Store all content uncompressed, e.g. before a downgrade",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Rows rewritten per transaction (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pause",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Sleep between batches to limit load (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show what would change without writing",
+    )
+
+    args = parser.parse_args()
+    threshold = -1 if args.decompress else args.threshold
+
+    database.init_db()
+    db = database.SessionLocal()
+
+    try:
+        print("=" * 60)
+        print("Shared Clipboard - Recompress Cards")
+        print("=" * 60)
+        print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print()
+
+        if args.dry_run:
+            print("DRY RUN MODE - No rows will be written")
+            print()
+
+        results = {}
+        for raw_table in RAW_TABLES:
+            print(f"Re-encoding {raw_table.name}...")
+            results[raw_table.name] = recompress(
+                db,
+                raw_table,
+                threshold,
+                args.level,
+                args.batch_size,
+                args.dry_run,
+                args.pause,
+            )
+            print()
+
+        print("=" * 60)
+        verb = "would rewrite" if args.dry_run else "rewrote"
+        for name, (scanned, rewritten, compressed, saved) in results.items():
+            print(
+                f"{name}: {verb} {rewritten} of {scanned} row(s), "
+                f"{saved:+d} bytes saved, {compressed} compressed afterwards"
+            )
+        print(f"Finished at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
+
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Fill the full-text search index with the cards of existing clipboards.
+
+Cards written since search was added are indexed as they are written; run
+this once after upgrading, or whenever the index should be rebuilt. Works
+in batches of cards in ID order, one transaction per batch; pass --after
+to resume after the last card ID it printed.
+
+Usage:
+    python reindex_search.py                 # Index every card
+    python reindex_search.py --dry-run       # Compare card and index counts
+    python reindex_search.py --after 120000 --batch-size 200
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from app import database, search
+
+
+def reindex(db, batch_size, after=0, pause=0.0):
+    """(Re)index cards with IDs above `after`; returns the number indexed"""
+    indexed = 0
+
+    while True:
+        cards = db.scalars(
+            select(database.Card)
+            .where(database.Card.id > after)
+            .order_by(database.Card.id)
+            .limit(batch_size)
+        ).all()
+        if not cards:
+            break
+
+        search.index_cards(
+            db, [(card.id, card.clipboard_id, card.content) for card in cards]
+        )
+        after = cards[-1].id
+        db.commit()
+        db.expunge_all()
+
+        indexed += len(cards)
+        print(f"  ... indexed {indexed} card(s), up to card {after}")
+
+        if pause:
+            time.sleep(pause)
+
+    return indexed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fill the full-text search index with existing cards"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Cards indexed per transaction (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--after",
+        type=int,
+        default=0,
+        metavar="CARD_ID",
+        help="Only index cards with a higher ID, to resume a run",
+    )
+    parser.add_argument(
+        "--pause",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Sleep between batches to limit load (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only compare the number of cards with the number indexed",
+    )
+
+    args = parser.parse_args()
+
+    database.init_db()
+    db = database.SessionLocal()
+
+    try:
+        print("=" * 60)
+        print("Shared Clipboard - Rebuild Search Index")
+        print("=" * 60)
+        print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print()
+
+        if search.count_indexed(db) is None:
+            print("Search is not available on this database")
+            sys.exit(1)
+
+        if not args.dry_run:
+            indexed = reindex(db, args.batch_size, args.after, args.pause)
+            print()
+            print(f"Indexed {indexed} card(s)")
+
+        cards = db.scalar(select(func.count()).select_from(database.Card))
+        print(f"Cards: {cards}, indexed: {search.count_indexed(db)}")
+        print(f"Finished at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
+
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """
 Startup script for the Shared Clipboard API server.
-This script starts the uvicorn server with the FastAPI application.
+This script starts the uvicorn server with the FastAPI application, reloading
+on code changes; use serve.py in production.
 """
 
 import uvicorn
@@ -0,0 +1,302 @@
+"""
+Production launcher for the Shared Clipboard API.
+
+Imports the application once in a supervisor process, which creates the
+database schema, and forks the workers from it: they start without
+repeating that work and share the loaded code copy-on-write. Workers run
+uvicorn with uvloop and httptools when those are installed, all accepting
+on one listening socket.
+
+- SIGTERM or SIGINT drains the workers: they stop accepting connections,
+  finish their in-flight requests (for up to --graceful-timeout seconds)
+  and dispose of their connection pools before exiting.
+- A worker exits after serving --max-requests requests (plus a random
+  jitter, so that workers don't all restart at once); the supervisor
+  replaces it, as it does workers that crash.
+- SIGHUP replaces all workers one by one. They fork from the supervisor,
+  so code changes need a full restart.
+- The cleanup scheduler, when enabled, runs in a single worker; its
+  replacement takes it over.
+
+- With several workers, the default in-memory response cache is turned
+  off: a write would only invalidate it in one worker. CACHE_BACKEND=redis
+  shares it instead.
+
+Other state stays per worker: event streams only see the changes handled
+by their own worker, and /metrics, /admin/metrics and /admin/profiles
+describe the worker that answers. A warning is logged when several
+workers are started.
+
+Requires a platform with fork() (Linux, macOS). For development, use
+run.py, which reloads on code changes.
+
+Usage:
+    python serve.py                          # One worker per CPU on port 8000
+    python serve.py --workers 4 --port 8080
+    python serve.py --max-requests 0         # Never recycle workers
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import signal
+import sys
+import time
+
+import uvicorn
+
+logger = logging.getLogger("uvicorn.error")
+
+# A worker dying sooner than this after its start is restarted with a delay
+MIN_WORKER_LIFETIME = 1.0
+
+
+def _available(module, preferred, fallback):
+    return preferred if importlib.util.find_spec(module) else fallback
+
+
+class Supervisor:
+    """Forks the workers, replaces those that exit, and stops them on a signal"""
+
+    def __init__(self, config, sockets, workers, max_requests, max_requests_jitter):
+        self.config = config
+        self.sockets = sockets
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        # pid -> start time
+        self.processes = {}
+        # The worker running the cleanup scheduler
+        self.scheduler_pid = None
+        self.should_exit = False
+        self.should_reload = False
+
+    def spawn(self):
+        limit = None
+        if self.max_requests > 0:
+            limit = self.max_requests + random.randint(0, self.max_requests_jitter)
+
+        runs_scheduler = self.scheduler_pid is None
+        pid = os.fork()
+        if pid:
+            self.processes[pid] = time.monotonic()
+            if runs_scheduler:
+                self.scheduler_pid = pid
+            return pid
+
+        # Worker: uvicorn installs its own SIGINT and SIGTERM handlers
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        if not runs_scheduler:
+            from app.scheduler import scheduler
+
+            scheduler.enabled = False
+        status = 1
+        try:
+            self.config.limit_max_requests = limit
+            uvicorn.Server(self.config).run(sockets=self.sockets)
+            status = 0
+        except SystemExit as e:
+            # uvicorn exits this way when the application fails to start
+            status = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            logger.exception("Worker %d failed", os.getpid())
+        finally:
+            os._exit(status)
+
+    def handle_exit(self, sig, frame):
+        self.should_exit = True
+
+    def handle_reload(self, sig, frame):
+        self.should_reload = True
+
+    def reap(self):
+        """Collect exited workers; returns how many died young"""
+        died_young = 0
+        while self.processes:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            started = self.processes.pop(pid, None)
+            if started is None:
+                continue
+            if pid == self.scheduler_pid:
+                self.scheduler_pid = None
+            if os.WIFSIGNALED(status):
+                signum = os.WTERMSIG(status)
+                logger.warning("Worker %d killed by signal %d", pid, signum)
+            elif os.WEXITSTATUS(status) != 0:
+                logger.warning(
+                    "Worker %d exited with status %d", pid, os.WEXITSTATUS(status)
+                )
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                died_young += 1
+        return died_young
+
+    def reload(self):
+        """Replace the workers one at a time, keeping the others serving"""
+        logger.info("Replacing %d worker(s)", len(self.processes))
+        for pid in list(self.processes):
+            # The scheduler waits an interval before its first run, by which
+            # time the old worker has stopped its own
+            if pid == self.scheduler_pid:
+                self.scheduler_pid = None
+            self.spawn()
+            self.stop_worker(pid)
+
+    def stop_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def stop(self, timeout):
+        """Ask every worker to drain, and kill those still running at `timeout`"""
+        logger.info("Stopping %d worker(s)", len(self.processes))
+        for pid in self.processes:
+            self.stop_worker(pid)
+
+        deadline = time.monotonic() + timeout
+        while self.processes and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for pid in self.processes:
+            logger.warning("Worker %d did not stop in time; killing it", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.processes.clear()
+
+    def run(self, graceful_timeout):
+        signal.signal(signal.SIGTERM, self.handle_exit)
+        signal.signal(signal.SIGINT, self.handle_exit)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+
+        for _ in range(self.workers):
+            self.spawn()
+        logger.info("Started %d worker(s), supervisor %d", self.workers, os.getpid())
+
+        while not self.should_exit:
+            if self.should_reload:
+                self.should_reload = False
+                self.reload()
+            if self.reap():
+                # Don't respawn in a tight loop when workers crash on startup
+                time.sleep(MIN_WORKER_LIFETIME)
+            while len(self.processes) < self.workers and not self.should_exit:
+                self.spawn()
+            time.sleep(0.5)
+
+        # Leave time for the requests to drain, then for pool disposal
+        self.stop(graceful_timeout + 5)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the Shared Clipboard API with several worker processes"
+    )
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        help="Worker processes (default: WEB_CONCURRENCY or the CPU count)",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=10000,
+        help="Requests after which a worker is replaced; 0 disables it "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-requests-jitter",
+        type=int,
+        default=1000,
+        help="Random extra requests added to each worker's limit "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=30,
+        metavar="SECONDS",
+        help="How long in-flight requests may take to finish on shutdown "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=5,
+        metavar="SECONDS",
+        help="Idle keep-alive connection timeout (default: %(default)s)",
+    )
+    parser.add_argument("--log-level", default="info")
+
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        print("ERROR: serve.py needs fork(); use `uvicorn app.main:app` instead")
+        sys.exit(1)
+
+    # Preload the app, and create the schema once, here
+    from app import database
+    from app.cache import response_cache
+    from app.main import app
+
+    database.ensure_schema()
+    # Workers must not share the supervisor's connections
+    database.dispose_engine()
+
+    config = uvicorn.Config(
+        app,
+        host=args.host,
+        port=args.port,
+        loop=_available("uvloop", "uvloop", "asyncio"),
+        http=_available("httptools", "httptools", "h11"),
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+    )
+    sockets = [config.bind_socket()]
+
+    # After uvicorn.Config, which sets up logging
+    if args.workers > 1:
+        logger.warning(
+            "Running %d workers: event streams only receive changes handled by "
+            "their own worker, and /metrics, /admin/metrics and /admin/profiles "
+            "report the worker that answers. Use --workers 1 if that matters.",
+            args.workers,
+        )
+        # A write only invalidates the cache of the worker handling it; the
+        # others would serve the old body and ETag until the entry expires
+        if response_cache.enabled and response_cache.backend.name == "memory":
+            if "CACHE_BACKEND" in os.environ:
+                logger.warning(
+                    "CACHE_BACKEND=memory with %d workers: clients may get "
+                    "outdated clipboards for up to CACHE_TTL seconds after a write. "
+                    "Use CACHE_BACKEND=redis or none.",
+                    args.workers,
+                )
+            else:
+                response_cache.backend = None
+                logger.warning(
+                    "Response cache disabled: the default in-memory cache isn't "
+                    "shared between workers. Set CACHE_BACKEND=redis to cache."
+                )
+
+    supervisor = Supervisor(
+        config,
+        sockets,
+        max(args.workers, 1),
+        args.max_requests,
+        args.max_requests_jitter,
+    )
+    supervisor.run(args.graceful_timeout)
+    logger.info("Supervisor %d stopped", os.getpid())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import { Link, Clock, Loader2, Plus, Trash2, RefreshCw } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { useToast } from '@/hooks/use-toast';
-import { api, Clipboard, Card } from '@/lib/api';
+import {
+  api,
+  applyCardChanges,
+  applyClipboardEvent,
+  CardConflictError,
+  Clipboard,
+  Card,
+  mergeText,
+} from '@/lib/api';
 import { CardItem } from './CardItem';
 import {
   AlertDialog,
@@ -38,6 +46,11 @@ export function ClipboardEditor({ clipboardId }: ClipboardEditorProps) {
     return randomName;
   });
   const { toast } = useToast();
+  const clipboardRef = useRef<Clipboard | null>(null);
+
+  useEffect(() => {
+    clipboardRef.current = clipboard;
+  }, [clipboard]);
 
   // Fetch clipboard content
   const fetchClipboard = useCallback(async (showRefreshing = false) => {
@@ -48,6 +61,17 @@ export function ClipboardEditor({ clipboardId }: ClipboardEditorProps) {
         setIsLoading(true);
       }
       setError(null);
+
+      // Once loaded, pull only what changed since our version
+      const current = clipboardRef.current;
+      if (current && current.id === clipboardId) {
+        const delta = await api.getChanges(clipboardId, current.version);
+        if (!delta.reset) {
+          setClipboard(prev => prev ? applyCardChanges(prev, delta) : prev);
+          return;
+        }
+      }
+
       const data = await api.getClipboard(clipboardId);
       setClipboard(data);
     } catch (err) {
@@ -62,6 +86,21 @@ export function ClipboardEditor({ clipboardId }: ClipboardEditorProps) {
     fetchClipboard();
   }, [fetchClipboard]);
 
+  // Apply other users' edits as they happen instead of polling
+  useEffect(() => {
+    return api.subscribeClipboard(clipboardId, (event) => {
+      if (event.type === 'resync') {
+        fetchClipboard(true);
+        return;
+      }
+      if (event.type === 'clipboard.deleted') {
+        setError('Clipboard not found');
+        return;
+      }
+      setClipboard(prev => prev ? applyClipboardEvent(prev, event) : prev);
+    });
+  }, [clipboardId, fetchClipboard]);
+
 
   // Add new card
   const handleAddCard = async () => {
@@ -80,10 +119,7 @@ export function ClipboardEditor({ clipboardId }: ClipboardEditorProps) {
         content: newCardContent,
         user_name: userName || undefined,
       });
-      setClipboard(prev => prev ? {
-        ...prev,
-        cards: [...prev.cards, card],
-      } : null);
+      setClipboard(prev => prev ? applyClipboardEvent(prev, { type: 'card.created', card }) : null);
       setNewCardContent('');
       toast({
         title: 'Card added',
@@ -102,7 +138,33 @@ export function ClipboardEditor({ clipboardId }: ClipboardEditorProps) {
 
   // Update card
   const handleUpdateCard = async (cardId: number, content: string) => {
-    const updatedCard = await api.updateCard(cardId, { content });
+    // From the ref: CardItem's debounced save may call an older closure
+    const card = clipboardRef.current?.cards.find(c => c.id === cardId);
+    let updatedCard: Card;
+    if (!card) {
+      updatedCard = await api.updateCard(cardId, { content });
+    } else {
+      try {
+        updatedCard = await api.patchCard(card, content);
+      } catch (err) {
+        if (!(err instanceof CardConflictError)) throw err;
+        // Saved elsewhere meanwhile: keep both edits if they don't overlap,
+        // otherwise show the other version and report the conflict
+        const latest = (await api.getClipboard(clipboardId)).cards.find(c => c.id === cardId);
+        if (!latest) throw new Error('Card not found');
+        const merged = mergeText(card.content, content, latest.content);
+        if (merged === null) {
+          setClipboard(prev => prev ? {
+            ...prev,
+            cards: prev.cards.map(c => c.id === cardId ? latest : c),
+          } : null);
+          throw new CardConflictError(
+            'Someone else edited the same text; the card was reloaded and your change was not saved'
+          );
+        }
+        updatedCard = await api.patchCard(latest, merged);
+      }
+    }
     setClipboard(prev => prev ? {
       ...prev,
       cards: prev.cards.map(c => c.id === cardId ? updatedCard : c),
@@ -6,6 +6,7 @@ export interface Card {
   clipboard_id: string;
   content: string;
   user_name: string | null;
+  version: number;
   created_at: string;
   updated_at: string;
 }
@@ -14,6 +15,7 @@ export interface Clipboard {
   id: string;
   created_at: string;
   updated_at: string;
+  version: number;
   cards: Card[];
 }
 
@@ -26,12 +28,222 @@ export interface UpdateCardRequest {
   content: string;
 }
 
+// Positive numbers retain, negative numbers delete, strings insert
+export type TextDeltaOp = number | string;
+
+export interface PatchCardRequest {
+  base_version: number;
+  ops: TextDeltaOp[];
+}
+
+export type CardOperation =
+  | { op: 'create'; content: string; user_name?: string }
+  | { op: 'update'; card_id: number; content: string }
+  | { op: 'delete'; card_id: number };
+
+export interface CardOperationResult {
+  index: number;
+  op: CardOperation['op'];
+  status: number;
+  card_id: number | null;
+  card: Card | null;
+  detail: string | null;
+}
+
+export interface CardBatchResult {
+  clipboard_id: string;
+  version: number;
+  results: CardOperationResult[];
+}
+
+export interface Attachment {
+  id: number;
+  card_id: number;
+  clipboard_id: string;
+  filename: string;
+  content_type: string;
+  size: number;
+  sha256: string;
+  created_at: string;
+}
+
 export interface ApiError {
   detail: string;
 }
 
+export interface CardPage {
+  cards: Card[];
+  next_cursor: string | null;
+}
+
+export interface ClipboardPage extends Clipboard {
+  next_cursor: string | null;
+}
+
+export interface CardSearchResult {
+  card_id: number;
+  user_name: string | null;
+  version: number;
+  created_at: string;
+  updated_at: string;
+  // HTML-escaped card text around the matches, which are wrapped in
+  // <mark></mark>
+  snippet: string;
+  score: number;
+}
+
+export interface CardSearchResults {
+  clipboard_id: string;
+  query: string;
+  results: CardSearchResult[];
+  next_offset: number | null;
+}
+
+export interface CardChange {
+  seq: number;
+  op: 'created' | 'updated' | 'deleted';
+  card_id: number;
+  card: Card | null;
+}
+
+export interface ClipboardChanges {
+  clipboard_id: string;
+  version: number;
+  reset: boolean;
+  changes: CardChange[];
+}
+
+export type ClipboardEvent =
+  | { type: 'card.created'; card: Card; version?: number }
+  | { type: 'card.updated'; card: Card; version?: number }
+  | { type: 'card.deleted'; card_id: number; clipboard_id: string; version?: number }
+  | { type: 'clipboard.deleted'; clipboard_id: string }
+  | { type: 'resync'; clipboard_id: string };
+
+const CLIPBOARD_EVENT_TYPES: ClipboardEvent['type'][] = [
+  'card.created',
+  'card.updated',
+  'card.deleted',
+  'clipboard.deleted',
+  'resync',
+];
+
+function upsertCard(cards: Card[], card: Card): Card[] {
+  return cards.some(c => c.id === card.id)
+    ? cards.map(c => c.id === card.id ? card : c)
+    : [...cards, card];
+}
+
+// Only advance the known version when no change was missed in between
+function nextVersion(clipboard: Clipboard, version?: number): number {
+  return version === clipboard.version + 1 ? version : clipboard.version;
+}
+
+// Apply a streamed change to a local clipboard copy instead of refetching it
+export function applyClipboardEvent(clipboard: Clipboard, event: ClipboardEvent): Clipboard {
+  switch (event.type) {
+    case 'card.created':
+    case 'card.updated':
+      return {
+        ...clipboard,
+        version: nextVersion(clipboard, event.version),
+        cards: upsertCard(clipboard.cards, event.card),
+      };
+    case 'card.deleted':
+      return {
+        ...clipboard,
+        version: nextVersion(clipboard, event.version),
+        cards: clipboard.cards.filter(c => c.id !== event.card_id),
+      };
+    default:
+      return clipboard;
+  }
+}
+
+// Apply the result of getChanges to a local clipboard copy
+export function applyCardChanges(clipboard: Clipboard, delta: ClipboardChanges): Clipboard {
+  let cards = clipboard.cards;
+  for (const change of delta.changes) {
+    cards = change.card
+      ? upsertCard(cards, change.card)
+      : cards.filter(c => c.id !== change.card_id);
+  }
+  return { ...clipboard, version: Math.max(clipboard.version, delta.version), cards };
+}
+
+interface TextSpan {
+  start: number;
+  end: number;
+  inserted: string;
+}
+
+// The one span of `before` (code points) that was replaced to get `after`
+function changedSpan(before: string[], after: string[]): TextSpan {
+  const shorter = Math.min(before.length, after.length);
+
+  let prefix = 0;
+  while (prefix < shorter && before[prefix] === after[prefix]) prefix++;
+
+  let suffix = 0;
+  while (
+    suffix < shorter - prefix &&
+    before[before.length - 1 - suffix] === after[after.length - 1 - suffix]
+  ) suffix++;
+
+  return {
+    start: prefix,
+    end: before.length - suffix,
+    inserted: after.slice(prefix, after.length - suffix).join(''),
+  };
+}
+
+// Delta turning `before` into `after` as one replaced span, counted in code
+// points like the server
+export function computeTextDelta(before: string, after: string): TextDeltaOp[] {
+  const from = Array.from(before);
+  const span = changedSpan(from, Array.from(after));
+
+  const ops: TextDeltaOp[] = [];
+  const removed = span.end - span.start;
+  if (span.start) ops.push(span.start);
+  if (removed) ops.push(-removed);
+  if (span.inserted) ops.push(span.inserted);
+  return ops;
+}
+
+// Three-way merge of two edits of `base`; null when they overlap or adjoin
+// in the text
+export function mergeText(base: string, ours: string, theirs: string): string | null {
+  if (ours === theirs || theirs === base) return ours;
+  if (ours === base) return theirs;
+
+  const from = Array.from(base);
+  const a = changedSpan(from, Array.from(ours));
+  const b = changedSpan(from, Array.from(theirs));
+  const [first, second] = a.start <= b.start ? [a, b] : [b, a];
+  if (first.end >= second.start) return null;
+
+  return (
+    from.slice(0, first.start).join('') +
+    first.inserted +
+    from.slice(first.end, second.start).join('') +
+    second.inserted +
+    from.slice(second.end).join('')
+  );
+}
+
+// A PATCH was based on a card version that is no longer current
+export class CardConflictError extends Error {
+  constructor(message = 'Card was changed elsewhere; reload to get the latest version') {
+    super(message);
+    this.name = 'CardConflictError';
+  }
+}
+
 class ApiClient {
   private baseUrl: string;
+  // Last clipboard body per ID, revalidated with If-None-Match
+  private clipboardCache = new Map<string, { etag: string; data: Clipboard }>();
 
   constructor(baseUrl: string) {
     this.baseUrl = baseUrl;
@@ -57,11 +269,19 @@ class ApiClient {
 
   async getClipboard(clipboardId: string): Promise<Clipboard> {
     console.log('Fetching clipboard:', clipboardId);
+    const cached = this.clipboardCache.get(clipboardId);
     const response = await fetch(`${this.baseUrl}/clipboard/${clipboardId}`, {
+      headers: cached ? { 'If-None-Match': cached.etag } : {},
+      cache: 'no-store',
       mode: 'cors',
     });
 
+    if (response.status === 304 && cached) {
+      return cached.data;
+    }
+
     if (!response.ok) {
+      this.clipboardCache.delete(clipboardId);
       console.error('Get clipboard failed:', response.status, response.statusText);
       if (response.status === 404) {
         throw new Error('Clipboard not found');
@@ -69,12 +289,97 @@ class ApiClient {
       throw new Error('Failed to fetch clipboard');
     }
 
-    const data = await response.json();
+    const data: Clipboard = await response.json();
     console.log('Get clipboard response:', data);
+    const etag = response.headers.get('ETag');
+    if (etag) {
+      this.clipboardCache.set(clipboardId, { etag, data });
+    }
     return data;
   }
 
+  // Clipboard with only its first page of cards; continue with getCards
+  async getClipboardPage(clipboardId: string, limit = 50): Promise<ClipboardPage> {
+    const response = await fetch(
+      `${this.baseUrl}/clipboard/${clipboardId}/paged?limit=${limit}`,
+      { mode: 'cors' },
+    );
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Clipboard not found');
+      }
+      throw new Error('Failed to fetch clipboard');
+    }
+
+    return response.json();
+  }
+
+  async getCards(clipboardId: string, after?: string | null, limit = 50): Promise<CardPage> {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (after) {
+      params.set('after', after);
+    }
+    const response = await fetch(
+      `${this.baseUrl}/clipboard/${clipboardId}/cards?${params}`,
+      { mode: 'cors' },
+    );
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Clipboard not found');
+      }
+      throw new Error('Failed to fetch cards');
+    }
+
+    return response.json();
+  }
+
+  // Full-text search; fetch further pages with offset = next_offset
+  async searchCards(
+    clipboardId: string,
+    query: string,
+    offset = 0,
+    limit = 20,
+  ): Promise<CardSearchResults> {
+    const params = new URLSearchParams({
+      q: query,
+      limit: String(limit),
+      offset: String(offset),
+    });
+    const response = await fetch(
+      `${this.baseUrl}/clipboard/${clipboardId}/search?${params}`,
+      { mode: 'cors' },
+    );
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Clipboard not found');
+      }
+      throw new Error('Failed to search cards');
+    }
+
+    return response.json();
+  }
+
+  async getChanges(clipboardId: string, since: number): Promise<ClipboardChanges> {
+    const response = await fetch(
+      `${this.baseUrl}/clipboard/${clipboardId}/changes?since=${since}`,
+      { mode: 'cors' },
+    );
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Clipboard not found');
+      }
+      throw new Error('Failed to fetch clipboard changes');
+    }
+
+    return response.json();
+  }
+
   async deleteClipboard(clipboardId: string): Promise<void> {
+    this.clipboardCache.delete(clipboardId);
     const response = await fetch(`${this.baseUrl}/clipboard/${clipboardId}`, {
       method: 'DELETE',
       mode: 'cors',
@@ -108,6 +413,27 @@ class ApiClient {
     return response.json();
   }
 
+  // Apply many card operations in one request and one transaction
+  async batch(clipboardId: string, operations: CardOperation[]): Promise<CardBatchResult> {
+    const response = await fetch(`${this.baseUrl}/clipboard/${clipboardId}/cards:batch`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ operations }),
+      mode: 'cors',
+    });
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Clipboard not found');
+      }
+      throw new Error('Failed to apply card changes');
+    }
+
+    return response.json();
+  }
+
   async updateCard(cardId: number, data: UpdateCardRequest): Promise<Card> {
     const response = await fetch(`${this.baseUrl}/cards/${cardId}`, {
       method: 'PUT',
@@ -128,6 +454,36 @@ class ApiClient {
     return response.json();
   }
 
+  // Save new content by sending only what changed since `card` was loaded
+  async patchCard(card: Card, content: string): Promise<Card> {
+    const ops = computeTextDelta(card.content, content);
+    if (ops.length === 0) {
+      return card;
+    }
+
+    const body: PatchCardRequest = { base_version: card.version, ops };
+    const response = await fetch(`${this.baseUrl}/cards/${card.id}`, {
+      method: 'PATCH',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(body),
+      mode: 'cors',
+    });
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Card not found');
+      }
+      if (response.status === 409) {
+        throw new CardConflictError();
+      }
+      throw new Error('Failed to update card');
+    }
+
+    return response.json();
+  }
+
   async deleteCard(cardId: number): Promise<void> {
     const response = await fetch(`${this.baseUrl}/cards/${cardId}`, {
       method: 'DELETE',
@@ -142,6 +498,90 @@ class ApiClient {
     }
   }
 
+  // Upload a file as the raw request body; the browser streams it from disk
+  async uploadAttachment(cardId: number, file: File): Promise<Attachment> {
+    const params = new URLSearchParams({ filename: file.name });
+    const response = await fetch(`${this.baseUrl}/cards/${cardId}/attachments?${params}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': file.type || 'application/octet-stream',
+      },
+      body: file,
+      mode: 'cors',
+    });
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Card not found');
+      }
+      if (response.status === 413) {
+        throw new Error('File is too large');
+      }
+      throw new Error('Failed to upload attachment');
+    }
+
+    return response.json();
+  }
+
+  async getAttachments(cardId: number): Promise<Attachment[]> {
+    const response = await fetch(`${this.baseUrl}/cards/${cardId}/attachments`, {
+      method: 'GET',
+      mode: 'cors',
+    });
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Card not found');
+      }
+      throw new Error('Failed to fetch attachments');
+    }
+
+    return response.json();
+  }
+
+  // Download link; the server supports Range requests for resuming
+  attachmentUrl(attachmentId: number): string {
+    return `${this.baseUrl}/attachments/${attachmentId}`;
+  }
+
+  async deleteAttachment(attachmentId: number): Promise<void> {
+    const response = await fetch(`${this.baseUrl}/attachments/${attachmentId}`, {
+      method: 'DELETE',
+      mode: 'cors',
+    });
+
+    if (!response.ok) {
+      if (response.status === 404) {
+        throw new Error('Attachment not found');
+      }
+      throw new Error('Failed to delete attachment');
+    }
+  }
+
+  // Listen for live card changes; returns a function that closes the stream
+  subscribeClipboard(
+    clipboardId: string,
+    onEvent: (event: ClipboardEvent) => void,
+    onError?: (error: Event) => void,
+  ): () => void {
+    const source = new EventSource(`${this.baseUrl}/clipboard/${clipboardId}/stream`);
+
+    CLIPBOARD_EVENT_TYPES.forEach(type => {
+      source.addEventListener(type, (message) => {
+        onEvent(JSON.parse((message as MessageEvent).data) as ClipboardEvent);
+        if (type === 'clipboard.deleted') {
+          source.close();
+        }
+      });
+    });
+
+    if (onError) {
+      source.onerror = onError;
+    }
+
+    return () => source.close();
+  }
+
   async checkHealth(): Promise<boolean> {
     try {
       const response = await fetch(`${this.baseUrl}/health`, { mode: 'cors' });